@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+#
+# Test cases for tournament_async.py
+
+import asyncio
+import os
+import tempfile
+
+from tournament_async import *
+from tournament_exception import TournamentException
+
+
+async def testRegisterCountDelete():
+    await deleteMatches(1)
+    await deletePlayers(1)
+    await registerPlayer("Markov Chaney")
+    await registerPlayers(["Joe Malik", "Mao Tsu-hsi", "Atlanta Hope"])
+    c = await countPlayers()
+    if c != 4:
+        raise ValueError(
+            "After registering four players, countPlayers should be 4.")
+    await deletePlayers()
+    c = await countPlayers()
+    if c != 0:
+        raise ValueError("After deleting, countPlayers should return zero.")
+    print("1. Players can be registered and deleted.")
+
+
+async def testReportMatchesAndPairings():
+    await deleteMatches(1)
+    await deletePlayers(1)
+    await registerPlayers(["Twilight Sparkle", "Fluttershy", "Applejack", "Pinkie Pie"])
+    standings = await playerStandings()
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    await reportMatch(id1, id2)
+    await reportMatches([(id3, id4, False)])
+    standings = await playerStandings()
+    for (i, n, w, m) in standings:
+        if m != 1:
+            raise ValueError("Each player should have one match recorded.")
+        if i in (id1, id3) and w != 1:
+            raise ValueError("Each match winner should have one win recorded.")
+    pairings = await swissPairings()
+    correct_pairs = set([frozenset([id1, id3]), frozenset([id2, id4])])
+    actual_pairs = set(frozenset([pid1, pid2]) for (pid1, _, pid2, _) in pairings)
+    if correct_pairs != actual_pairs:
+        raise ValueError(
+            "After one match, players with one win should be paired.")
+    print("2. After one match, players with one win are paired.")
+
+
+async def testNoRepeatMatches():
+    await deleteMatches(1)
+    await deletePlayers(1)
+    [id1, id2] = await registerPlayers(["Flynn Taggart", "B.J. Blackowicz"])
+    await reportMatch(id1, id2)
+    try:
+        await reportMatch(id2, id1)
+    except TournamentException:
+        print("3. Players cannot play each other more than once.")
+    else:
+        raise ValueError(
+            "Players should not be able to play each other more than once.")
+
+
+async def testSessionRollsBackOnError():
+    await deleteMatches(1)
+    await deletePlayers(1)
+    [id1, id2] = await registerPlayers(["Flynn Taggart", "B.J. Blackowicz"])
+    try:
+        async with AsyncTournamentSession() as session:
+            await session.registerPlayer("Commander Keen")
+            await session.reportMatch(id1, id2)
+            await session.reportMatch(id2, id1)
+    except TournamentException:
+        pass
+    if await countPlayers() != 2:
+        raise ValueError("A session that raises should leave no changes behind.")
+    print("4. A session commits as one unit and rolls back on error.")
+
+
+async def testConcurrentCalls():
+    await deleteMatches(1)
+    await deletePlayers(1)
+    await asyncio.gather(*[registerPlayer("Player {}".format(i)) for i in range(50)])
+    counts = await asyncio.gather(*[countPlayers() for _ in range(200)])
+    if set(counts) != set([50]):
+        raise ValueError("Concurrent calls should all see every registration.")
+    player_ids = [row[0] for row in await playerStandings()]
+    pairs = list(zip(player_ids[::2], player_ids[1::2]))
+
+    async def report(winner, loser):
+        try:
+            await reportMatch(winner, loser)
+        except TournamentException:
+            return 0
+        return 1
+
+    accepted = await asyncio.gather(*[report(a, b) for a, b in pairs] +
+                                    [report(b, a) for a, b in pairs])
+    if sum(accepted) != len(pairs) or \
+            sum(row[3] for row in await playerStandings()) != 2 * len(pairs):
+        raise ValueError("Racing reports of a pairing should record it once.")
+    print("5. Many calls can run concurrently.")
+
+
+async def testPagedAndStreamedStandings():
+    await deleteMatches(1)
+    await deletePlayers(1)
+    player_ids = await registerPlayers(["Player {}".format(i) for i in range(25)])
+    await reportMatches([(player_ids[i], player_ids[i + 1], False)
+                         for i in range(0, 24, 2)])
+    # Streamed and paged standings skip the tiebreaks.
+    standings = sorted(await playerStandings(), key=lambda row: (-row[2], row[3], row[0]))
+    streamed = [row async for row in iterStandings(1, 4)]
+    paged = []
+    page = await topStandings(1, 7)
+    while page:
+        paged.extend(page)
+        page = await topStandings(1, 7, page[-1])
+    if streamed != standings or paged != standings:
+        raise ValueError(
+            "Streamed and paged standings should match playerStandings.")
+    print("6. Standings can be streamed and paged.")
+
+
+async def testCreateAndDropTournament():
+    tournament_id = await createTournament("Async Open")
+    [id1, id2] = await registerPlayers(["Flynn Taggart", "Commander Keen"], tournament_id)
+    await reportMatch(id1, id2, tournament_id)
+    await deleteMatches(tournament_id)
+    await reportMatch(id2, id1, tournament_id)
+    if [row[0] for row in await playerStandings(tournament_id)] != [id2, id1]:
+        raise ValueError("A created tournament should keep standings like any other.")
+    await dropTournament(tournament_id)
+    if await countPlayers(tournament_id) != 0:
+        raise ValueError("A dropped tournament should have no players left.")
+    print("7. Tournaments can be created and dropped.")
+
+
+async def testExportAndImportTournament():
+    await deleteMatches(1)
+    await deletePlayers(1)
+    [id1, id2, id3] = await registerPlayers(
+        ["Flynn Taggart", "Commander Keen", "Duke Nukem"])
+    await reportMatch(id2, id3)
+    standings = await playerStandings()
+
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        await exportTournament(1, path)
+        await deletePlayers(1)
+        await importTournament(path)
+    finally:
+        os.remove(path)
+
+    if await playerStandings() != standings:
+        raise ValueError("A restored tournament should have the same standings.")
+    print("8. Tournaments can be exported and restored.")
+
+
+async def testBatchQueries():
+    await deletePlayers(1)
+    await deletePlayers(2)
+    [id1, id2] = await registerPlayers(["Flynn Taggart", "Commander Keen"], 1)
+    await registerPlayer("Duke Nukem", 2)
+    await reportMatch(id1, id2, 1)
+    if await countPlayersMany([1, 2]) != {1: 2, 2: 1}:
+        raise ValueError("countPlayersMany should count each tournament.")
+    standings = await playerStandingsMany([1, 2])
+    if standings != {1: await playerStandings(1), 2: await playerStandings(2)}:
+        raise ValueError("playerStandingsMany should match playerStandings.")
+    if await swissPairingsMany([1, 2]) != {1: await swissPairings(1), 2: []}:
+        raise ValueError("swissPairingsMany should match swissPairings.")
+    print("9. Many tournaments can be read at once.")
+
+
+async def testRatings():
+    await deleteMatches(1)
+    await deletePlayers(1)
+    [id1, id2] = await registerPlayers(["Flynn Taggart", "Commander Keen"], 1, [1400, 1600])
+    if [row[0] for row in await playerStandings(1)] != [id2, id1]:
+        raise ValueError("Players should be seeded by rating.")
+    await reportMatch(id1, id2, 1, True)
+    ratings = await playerRatings(1)
+    if not ratings[id1] > 1400 or await recomputeRatings(1) != await playerRatings(1):
+        raise ValueError("Draws should update ratings, and recomputing should store them.")
+    print("10. Players are seeded by rating, and ratings follow results.")
+
+
+async def testRounds():
+    await deleteMatches(1)
+    await deletePlayers(1)
+    player_ids = await registerPlayers(["Flynn Taggart", "Commander Keen", "Duke Nukem"], 1)
+    pairings = await startRound(1)
+    if await startRound(1) != pairings or await swissPairings(1) != pairings:
+        raise ValueError("A round in progress should keep its stored pairings.")
+    [(id1, _, id2, _)] = pairings
+    [bye] = set(player_ids) - set([id1, id2])
+    if await byeHistory(1) != {bye: 1}:
+        raise ValueError("The player left out of the round should get its bye.")
+    await reportMatch(id1, id2, 1)
+    try:
+        await reportMatch(id2, id1, 1, True)
+    except TournamentException:
+        pass
+    else:
+        raise ValueError("Only one result should be accepted per pairing.")
+
+    # Everyone has met everyone and had a bye after three rounds.
+    for _ in range(2):
+        [(id1, _, id2, _)] = await startRound(1)
+        await reportMatch(id1, id2, 1)
+    try:
+        await startRound(1)
+    except TournamentException:
+        pass
+    else:
+        raise ValueError("startRound() should refuse a round that needs a rematch.")
+    print("11. Rounds are paired once, with a bye, and results are checked against them.")
+
+
+async def testReplicaRouting():
+    await deleteMatches(1)
+    await deletePlayers(1)
+    await configureReplica(dsn=os.environ["TOURNAMENT_REPLICA_DSN"])
+    try:
+        for i in range(10):
+            await registerPlayer("Player {}".format(i), 1)
+            if await countPlayers(1) != i + 1:
+                raise ValueError("Reads should see the task's own writes.")
+        async with AsyncTournamentSession() as session:
+            await session.db_cursor.execute("SELECT pg_is_in_recovery();")
+            if (await session.db_cursor.fetchone())[0]:
+                raise ValueError("Sessions that may write should use the primary.")
+    finally:
+        await disableReplica()
+    print("12. Read-only calls go to the replica, after it has the task's writes.")
+
+
+async def main():
+    try:
+        await testRegisterCountDelete()
+        await testReportMatchesAndPairings()
+        await testNoRepeatMatches()
+        await testSessionRollsBackOnError()
+        await testConcurrentCalls()
+        await testPagedAndStreamedStandings()
+        await testCreateAndDropTournament()
+        await testExportAndImportTournament()
+        await testBatchQueries()
+        await testRatings()
+        await testRounds()
+        # Needs a streaming standby of the test database.
+        if os.environ.get("TOURNAMENT_REPLICA_DSN"):
+            await testReplicaRouting()
+    finally:
+        await closePool()
+
+    print("Success!  All tests pass!")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
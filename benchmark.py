@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+#
+# benchmark.py -- end-to-end benchmark of the tournament API
+#
+# Generates synthetic tournaments and plays them through the public API:
+# every player is registered with registerPlayer(), and each round is paired
+# with swissPairings(), reported with reportMatch() (with a configurable
+# share of draws) and followed by a playerStandings() read. Rounds of all
+# tournaments are interleaved, as when several events run side by side.
+#
+# The latency of every call is recorded, and p50/p95/p99 latency and
+# throughput for each operation are written to a JSON file. Passing an
+# earlier file with --baseline flags operations whose p95 latency got worse
+# by more than --tolerance, and exits with status 1 if there are any.
+#
+# Runs against the local PostgreSQL database by default; the benchmark
+# tournaments (IDs from --first-tournament up) are emptied before and after
+# the run.
+#
+# Usage: python benchmark.py [--players 64] [--rounds 6] [--draw-rate 0.1]
+#                            [--tournaments 4] [--output bench.json]
+#                            [--baseline old.json] [--memory]
+
+import argparse
+import json
+import platform
+import random
+import time
+
+import tournament
+from tournament_memory import MemoryBackend
+
+
+OPERATIONS = ("registerPlayer", "swissPairings", "reportMatch", "playerStandings")
+
+
+class LatencyRecorder(object):
+    """Collects the latency of every call, per operation."""
+
+    def __init__(self):
+        self.samples = dict((operation, []) for operation in OPERATIONS)
+
+    def call(self, operation, *args):
+        """Calls the named API function, timing it, and returns its result."""
+        function = getattr(tournament, operation)
+
+        start = time.time()
+        result = function(*args)
+        self.samples[operation].append(time.time() - start)
+
+        return result
+
+    def summary(self):
+        """Returns count, throughput and latency percentiles per operation."""
+        summary = {}
+        for operation, samples in self.samples.items():
+            if not samples:
+                continue
+
+            samples = sorted(samples)
+            total = sum(samples)
+            summary[operation] = {
+                'count': len(samples),
+                'total_seconds': total,
+                'ops_per_second': len(samples) / total if total else None,
+                'p50_ms': 1000 * percentile(samples, 50),
+                'p95_ms': 1000 * percentile(samples, 95),
+                'p99_ms': 1000 * percentile(samples, 99),
+                'max_ms': 1000 * samples[-1],
+            }
+
+        return summary
+
+
+def percentile(sorted_samples, percent):
+    """Nearest-rank percentile of an already sorted, non-empty list."""
+    rank = int(round(percent / 100.0 * len(sorted_samples) + 0.5)) - 1
+    return sorted_samples[min(max(rank, 0), len(sorted_samples) - 1)]
+
+
+def playTournaments(recorder, tournament_ids, players, rounds, draw_rate, rng):
+    """Registers players and plays every round of each tournament.
+
+    Args:
+      recorder: LatencyRecorder the API calls go through
+      tournament_ids: IDs of the (empty) tournaments to play
+      players: players registered for each tournament
+      rounds: rounds played in each tournament
+      draw_rate: probability that a match is reported as a draw
+      rng: random.Random used to decide results
+    """
+
+    for tournament_id in tournament_ids:
+        for i in range(players):
+            recorder.call("registerPlayer",
+                          "Player {}-{}".format(tournament_id, i), tournament_id)
+
+    for _ in range(rounds):
+        for tournament_id in tournament_ids:
+            pairings = recorder.call("swissPairings", tournament_id)
+
+            for id1, _, id2, _ in pairings:
+                winner, loser = (id1, id2) if rng.random() < 0.5 else (id2, id1)
+                try:
+                    recorder.call("reportMatch", winner, loser, tournament_id,
+                                  rng.random() < draw_rate)
+                except tournament.TournamentException:
+                    # Late rounds of small fields can force a rematch, which
+                    # the API refuses; the benchmark just moves on.
+                    pass
+
+            recorder.call("playerStandings", tournament_id)
+
+
+def clearTournaments(tournament_ids):
+    """Deletes all matches and players of the benchmark tournaments."""
+    for tournament_id in tournament_ids:
+        tournament.deleteMatches(tournament_id)
+        tournament.deletePlayers(tournament_id)
+
+
+def compareToBaseline(summary, baseline, tolerance):
+    """Lists operations whose p95 latency regressed against a baseline run.
+
+    Returns:
+      A list of (operation, baseline p95 ms, current p95 ms) tuples.
+    """
+
+    regressions = []
+    for operation, stats in sorted(summary.items()):
+        before = baseline.get('operations', {}).get(operation)
+        if before and stats['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append((operation, before['p95_ms'], stats['p95_ms']))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the tournament API with synthetic tournaments.")
+    parser.add_argument("--players", type=int, default=64,
+                        help="players registered per tournament")
+    parser.add_argument("--rounds", type=int, default=6,
+                        help="rounds played per tournament")
+    parser.add_argument("--draw-rate", type=float, default=0.1,
+                        help="share of matches reported as draws")
+    parser.add_argument("--tournaments", type=int, default=4,
+                        help="number of tournaments played side by side")
+    parser.add_argument("--first-tournament", type=int, default=1000,
+                        help="ID of the first benchmark tournament")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for match results")
+    parser.add_argument("--output", default="bench_output.json",
+                        help="file the results are written to, as JSON")
+    parser.add_argument("--baseline",
+                        help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed p95 slowdown against the baseline (0.2 = 20%%)")
+    parser.add_argument("--memory", action="store_true",
+                        help="use the in-memory backend instead of PostgreSQL")
+    args = parser.parse_args()
+
+    if args.memory:
+        tournament.setBackend(MemoryBackend())
+
+    tournament_ids = list(range(args.first_tournament,
+                                args.first_tournament + args.tournaments))
+    recorder = LatencyRecorder()
+
+    clearTournaments(tournament_ids)
+    started_at = time.time()
+    try:
+        playTournaments(recorder, tournament_ids, args.players, args.rounds,
+                        args.draw_rate, random.Random(args.seed))
+    finally:
+        clearTournaments(tournament_ids)
+    elapsed = time.time() - started_at
+
+    summary = recorder.summary()
+    results = {
+        'config': {
+            'players': args.players,
+            'rounds': args.rounds,
+            'draw_rate': args.draw_rate,
+            'tournaments': args.tournaments,
+            'seed': args.seed,
+            'backend': type(tournament.getBackend()).__name__,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'started_at': started_at,
+        'elapsed_seconds': elapsed,
+        'operations': summary,
+    }
+
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+    print("{:<16} {:>7} {:>10} {:>9} {:>9} {:>9}".format(
+        "operation", "count", "ops/s", "p50 ms", "p95 ms", "p99 ms"))
+    for operation in OPERATIONS:
+        stats = summary.get(operation)
+        if stats:
+            print("{:<16} {:>7} {:>10.0f} {:>9.3f} {:>9.3f} {:>9.3f}".format(
+                operation, stats['count'], stats['ops_per_second'] or 0,
+                stats['p50_ms'], stats['p95_ms'], stats['p99_ms']))
+    print("Results written to {}".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compareToBaseline(summary, json.load(baseline_file),
+                                            args.tolerance)
+
+        for operation, before, after in regressions:
+            print("REGRESSION {}: p95 {:.3f} ms -> {:.3f} ms".format(
+                operation, before, after))
+
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
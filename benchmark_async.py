@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+#
+# benchmark_async.py -- compares throughput of the sync and asyncio APIs
+#
+# Fires the same batch of requests (a mix of playerStandings, countPlayers and
+# swissPairings reads) at the database with many requests in flight at once,
+# first through tournament.py on a thread pool and then through
+# tournament_async.py on one event loop, and reports requests per second for
+# each. Both APIs use connection pools of the same size.
+#
+# Run against a scratch database: the benchmark tournament's players and
+# matches are replaced.
+#
+# Usage: python3 benchmark_async.py [--concurrency 100 200] [--requests 5000]
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tournament
+import tournament_async
+
+
+OPERATIONS = ("playerStandings", "countPlayers", "swissPairings")
+
+
+def setUp(tournament_id, player_count):
+    """Fills the benchmark tournament with players and one round of results."""
+
+    tournament.deleteMatches(tournament_id)
+    tournament.deletePlayers(tournament_id)
+    player_ids = tournament.registerPlayers(
+        ["Player {}".format(i) for i in range(player_count)], tournament_id)
+    tournament.reportMatches([(player_ids[i], player_ids[i + 1], False)
+                              for i in range(0, len(player_ids) - 1, 2)],
+                             tournament_id)
+
+
+def runSync(tournament_id, concurrency, requests):
+    """Runs the requests through the sync API on a thread pool.
+
+    Returns:
+      Elapsed seconds.
+    """
+
+    def call(i):
+        return getattr(tournament, OPERATIONS[i % len(OPERATIONS)])(tournament_id)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.time()
+        list(executor.map(call, range(requests)))
+        return time.time() - start
+
+
+async def runAsync(tournament_id, concurrency, requests):
+    """Runs the requests through the asyncio API on the running event loop.
+
+    Returns:
+      Elapsed seconds.
+    """
+
+    in_flight = asyncio.Semaphore(concurrency)
+
+    async def call(i):
+        async with in_flight:
+            return await getattr(tournament_async,
+                                 OPERATIONS[i % len(OPERATIONS)])(tournament_id)
+
+    start = time.time()
+    await asyncio.gather(*[call(i) for i in range(requests)])
+    return time.time() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Compare sync and asyncio API throughput.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[100, 200],
+                        help="numbers of requests in flight at once")
+    parser.add_argument("--requests", type=int, default=5000,
+                        help="requests issued per run")
+    parser.add_argument("--players", type=int, default=64,
+                        help="players in the benchmark tournament")
+    parser.add_argument("--pool-size", type=int, default=tournament.POOL_MAX_CONNECTIONS,
+                        help="maximum connections in each API's pool")
+    parser.add_argument("--tournament", type=int, default=9999,
+                        help="tournament ID to use for the benchmark")
+    args = parser.parse_args()
+
+    tournament.configurePool(maxconn=args.pool_size)
+    await tournament_async.configurePool(maxconn=args.pool_size)
+    setUp(args.tournament, args.players)
+
+    print("{:>12} {:>14} {:>14}".format("concurrency", "sync (req/s)", "async (req/s)"))
+
+    try:
+        for concurrency in args.concurrency:
+            sync_seconds = runSync(args.tournament, concurrency, args.requests)
+            async_seconds = await runAsync(args.tournament, concurrency, args.requests)
+
+            print("{:>12} {:>14.0f} {:>14.0f}".format(
+                concurrency, args.requests / sync_seconds, args.requests / async_seconds))
+    finally:
+        await tournament_async.closePool()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+#
+# benchmark_concurrency.py -- stress test of the tournament API under concurrent writers
+#
+# Hammers registerPlayer() and reportMatch() from a pool of worker threads,
+# all writing to the same tournaments at once. Every pairing is reported
+# twice, once in each order, by different workers, so that reports of the
+# same pairing race each other, and extra players register while the
+# results come in.
+#
+# Afterwards the tournaments are checked for integrity:
+#
+#   - every player registered exactly once
+#   - each pairing recorded once, whichever report won, and the other
+#     report refused with TournamentException
+#   - every player's wins and matches equal to those of the accepted
+#     reports, with no bye given, as no round is started
+#   - the ratings still summing to the seeds, as Elo updates are zero-sum
+#
+# Throughput of each phase is printed, and the script exits with status 1 if
+# any check fails.
+#
+# Runs against the local PostgreSQL database by default; the stress
+# tournaments (IDs from --first-tournament up) are emptied before and after
+# the run.
+#
+# Usage: python benchmark_concurrency.py [--workers 16] [--players 200]
+#                                        [--matches 2000] [--late-players 50]
+#                                        [--tournaments 2] [--memory]
+
+import argparse
+import random
+import time
+from multiprocessing.pool import ThreadPool
+
+import tournament
+from tournament_memory import MemoryBackend
+from tournament_ratings import INITIAL_RATING
+
+
+def registerAll(pool, tournament_ids, players, prefix):
+    """Registers players for each tournament from the worker pool.
+
+    Returns:
+      The number of registrations made.
+    """
+
+    tasks = [("{} {}-{}".format(prefix, tournament_id, i), tournament_id)
+             for tournament_id in tournament_ids for i in range(players)]
+
+    pool.map(lambda task: tournament.registerPlayer(*task), tasks, chunksize=1)
+
+    return len(tasks)
+
+
+def chooseReports(tournament_ids, matches, rng):
+    """Chooses distinct pairings among each tournament's players and makes
+    two reports of each, one in each order, in shuffled order.
+
+    Returns:
+      A list of (winner, loser, tournament_id) reports.
+    """
+
+    reports = []
+    for tournament_id in tournament_ids:
+        player_ids = [row[0] for row in tournament.playerStandings(tournament_id)]
+        possible = len(player_ids) * (len(player_ids) - 1) // 2
+
+        pairs = set()
+        while len(pairs) < min(matches, possible):
+            pairs.add(tuple(sorted(rng.sample(player_ids, 2))))
+
+        for id1, id2 in pairs:
+            reports.append((id1, id2, tournament_id))
+            reports.append((id2, id1, tournament_id))
+
+    rng.shuffle(reports)
+
+    return reports
+
+
+def reportAll(pool, reports, late_players, tournament_ids):
+    """Sends the reports from the worker pool, registering late players for
+    each tournament in among them.
+
+    Returns:
+      A pair of the reports that were accepted and the number of calls made.
+    """
+
+    def run(task):
+        if task[0] == "register":
+            tournament.registerPlayer(*task[1:])
+            return None
+
+        try:
+            tournament.reportMatch(*task)
+        except tournament.TournamentException:
+            return None
+
+        return task
+
+    tasks = list(reports)
+    for tournament_id in tournament_ids:
+        for i in range(late_players):
+            position = (i + 1) * len(tasks) // (late_players + 1)
+            tasks.insert(position, ("register", "Late {}-{}".format(tournament_id, i),
+                                    tournament_id))
+
+    accepted = [report for report in pool.map(run, tasks, chunksize=1) if report]
+
+    return accepted, len(tasks)
+
+
+def checkTournament(tournament_id, expected_players, reports, accepted):
+    """Checks a tournament after the run.
+
+    Returns:
+      A list of descriptions of everything found wrong; empty if nothing.
+    """
+
+    problems = []
+    standings = tournament.playerStandings(tournament_id)
+
+    if tournament.countPlayers(tournament_id) != expected_players or \
+            len(standings) != expected_players:
+        problems.append("{} players registered, expected {}".format(
+            len(standings), expected_players))
+
+    recorded = {}
+    for winner, loser, _ in accepted:
+        pair = (min(winner, loser), max(winner, loser))
+        recorded[pair] = recorded.get(pair, 0) + 1
+
+    reported = set((min(winner, loser), max(winner, loser)) for winner, loser, _ in reports)
+    for pair in sorted(reported):
+        if recorded.get(pair, 0) != 1:
+            problems.append("pairing {} recorded {} times".format(pair, recorded.get(pair, 0)))
+
+    wins = dict((row[0], 0) for row in standings)
+    matches = dict(wins)
+    for winner, loser, _ in accepted:
+        wins[winner] += 1
+        matches[winner] += 1
+        matches[loser] += 1
+
+    for player_id, _, player_wins, player_matches in standings:
+        if (player_wins, player_matches) != (wins[player_id], matches[player_id]):
+            problems.append("player {} has {}/{} wins/matches, expected {}/{}".format(
+                player_id, player_wins, player_matches, wins[player_id],
+                matches[player_id]))
+
+    ratings = tournament.playerRatings(tournament_id)
+    if abs(sum(ratings.values()) - INITIAL_RATING * len(ratings)) > 1e-6 * len(ratings):
+        problems.append("ratings sum to {:.3f}, expected {:.3f}".format(
+            sum(ratings.values()), INITIAL_RATING * len(ratings)))
+
+    return problems
+
+
+def clearTournaments(tournament_ids):
+    """Deletes all matches and players of the stress tournaments."""
+    for tournament_id in tournament_ids:
+        tournament.deleteMatches(tournament_id)
+        tournament.deletePlayers(tournament_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stress the tournament API with concurrent writers.")
+    parser.add_argument("--workers", type=int, default=16,
+                        help="worker threads making calls at once")
+    parser.add_argument("--players", type=int, default=200,
+                        help="players registered per tournament before play")
+    parser.add_argument("--matches", type=int, default=2000,
+                        help="distinct pairings reported per tournament")
+    parser.add_argument("--late-players", type=int, default=50,
+                        help="players registered per tournament during play")
+    parser.add_argument("--tournaments", type=int, default=2,
+                        help="number of tournaments written to at once")
+    parser.add_argument("--first-tournament", type=int, default=3000,
+                        help="ID of the first stress tournament")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for the pairings")
+    parser.add_argument("--memory", action="store_true",
+                        help="use the in-memory backend instead of PostgreSQL")
+    args = parser.parse_args()
+
+    if args.memory:
+        tournament.setBackend(MemoryBackend())
+    else:
+        tournament.configurePool(maxconn=args.workers)
+
+    tournament_ids = list(range(args.first_tournament,
+                                args.first_tournament + args.tournaments))
+    pool = ThreadPool(args.workers)
+
+    clearTournaments(tournament_ids)
+    try:
+        start = time.time()
+        registered = registerAll(pool, tournament_ids, args.players, "Player")
+        register_seconds = time.time() - start
+
+        reports = chooseReports(tournament_ids, args.matches, random.Random(args.seed))
+
+        start = time.time()
+        accepted, calls = reportAll(pool, reports, args.late_players, tournament_ids)
+        report_seconds = time.time() - start
+
+        problems = []
+        for tournament_id in tournament_ids:
+            problems.extend("tournament {}: {}".format(tournament_id, problem)
+                            for problem in checkTournament(
+                                tournament_id, args.players + args.late_players,
+                                [report for report in reports if report[2] == tournament_id],
+                                [report for report in accepted if report[2] == tournament_id]))
+    finally:
+        pool.close()
+        pool.join()
+        clearTournaments(tournament_ids)
+
+    print("{:<24} {:>7} {:>10}".format("phase", "calls", "calls/s"))
+    print("{:<24} {:>7} {:>10.0f}".format("registerPlayer", registered,
+                                          registered / register_seconds))
+    print("{:<24} {:>7} {:>10.0f}".format("reportMatch + register", calls,
+                                          calls / report_seconds))
+    print("{} of {} reports accepted, {} workers".format(
+        len(accepted), len(reports), args.workers))
+
+    for problem in problems:
+        print("INTEGRITY {}".format(problem))
+
+    if problems:
+        raise SystemExit(1)
+
+    print("All integrity checks passed.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+# benchmark_pairing.py -- measures how the Swiss pairing engine scales
+#
+# Plays synthetic tournaments entirely in memory, pairing each round with
+# tournament_pairing.pairPlayers() and picking winners at random, and reports
+# how long pairing took per round for each field size. No database is needed.
+#
+# Usage: python benchmark_pairing.py [--players 1000 10000 50000] [--rounds 9]
+
+import argparse
+import random
+import time
+
+from tournament_pairing import pairPlayers
+
+
+def playTournament(player_count, rounds, rng):
+    """Plays a synthetic tournament and returns the pairing time of each round.
+
+    Args:
+      player_count: number of players in the field
+      rounds: number of rounds to play
+      rng: random.Random used to decide match results
+
+    Returns:
+      A list of (seconds, rematches) tuples, one per round.
+    """
+
+    wins = dict((player_id, 0) for player_id in range(1, player_count + 1))
+    matches = dict(wins)
+    opponents = {}
+    timings = []
+
+    for _ in range(rounds):
+        standings = sorted(((player_id, "Player {}".format(player_id),
+                             wins[player_id], matches[player_id])
+                            for player_id in wins),
+                           key=lambda row: (-row[2], row[3], row[0]))
+
+        start = time.time()
+        pairings = pairPlayers(standings, opponents)
+        elapsed = time.time() - start
+
+        rematches = 0
+        for id1, _, id2, _ in pairings:
+            if id2 in opponents.get(id1, ()):
+                rematches += 1
+
+            winner, loser = (id1, id2) if rng.random() < 0.5 else (id2, id1)
+            wins[winner] += 1
+            matches[winner] += 1
+            matches[loser] += 1
+            opponents.setdefault(winner, set()).add(loser)
+            opponents.setdefault(loser, set()).add(winner)
+
+        timings.append((elapsed, rematches))
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--players", type=int, nargs="+",
+                        default=[100, 1000, 10000, 50000],
+                        help="field sizes to benchmark")
+    parser.add_argument("--rounds", type=int, default=9,
+                        help="rounds played per tournament")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for match results")
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>12} {:>10}".format(
+        "players", "mean (ms)", "worst (ms)", "rematches"))
+
+    for player_count in args.players:
+        timings = playTournament(player_count, args.rounds, random.Random(args.seed))
+        seconds = [elapsed for elapsed, _ in timings]
+
+        print("{:>8} {:>12.2f} {:>12.2f} {:>10}".format(
+            player_count,
+            1000 * sum(seconds) / len(seconds),
+            1000 * max(seconds),
+            sum(rematches for _, rematches in timings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#
+# benchmark_simulation.py -- measures how the Monte Carlo simulator scales with processes
+#
+# Builds a synthetic tournament state in memory, with random seed ratings
+# and a few rounds already played, and forecasts its remaining rounds with
+# tournament_simulation.simulateState() on each number of worker processes
+# given. Reports the trials played per second and the speedup over the
+# first number of processes. No database is needed.
+#
+# Usage: python benchmark_simulation.py [--players 128] [--played 3] [--rounds 4]
+#                                       [--trials 2000] [--processes 1 2 4 8]
+
+import argparse
+import random
+import time
+
+from tournament_pairing import pairRound
+from tournament_simulation import TournamentState, simulateState
+
+
+def buildState(player_count, played, rng):
+    """Returns a TournamentState of a synthetic tournament with some rounds played.
+
+    Args:
+      player_count: number of players in the field
+      played: number of rounds already played
+      rng: random.Random used for ratings and results
+    """
+
+    player_ids = list(range(1, player_count + 1))
+    names = ["Player {}".format(player_id) for player_id in player_ids]
+    wins = dict((player_id, 0) for player_id in player_ids)
+    matches = dict(wins)
+    opponents = {}
+    results = []
+    had_bye = set()
+
+    for _ in range(played):
+        standings = sorted(((player_id, None, wins[player_id], matches[player_id])
+                            for player_id in player_ids),
+                           key=lambda row: (-row[2], row[3], row[0]))
+
+        pairings, bye = pairRound(standings, opponents, had_bye)
+        if bye is not None:
+            had_bye.add(bye)
+            wins[bye] += 1
+            matches[bye] += 1
+
+        for id1, _, id2, _ in pairings:
+            winner, loser = (id1, id2) if rng.random() < 0.5 else (id2, id1)
+            wins[winner] += 1
+            matches[winner] += 1
+            matches[loser] += 1
+            opponents.setdefault(winner, set()).add(loser)
+            opponents.setdefault(loser, set()).add(winner)
+            results.append((winner, loser))
+
+    return TournamentState(player_ids, names,
+                           [wins[player_id] for player_id in player_ids],
+                           [matches[player_id] for player_id in player_ids],
+                           [rng.gauss(1500, 200) for _ in player_ids], results,
+                           had_bye=had_bye)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure how the tournament simulator scales with processes.")
+    parser.add_argument("--players", type=int, default=128,
+                        help="players in the synthetic tournament")
+    parser.add_argument("--played", type=int, default=3,
+                        help="rounds already played")
+    parser.add_argument("--rounds", type=int, default=4,
+                        help="rounds simulated in each trial")
+    parser.add_argument("--trials", type=int, default=2000,
+                        help="trials per forecast")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="numbers of worker processes to measure")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for the tournament and the trials")
+    args = parser.parse_args()
+
+    state = buildState(args.players, args.played, random.Random(args.seed))
+
+    print("{:>9} {:>10} {:>10} {:>8}".format("processes", "seconds", "trials/s", "speedup"))
+    baseline = None
+    for processes in args.processes:
+        start = time.time()
+        simulateState(state, args.rounds, args.trials, processes=processes, seed=args.seed)
+        elapsed = time.time() - start
+
+        if baseline is None:
+            baseline = elapsed
+
+        print("{:>9} {:>10.3f} {:>10.0f} {:>7.2f}x".format(
+            processes, elapsed, args.trials / elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+# benchmark_snapshot.py -- measures how long a tournament takes to save and restore
+#
+# Plays a synthetic tournament in memory, writes it to a snapshot file with
+# tournament_snapshot.writeSnapshot(), then times exportTournament() and
+# importTournament() against the chosen backend. The benchmark tournament
+# (--tournament) is emptied before and after the run.
+#
+# Usage: python benchmark_snapshot.py [--players 10000] [--rounds 11] [--memory]
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import tournament
+from tournament_memory import MemoryBackend
+from tournament_pairing import pairRound
+from tournament_snapshot import TournamentSnapshot, writeSnapshot
+
+
+def syntheticSnapshot(tournament_id, player_count, rounds, rng):
+    """Returns a TournamentSnapshot of a tournament played with random results."""
+
+    player_ids = list(range(1, player_count + 1))
+    wins = dict((player_id, 0) for player_id in player_ids)
+    opponents = {}
+    winners, losers, byes = [], [], []
+
+    for _ in range(rounds):
+        standings = sorted(((player_id, "", wins[player_id], 0) for player_id in player_ids),
+                           key=lambda row: (-row[2], row[0]))
+
+        # An odd field gives each round's bye as startRound() does.
+        pairings, bye = pairRound(standings, opponents, byes)
+        if bye is not None:
+            byes.append(bye)
+            wins[bye] += 1
+
+        for id1, _, id2, _ in pairings:
+            winner, loser = (id1, id2) if rng.random() < 0.5 else (id2, id1)
+            if loser in opponents.get(winner, ()):
+                continue
+
+            winners.append(winner)
+            losers.append(loser)
+            wins[winner] += 1
+            opponents.setdefault(winner, set()).add(loser)
+            opponents.setdefault(loser, set()).add(winner)
+
+    return TournamentSnapshot(tournament_id, player_ids,
+                              ["Player {}".format(player_id) for player_id in player_ids],
+                              winners, losers, byes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time saving and restoring a tournament snapshot.")
+    parser.add_argument("--players", type=int, default=10000,
+                        help="players in the tournament")
+    parser.add_argument("--rounds", type=int, default=11,
+                        help="rounds played")
+    parser.add_argument("--tournament", type=int, default=2000,
+                        help="ID of the benchmark tournament")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for match results")
+    parser.add_argument("--memory", action="store_true",
+                        help="use the in-memory backend instead of PostgreSQL")
+    args = parser.parse_args()
+
+    if args.memory:
+        tournament.setBackend(MemoryBackend())
+
+    snapshot = syntheticSnapshot(args.tournament, args.players, args.rounds,
+                                 random.Random(args.seed))
+
+    handle, path = tempfile.mkstemp(suffix=".tdbs")
+    os.close(handle)
+    try:
+        writeSnapshot(path, snapshot)
+        size = os.path.getsize(path)
+
+        tournament.deletePlayers(args.tournament)
+        try:
+            start = time.time()
+            tournament.importTournament(path)
+            imported = time.time() - start
+
+            start = time.time()
+            tournament.exportTournament(args.tournament, path)
+            exported = time.time() - start
+        finally:
+            tournament.deletePlayers(args.tournament)
+    finally:
+        os.remove(path)
+
+    print("{} players, {} matches, {} byes; snapshot is {} bytes".format(
+        len(snapshot.player_ids), len(snapshot.winners), len(snapshot.byes), size))
+    print("importTournament: {:.3f} s".format(imported))
+    print("exportTournament: {:.3f} s".format(exported))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,22 @@
 #
 # Test cases for tournament.py
 
+import os
+import random
+import sys
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
 from tournament import *
+from migrate import checkIndexes
+from tournament_columns import StandingsColumns
 from tournament_exception import TournamentException
+from tournament_feed import StandingsReplica, parseDelta
+from tournament_memory import MemoryBackend
+from tournament_pairing import pairPlayers
+from tournament_simulation import roundsForClearWinner, simulateTournament
+from tournament_tiebreaks import computeTiebreaks
 
 
 def testDeleteMatches():
@@ -201,28 +215,45 @@ def testByes():
     deleteMatches(2)
     deletePlayers(2)
 
-    registerPlayer("Flynn Taggart", 1)
+    registerPlayers(["Flynn Taggart", "B.J. Blackowicz", "Commander Keen"], 1)
 
     standings = playerStandings(1)
+    if [row[2:] for row in standings] != [(0, 0)] * 3:
+        raise ValueError(
+            "Registering players should not give anyone a bye."
+        )
 
-    (wins, matches) = standings[0][2:]
+    last = standings[-1][0]
+    [(id1, _, id2, _)] = startRound(1)
+    records = dict((row[0], row[2:]) for row in playerStandings(1))
 
-    if wins != 1 or matches != 1:
+    if last in (id1, id2) or records[last] != (1, 1) or byeHistory(1) != {last: 1}:
         raise ValueError(
-            "After one player registers, player should have record of 1 win, 1 match due to bye."
+            "The first round's bye should go to the player in last place, as 1 win and 1 match."
         )
-    registerPlayer("B.J. Blackowicz", 1)
 
-    standings = playerStandings(1)
-    records = [(x[2:]) for x in standings]
+    reportMatch(id1, id2, 1)
+    pairings = swissPairings(1)
+    if startRound(1) != pairings or last not in (pairings[0][0], pairings[0][2]):
+        raise ValueError(
+            "A player who has had a bye should be paired in later rounds, "
+            "as swissPairings() showed."
+        )
 
-    if records[0][0] != 0 or records[0][1] != 0 \
-            or records[1][0] != 0 or records[1][1] != 0:
+    byes = byeHistory(1)
+    if len(byes) != 2 or sorted(byes.values()) != [1, 2] or \
+            sum(row[2] for row in playerStandings(1)) != 3:
         raise ValueError(
-            "After two players register, wins and losses should be zero for both players."
+            "The second round's bye should go to a player who has not had one yet."
         )
 
-    print "9. After one match, players with assigned bye have 1 win and 1 match."
+    deleteMatches(1)
+    if byeHistory(1) or any(row[2:] != (0, 0) for row in playerStandings(1)):
+        raise ValueError(
+            "Deleting matches should remove the byes too."
+        )
+
+    print "9. Each round's bye goes to the lowest-ranked player without one."
 
 
 def testNoRepeatMatches():
@@ -272,7 +303,856 @@ def testDrawDoesNotAffectStandings():
     print "11. Reporting a draw does not affect standings."
 
 
+def testSessionRollsBackOnError():
+    deleteMatches(1)
+    deletePlayers(1)
+    deleteMatches(2)
+    deletePlayers(2)
+
+    with getBackend().session() as session:
+        session.registerPlayer("Flynn Taggart", 1)
+        session.registerPlayer("B.J. Blackowicz", 1)
+        if session.countPlayers(1) != 2:
+            raise ValueError(
+                "Players registered in a session should be visible within it."
+            )
+
+    [id1, id2] = [row[0] for row in playerStandings(1)]
+
+    try:
+        with getBackend().session() as session:
+            session.registerPlayer("Commander Keen", 1)
+            session.reportMatch(id1, id2, 1)
+            session.reportMatch(id2, id1, 1)
+    except TournamentException:
+        pass
+    else:
+        raise ValueError(
+            "Players should not be able to play each other more than once."
+        )
+
+    if countPlayers(1) != 2 or playerStandings(1)[0][3] != 0:
+        raise ValueError(
+            "A session that raises should leave no changes behind."
+        )
+
+    print "12. A session commits as one unit and rolls back on error."
+
+
+def testRebuildStandings():
+    deleteMatches(1)
+    deletePlayers(1)
+    deleteMatches(2)
+    deletePlayers(2)
+
+    registerPlayer("Flynn Taggart", 1)
+    registerPlayer("B.J. Blackowicz", 1)
+    registerPlayer("Commander Keen", 1)
+    registerPlayer("Dangerous Dave", 1)
+
+    [id1, id2, id3, id4] = [row[0] for row in playerStandings(1)]
+    reportMatch(id1, id2, 1)
+    reportMatch(id3, id4, 1)
+    expected = playerStandings(1)
+
+    # Knock the stored counters out of line with the match records.
+    backend = getBackend()
+    if isinstance(backend, MemoryBackend):
+        state = backend._tournaments[1]
+        for player_id in state.names:
+            state.wins[player_id], state.matches[player_id] = 5, 9
+    else:
+        db_conn, db_cursor = connect()
+        db_cursor.execute("UPDATE standings SET wins = 5, matches = 9 "
+                          "WHERE tournament_id = 1;")
+        db_conn.commit()
+        db_conn.close()
+
+    rebuildStandings(1)
+
+    if playerStandings(1) != expected:
+        raise ValueError(
+            "Rebuilding standings should recompute them from recorded matches."
+        )
+
+    print "13. Standings can be rebuilt from recorded matches."
+
+
+def testRegisterPlayersInBulk():
+    deleteMatches(1)
+    deletePlayers(1)
+    deleteMatches(2)
+    deletePlayers(2)
+
+    registerPlayer("Flynn Taggart", 1)
+    names = ["B.J. Blackowicz", "Commander\tKeen", "Dangerous \\Dave",
+             u"Duke Nuk\u00e9m"]
+    ids = registerPlayers(names, 1)
+
+    if len(ids) != 4 or countPlayers(1) != 5:
+        raise ValueError(
+            "Registering players in bulk should return an ID for each player."
+        )
+
+    standings = playerStandings(1)
+    registered = dict((row[0], row[1]) for row in standings)
+    # PostgreSQL hands names back as UTF-8 encoded strings.
+    if [n if isinstance(n, unicode) else n.decode("utf-8")
+            for n in (registered[i] for i in ids)] != names:
+        raise ValueError(
+            "Players registered in bulk should keep their names."
+        )
+
+    if sum(row[2] for row in standings) != 0:
+        raise ValueError(
+            "Registering players in bulk should not assign a bye."
+        )
+
+    print "14. Players can be registered in bulk."
+
+
+def testReportMatchesInBatch():
+    deleteMatches(1)
+    deletePlayers(1)
+    deleteMatches(2)
+    deletePlayers(2)
+
+    [id1, id2, id3, id4] = registerPlayers(
+        ["Flynn Taggart", "B.J. Blackowicz", "Commander Keen", "Dangerous Dave"], 1)
+    [other] = registerPlayers(["Duke Nukem"], 2)
+
+    reportMatch(id1, id2, 1)
+
+    try:
+        reportMatches([(id2, id1, False), (id3, other, False),
+                       (id3, id4, False), (id4, id4, False)], 1)
+    except TournamentException as e:
+        if len(e.errors) != 3:
+            raise ValueError(
+                "Every rejected result in a batch should be reported."
+            )
+    else:
+        raise ValueError(
+            "A batch containing invalid results should be rejected."
+        )
+
+    if [row[3] for row in playerStandings(1) if row[0] in (id3, id4)] != [0, 0]:
+        raise ValueError(
+            "No result in a rejected batch should be recorded."
+        )
+
+    reportMatches([(id1, id3, False), (id4, id2, False), (id2, id3, True)], 1)
+
+    for (i, n, w, m) in playerStandings(1):
+        if m != 2 and i in (id1, id2) or m != 1 and i in (id3, id4):
+            raise ValueError(
+                "Each result in a batch should be recorded."
+            )
+
+    print "15. A round of results can be reported in one batch."
+
+
+def testPairingsAvoidRematches():
+    deleteMatches(1)
+    deletePlayers(1)
+    deleteMatches(2)
+    deletePlayers(2)
+
+    [id1, id2, id3, id4] = registerPlayers(
+        ["Flynn Taggart", "B.J. Blackowicz", "Commander Keen", "Dangerous Dave"], 1)
+    reportMatches([(id1, id2, False), (id3, id4, False)], 1)
+    reportMatches([(id1, id3, False), (id2, id4, False)], 1)
+
+    # Standings are now id1, id2, id3, id4, but id1 has played both id2 and id3.
+    pairings = swissPairings(1)
+    actual_pairs = set(frozenset([pid1, pid2]) for (pid1, _, pid2, _) in pairings)
+    if actual_pairs != set([frozenset([id1, id4]), frozenset([id2, id3])]):
+        raise ValueError(
+            "Pairings should skip over players who have already met."
+        )
+
+    # Greedy pairing would leave the two bottom players, who have met, together.
+    standings = [(i, str(i), 0, 0) for i in range(1, 7)]
+    opponents = {5: set([6]), 6: set([5])}
+    pairings = pairPlayers(standings, opponents)
+    if len(pairings) != 3 or any(
+            pid2 in opponents.get(pid1, ()) for (pid1, _, pid2, _) in pairings):
+        raise ValueError(
+            "Pairing should backtrack rather than propose a rematch."
+        )
+
+    print "16. Swiss pairings avoid rematches."
+
+
+def testHotQueriesUseIndexes():
+    failures = checkIndexes()
+    if failures:
+        raise ValueError(
+            "Hot queries should use their indexes; run migrate.py. "
+            "Not using an index: " + ", ".join(f[0] for f in failures)
+        )
+
+    print "17. Hot queries use their indexes."
+
+
+def testCachedReadsInvalidatedByWrites():
+    deleteMatches(1)
+    deletePlayers(1)
+    deleteMatches(2)
+    deletePlayers(2)
+
+    enableCache()
+    try:
+        [id1, id2] = registerPlayers(["Flynn Taggart", "B.J. Blackowicz"], 1)
+        registerPlayers(["Commander Keen", "Dangerous Dave"], 2)
+
+        playerStandings(1)
+        playerStandings(2)
+        standings2 = playerStandings(2)
+        stats = cacheStats()
+        if stats['hits'] != 1 or stats['misses'] != 2:
+            raise ValueError(
+                "Repeated standings reads should be served from the cache."
+            )
+
+        reportMatch(id1, id2, 1)
+        if [row[2] for row in playerStandings(1)] != [1, 0]:
+            raise ValueError(
+                "Reporting a match should invalidate the tournament's cached standings."
+            )
+        if playerStandings(2) != standings2 or cacheStats()['hits'] != 2:
+            raise ValueError(
+                "Reporting a match should not invalidate other tournaments."
+            )
+    finally:
+        disableCache()
+
+    print "18. Cached standings are invalidated when a tournament changes."
+
+
+def testBackendsAgree():
+    deleteMatches(1)
+    deletePlayers(1)
+    deleteMatches(2)
+    deletePlayers(2)
+
+    # Play the same tournament on PostgreSQL and in memory, round by round.
+    rng = random.Random(7)
+    names = ["Player {}".format(i) for i in range(13)]
+    backends = [getBackend(), MemoryBackend()]
+    ids = []
+    for backend in backends:
+        with backend.session() as session:
+            session.registerPlayers(names[:5], 2)
+            for name in names[5:]:
+                session.registerPlayer(name, 2)
+            ids.append([row[0] for row in sorted(session.playerStandings(2))])
+
+    def normalized(backend, player_ids, method, id_columns):
+        # Replace player IDs, which differ between backends, with registration order.
+        position = dict((player_id, k) for k, player_id in enumerate(player_ids))
+        with backend.session() as session:
+            rows = getattr(session, method)(2)
+        return [tuple(position[value] if column in id_columns else value
+                      for column, value in enumerate(row)) for row in rows]
+
+    for _ in range(4):
+        results = normalized(backends[0], ids[0], "swissPairings", (0, 2))
+        if results != normalized(backends[1], ids[1], "swissPairings", (0, 2)):
+            raise ValueError("Both backends should propose the same pairings.")
+
+        outcomes = [rng.random() for _ in results]
+        for backend, player_ids in zip(backends, ids):
+            with backend.session() as session:
+                session.reportMatches(
+                    [(player_ids[a], player_ids[b], False) if outcome < 0.5 else
+                     (player_ids[b], player_ids[a], outcome > 0.9)
+                     for (a, _, b, _), outcome in zip(results, outcomes)], 2)
+
+        if normalized(backends[0], ids[0], "playerStandings", (0,)) != \
+                normalized(backends[1], ids[1], "playerStandings", (0,)):
+            raise ValueError("Both backends should produce the same standings.")
+
+    print "19. The in-memory backend matches PostgreSQL."
+
+
+def testMetricsRecordCallsAndStatements():
+    deleteMatches(1)
+    deletePlayers(1)
+
+    enableMetrics()
+    try:
+        [id1, id2] = registerPlayers(["Flynn Taggart", "B.J. Blackowicz"])
+        reportMatch(id1, id2)
+        try:
+            reportMatch(id2, id1)
+        except TournamentException:
+            pass
+        playerStandings()
+
+        stats = metricsStats()
+        calls = stats['functions']['reportMatch']
+        if calls['count'] != 2 or calls['errors'] != 1:
+            raise ValueError(
+                "Metrics should count every call and every call that raised."
+            )
+        if calls['p50_ms'] is None or calls['p99_ms'] < calls['p50_ms']:
+            raise ValueError("Metrics should report latency percentiles.")
+
+        text = metricsText()
+        if 'tournament_call_duration_seconds_count{function="reportMatch"} 2' not in text:
+            raise ValueError("Metrics should be exported in Prometheus format.")
+
+        if isinstance(getBackend(), PostgresBackend):
+            standings_rows = [statement for statement in stats['statements']
+                              if statement.startswith("SELECT p.id, p.name")]
+            if len(standings_rows) != 1 or \
+                    stats['statements'][standings_rows[0]]['rows'] != 2:
+                raise ValueError(
+                    "Metrics should record each statement and the rows it returned."
+                )
+    finally:
+        disableMetrics()
+
+    if metricsStats() is not None:
+        raise ValueError("Disabling metrics should discard them.")
+
+    print "20. Metrics record API calls and SQL statements."
+
+
+def testSessionContinuesAfterRejectedResult():
+    deleteMatches(1)
+    deletePlayers(1)
+    [id1, id2, id3, id4] = registerPlayers(
+        ["Flynn Taggart", "B.J. Blackowicz", "Commander Keen", "Dangerous Dave"])
+
+    with getBackend().session() as session:
+        session.reportMatch(id1, id2)
+        for winner, loser, tournament_id in [(id2, id1, 1), (id3, id3, 1),
+                                              (id3, id4, 2)]:
+            try:
+                session.reportMatch(winner, loser, tournament_id)
+            except TournamentException:
+                pass
+            else:
+                raise ValueError("Each of these results breaks a rule.")
+        session.reportMatch(id3, id4)
+
+    if [row[2] for row in playerStandings()] != [1, 1, 0, 0]:
+        raise ValueError(
+            "A rejected result should not undo the rest of the session."
+        )
+
+    print "21. A session carries on after a rejected result."
+
+
+def testPagedAndStreamedStandings():
+    deleteMatches(1)
+    deletePlayers(1)
+    player_ids = registerPlayers(["Player {}".format(i) for i in range(25)])
+    reportMatches([(player_ids[i], player_ids[i + 1], False)
+                   for i in range(0, 24, 2)])
+    reportMatches([(player_ids[i], player_ids[i + 2], False)
+                   for i in range(0, 20, 4)])
+    # Streamed and paged standings skip the tiebreaks.
+    standings = sorted(playerStandings(), key=lambda row: (-row[2], row[3], row[0]))
+
+    if list(iterStandings(1, 4)) != standings:
+        raise ValueError(
+            "Streamed standings should match playerStandings."
+        )
+
+    paged = []
+    page = topStandings(1, 7)
+    while page:
+        if len(page) > 7:
+            raise ValueError("A page should hold at most limit rows.")
+        paged.extend(page)
+        page = topStandings(1, 7, page[-1])
+    if paged != standings:
+        raise ValueError(
+            "Paging through the standings should visit every row once, in order."
+        )
+
+    print "22. Standings can be streamed and paged."
+
+
+def testTiebreaks():
+    deleteMatches(1)
+    deletePlayers(1)
+    [a, b, d, c] = registerPlayers(
+        ["Flynn Taggart", "B.J. Blackowicz", "Commander Keen", "Dangerous Dave"])
+    reportMatches([(a, b, False), (c, d, False)])
+    reportMatches([(a, c, False), (d, b, False)])
+
+    # c and d both have one win in two matches, but c lost to the leader
+    # while d only beat the player in last place.
+    tiebreaks = playerTiebreaks()
+    if tiebreaks[c] != (0.75, 3, 3, 1) or tiebreaks[d][1:] != (1, 1, 0):
+        raise ValueError(
+            "OMW%, Buchholz, median-Buchholz and Sonneborn-Berger should "
+            "reflect opponent strength."
+        )
+    if [row[0] for row in playerStandings()] != [a, c, d, b]:
+        raise ValueError(
+            "Players level on wins should be ordered by their tiebreaks."
+        )
+
+    # Median-Buchholz drops the best and worst of at least three opponents.
+    standings = [(1, "", 3, 3), (2, "", 2, 3), (3, "", 1, 3), (4, "", 0, 3)]
+    results = [(1, 2), (1, 3), (1, 4), (2, 3), (2, 4), (3, 4)]
+    if [values[2] for values in computeTiebreaks(standings, results)] != [1, 1, 2, 2]:
+        raise ValueError("Median-Buchholz should drop the best and worst opponent.")
+
+    print "23. Ties in the standings are broken by opponent strength."
+
+
+def testCreateAndDropTournaments():
+    tournament_id = createTournament("Spring Open")
+    try:
+        createTournament("Spring Open again", tournament_id)
+    except TournamentException:
+        pass
+    else:
+        raise ValueError("A tournament ID can only be created once.")
+
+    [id1, id2, id3, id4] = registerPlayers(
+        ["Flynn Taggart", "B.J. Blackowicz", "Commander Keen", "Dangerous Dave"],
+        tournament_id)
+    reportMatch(id1, id2, tournament_id)
+    deleteMatches(tournament_id)
+    reportMatch(id1, id2, tournament_id)
+    reportMatch(id3, id4, tournament_id)
+    if [row[2] for row in playerStandings(tournament_id)] != [1, 1, 0, 0]:
+        raise ValueError(
+            "A created tournament should keep standings like any other."
+        )
+    ratings = playerRatings(tournament_id)
+    reportMatch(id1, id4, tournament_id, draw=True)
+    if playerRatings(tournament_id)[id4] <= ratings[id4]:
+        raise ValueError("A created tournament should record draws like any other.")
+
+    if isinstance(getBackend(), PostgresBackend):
+        db_conn, db_cursor = connect()
+        db_cursor.execute("EXPLAIN SELECT COUNT(*) FROM players "
+                          "WHERE tournament_id = %s;", (tournament_id,))
+        plan = "\n".join(row[0] for row in db_cursor.fetchall())
+        db_conn.close()
+        if "players_t{}".format(tournament_id) not in plan or "players_default" in plan:
+            raise ValueError(
+                "Queries on a created tournament should only read its partition."
+            )
+
+    # Players registered before the tournament was created become part of
+    # it, with their rounds and the byes given in them.
+    deletePlayers(9024)
+    registerPlayers(["Duke Nukem", "Ranger", "Blake Stone"], 9024)
+    [(id5, _, id6, _)] = startRound(9024)
+    reportMatch(id5, id6, 9024)
+    byes = byeHistory(9024)
+    if createTournament("Late Registration", 9024) != 9024:
+        raise ValueError("createTournament() should return the ID it was given.")
+    if [row[2] for row in playerStandings(9024)] != [1, 1, 0] or \
+            byeHistory(9024) != byes or list(byes.values()) != [1]:
+        raise ValueError(
+            "Creating a tournament should keep its existing players, matches and byes."
+        )
+
+    dropTournament(tournament_id, archive=True)
+    dropTournament(9024)
+    if countPlayers(tournament_id) != 0 or countPlayers(9024) != 0:
+        raise ValueError("Dropped tournaments should have no players left.")
+    for dropped in (tournament_id, 9024):
+        try:
+            dropTournament(dropped, archive=True)
+        except TournamentException:
+            pass
+        else:
+            raise ValueError("Only created tournaments can be archived.")
+
+    print "24. Tournaments can be created, dropped and archived."
+
+
+def testExportAndImportTournament():
+    deleteMatches(1)
+    deletePlayers(1)
+    [a, b, c, d, e] = registerPlayers(
+        ["Flynn Taggart", "B.J. Blackowicz", "Commander Keen", "Dangerous Dave",
+         "Duke Nukem"])
+    pairings = startRound(1)
+    reportMatches([(id1, id2, False) for id1, _, id2, _ in pairings])
+    standings = playerStandings(1)
+    [bye] = byeHistory(1)
+
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        exportTournament(1, path)
+        try:
+            importTournament(path)
+        except TournamentException:
+            pass
+        else:
+            raise ValueError("A snapshot can only be restored into an empty tournament.")
+
+        deletePlayers(1)
+        if importTournament(path) != 1:
+            raise ValueError("importTournament() should return the tournament's ID.")
+        if playerStandings(1) != standings or byeHistory(1) != {bye: None}:
+            raise ValueError(
+                "A restored tournament should have the same standings, bye included."
+            )
+
+        try:
+            reportMatch(pairings[0][2], pairings[0][0], 1)
+        except TournamentException:
+            pass
+        else:
+            raise ValueError("Restored matches should still prevent rematches.")
+
+        registerPlayer("Ranger", 1)
+        if max(row[0] for row in playerStandings(1)) <= e:
+            raise ValueError("Players registered later should get new IDs.")
+    finally:
+        os.remove(path)
+
+    print "25. Tournaments can be exported to a snapshot and restored."
+
+
+def testBatchQueries():
+    for tournament_id in (1, 2, 3):
+        deleteMatches(tournament_id)
+        deletePlayers(tournament_id)
+    [id1, id2, id3, id4] = registerPlayers(
+        ["Flynn Taggart", "B.J. Blackowicz", "Commander Keen", "Dangerous Dave"], 1)
+    registerPlayers(["Duke Nukem", "Ranger", "Corvo Attano"], 2)
+    reportMatches([(id1, id2, False), (id3, id4, False)], 1)
+
+    ids = [1, 2, 3]
+    if countPlayersMany(ids) != {1: 4, 2: 3, 3: 0}:
+        raise ValueError("countPlayersMany() should count every tournament, empty ones too.")
+
+    for cached in (False, True):
+        if cached:
+            enableCache()
+            playerStandings(2)
+        try:
+            standings = playerStandingsMany(ids)
+            pairings = swissPairingsMany(ids)
+            if standings != dict((t, playerStandings(t)) for t in ids):
+                raise ValueError(
+                    "playerStandingsMany() should match playerStandings() for each tournament."
+                )
+            if pairings != dict((t, swissPairings(t)) for t in ids):
+                raise ValueError(
+                    "swissPairingsMany() should match swissPairings() for each tournament."
+                )
+        finally:
+            disableCache()
+
+    print "26. Counts, standings and pairings can be read for many tournaments at once."
+
+
+def testRatings():
+    deleteMatches(1)
+    deletePlayers(1)
+    [id1, id2, id3, id4] = registerPlayers(
+        ["Flynn Taggart", "B.J. Blackowicz", "Commander Keen", "Dangerous Dave"], 1,
+        [1400, 1700, 1500, 1600])
+
+    if [row[0] for row in playerStandings(1)] != [id2, id4, id3, id1]:
+        raise ValueError("Before any matches, players should be seeded by rating.")
+    pairings = swissPairings(1)
+    if [(row[0], row[2]) for row in pairings] != [(id2, id4), (id3, id1)]:
+        raise ValueError("The first round should be paired by rating.")
+
+    reportMatch(id1, id3, 1)
+    ratings = playerRatings(1)
+    if not (ratings[id1] > 1400 and ratings[id3] < 1500):
+        raise ValueError("A win should move the winner's rating up and the loser's down.")
+    if abs(ratings[id1] + ratings[id3] - 2900) > 1e-6:
+        raise ValueError("A game should not change the sum of the two players' ratings.")
+
+    standings = playerStandings(1)
+    reportMatch(id2, id4, 1, True)
+    if playerStandings(1) != standings:
+        raise ValueError("A draw should not affect standings.")
+    if not playerRatings(1)[id4] > 1600:
+        raise ValueError("A draw should move the lower-rated player's rating up.")
+
+    recomputed = recomputeRatings(1)
+    if recomputed != playerRatings(1) or len(recomputed) != 4:
+        raise ValueError("recomputeRatings() should store and return every rating.")
+
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        exportTournament(1, path)
+        deletePlayers(1)
+        importTournament(path)
+        if playerRatings(1) != recomputed:
+            raise ValueError("A restored tournament should keep its ratings.")
+    finally:
+        os.remove(path)
+
+    deleteMatches(1)
+    if playerRatings(1) != {id1: 1400, id2: 1700, id3: 1500, id4: 1600}:
+        raise ValueError("Deleting matches should put ratings back to the seeds.")
+
+    print "27. Players are seeded by rating, and ratings follow wins and draws."
+
+
+def testRounds():
+    deleteMatches(1)
+    deletePlayers(1)
+    [id1, id2, id3, id4] = registerPlayers(
+        ["Flynn Taggart", "B.J. Blackowicz", "Commander Keen", "Dangerous Dave"], 1)
+
+    pairings = startRound(1)
+    if len(pairings) != 2:
+        raise ValueError("startRound() should pair every player of an even field.")
+    if startRound(1) != pairings or swissPairings(1) != pairings:
+        raise ValueError("A round in progress should keep returning its stored pairings.")
+
+    (a, _, b, _), (c, _, d, _) = pairings
+    for winner, loser in ((a, c), (a, a)):
+        try:
+            reportMatch(winner, loser, 1)
+        except TournamentException:
+            pass
+        else:
+            raise ValueError("Results must be for a pairing of the current round.")
+
+    reportMatch(a, b, 1)
+    try:
+        reportMatch(b, a, 1, True)
+    except TournamentException:
+        pass
+    else:
+        raise ValueError("Only one result should be accepted per pairing.")
+
+    try:
+        reportMatches([(c, d, False), (a, c, False)], 1)
+    except TournamentException as e:
+        if [result for result, _ in e.errors] != [(a, c, False)]:
+            raise ValueError("Results outside the round's pairings should be listed.")
+    else:
+        raise ValueError("Results outside the round's pairings should be rejected.")
+    reportMatches([(d, c, False)], 1)
+
+    second = startRound(1)
+    if second == pairings or swissPairings(1) != second:
+        raise ValueError("Once every result is in, startRound() should pair a new round.")
+    if playerStandingsMany([1])[1] != playerStandings(1) or \
+            swissPairingsMany([1])[1] != second:
+        raise ValueError("Batch reads should see the stored pairings too.")
+
+    deleteMatches(1)
+    reportMatch(id1, id2, 1)
+    if startRound(1) != swissPairings(1):
+        raise ValueError("Deleting matches should start the rounds over.")
+
+    # Four players have met everyone after three rounds, so a fourth round
+    # could only be paired with rematches, which can never be reported.
+    deleteMatches(1)
+    for _ in range(3):
+        reportMatches([(p1, p2, False) for p1, _, p2, _ in startRound(1)], 1)
+    for _ in range(2):
+        try:
+            startRound(1)
+        except TournamentException:
+            pass
+        else:
+            raise ValueError("startRound() should refuse a round that needs a rematch.")
+
+    print "28. Rounds are paired once, and results are checked against their pairings."
+
+
+def testStandingsFeed():
+    if parseDelta("3,17:2:4") != (3, 17, 2, 4) or parseDelta("3,17:-") != (3, 17, None, None):
+        raise ValueError("parseDelta() should read the counts, or a removed player.")
+
+    deleteMatches(1)
+    deletePlayers(1)
+    [id1, id2] = registerPlayers(["Flynn Taggart", "B.J. Blackowicz"], 1)
+
+    with StandingsReplica([1]) as replica:
+        if sorted(replica.standings(1)) != sorted(playerStandings(1)):
+            raise ValueError("A replica should start from the current standings.")
+
+        registerPlayer("Commander Keen", 1)
+        reportMatch(id1, id2, 1)
+        changed = replica.poll(timeout=5)
+        changed |= replica.poll(timeout=0.5)
+        if changed != set([1]) or sorted(replica.standings(1)) != sorted(playerStandings(1)):
+            raise ValueError("A replica should follow new players and results.")
+
+        deletePlayers(1)
+        replica.poll(timeout=5)
+        if replica.standings(1) != []:
+            raise ValueError("A replica should drop deleted players.")
+
+    print "29. Standings replicas follow the change feed."
+
+
+def testConcurrentReports():
+    deleteMatches(1)
+    deletePlayers(1)
+    pool = ThreadPool(8)
+    try:
+        pool.map(lambda i: registerPlayer("Player {}".format(i), 1), range(9))
+        player_ids = [row[0] for row in playerStandings(1)]
+        if countPlayers(1) != 9 or any(row[3] for row in playerStandings(1)):
+            raise ValueError("Concurrent registrations should leave every record empty.")
+
+        reports = [(a, b) for a in player_ids for b in player_ids if a != b]
+        random.shuffle(reports)
+
+        def report(pair):
+            try:
+                reportMatch(pair[0], pair[1], 1)
+            except TournamentException:
+                return 0
+            return 1
+
+        accepted = sum(pool.map(report, reports))
+        if accepted != len(reports) // 2:
+            raise ValueError("Each pairing should be recorded once, whichever order it was reported in.")
+        if sum(row[3] for row in playerStandings(1)) != len(reports):
+            raise ValueError("Standings should count each recorded match once.")
+
+        # Batches for the same round, each result reported both ways at once.
+        deleteMatches(1)
+        batches = [[(id1, id2, False)] for id1, _, id2, _ in startRound(1)]
+        batches += [[(loser, winner, False)] for [(winner, loser, _)] in batches]
+        random.shuffle(batches)
+
+        def reportBatch(batch):
+            try:
+                reportMatches(batch, 1)
+            except TournamentException:
+                return 0
+            return 1
+
+        accepted = sum(pool.map(reportBatch, batches))
+    finally:
+        pool.close()
+        pool.join()
+
+    if accepted != len(batches) // 2:
+        raise ValueError("Each pairing of a round should be recorded by one batch.")
+    if sum(row[3] for row in playerStandings(1)) != len(batches) + 1:
+        raise ValueError("Standings should count each batch's result, and the bye, once.")
+
+    print "30. Concurrent reports and registrations keep one result per pairing."
+
+
+def testSimulation():
+    deleteMatches(1)
+    deletePlayers(1)
+    player_ids = registerPlayers(["Player {}".format(i) for i in range(8)], 1,
+                                 [2400, 1500, 1500, 1500, 1500, 1500, 1500, 1000])
+    for id1, _, id2, _ in swissPairings(1)[:2]:
+        reportMatch(id1, id2, 1)
+
+    forecast = simulateTournament(1, 3, trials=120, processes=1, seed=7)
+    for player_id in player_ids:
+        if abs(sum(forecast.distribution(player_id)) - 1) > 1e-9:
+            raise ValueError("Each player should finish somewhere in every trial.")
+    if [sum(forecast.counts[player_id][place] for player_id in player_ids)
+            for place in range(8)] != [120] * 8:
+        raise ValueError("Each place should be taken once in every trial.")
+    if forecast.topProbability(player_ids[0], 1) <= forecast.topProbability(player_ids[7], 1):
+        raise ValueError("The strongest player should win more often than the weakest.")
+
+    parallel = simulateTournament(1, 3, trials=120, processes=2, seed=7)
+    if parallel.counts != forecast.counts or parallel.clear_winners != forecast.clear_winners:
+        raise ValueError("A seed should give the same forecast on any number of processes.")
+
+    if roundsForClearWinner(1, 3, confidence=0, trials=10, processes=1) != 0:
+        raise ValueError("No more rounds are needed when any chance will do.")
+
+    print "31. Remaining rounds can be simulated to forecast finishing places."
+
+
+def inRecovery(session):
+    session.db_cursor.execute("SELECT pg_is_in_recovery();")
+    return session.db_cursor.fetchone()[0]
+
+
+def testReplicaRouting():
+    deleteMatches(1)
+    deletePlayers(1)
+    configureReplica(dsn=os.environ["TOURNAMENT_REPLICA_DSN"])
+    try:
+        for i in range(20):
+            registerPlayer("Player {}".format(i), 1)
+            if countPlayers(1) != i + 1:
+                raise ValueError("Reads should see the thread's own writes.")
+
+        with TournamentSession() as session:
+            if inRecovery(session):
+                raise ValueError("Sessions that may write should use the primary.")
+
+        deadline = time.time() + 10
+        while True:
+            with TournamentSession(read_only=True) as session:
+                if inRecovery(session):
+                    break
+            if time.time() > deadline:
+                raise ValueError("Reads should go to the replica once it has caught up.")
+            time.sleep(0.05)
+
+        configureReplica(dsn=os.environ["TOURNAMENT_REPLICA_DSN"], read_your_writes=False)
+        registerPlayer("Commander Keen", 1)
+        with TournamentSession(read_only=True) as session:
+            if not inRecovery(session):
+                raise ValueError("Without read-your-writes, reads should always use the replica.")
+    finally:
+        disableReplica()
+
+    with TournamentSession(read_only=True) as session:
+        if inRecovery(session):
+            raise ValueError("Reads should go back to the primary once the replica is disabled.")
+
+    print "32. Read-only calls go to the replica, after it has the thread's writes."
+
+
+def testColumnStandings():
+    deleteMatches(1)
+    deletePlayers(1)
+    player_ids = registerPlayers(["Player {}".format(i) for i in range(9)], 1,
+                                 [1500 + 10 * i for i in range(9)])
+    startRound(1)
+    reportMatches([(id1, id2, False) for id1, _, id2, _ in swissPairings(1)], 1)
+
+    columns = columnStandings(1)
+    standings = playerStandings(1)
+    if not isinstance(columns, StandingsColumns) or columns != standings:
+        raise ValueError("columnStandings should hold the same rows as playerStandings.")
+    if list(columns) != standings or columns[0] != standings[0] or \
+            columns[2:5] != standings[2:5]:
+        raise ValueError("Columns should iterate, index and slice like rows.")
+    if sorted(columns.ids) != sorted(player_ids) or columns.ids.typecode != 'i' or \
+            list(columns.wins) != [row[2] for row in standings]:
+        raise ValueError("IDs, wins and matches should be held in typed arrays.")
+    if len(columns.ratings) != len(columns):
+        raise ValueError("Columns should carry each player's rating.")
+
+    results = [(id1, id2) for id1, _, id2, _ in standings[1:3]]
+    if computeTiebreaks(columns, results) != computeTiebreaks(standings, results):
+        raise ValueError("Tiebreaks should be the same from columns as from rows.")
+    if pairPlayers(columns[1:], {}) != pairPlayers(standings[1:], {}):
+        raise ValueError("Columns should be paired as their rows would be.")
+
+    print "33. Standings can be read column by column."
+
+
 if __name__ == '__main__':
+    # Run with --memory to test the in-memory backend instead of PostgreSQL.
+    if "--memory" in sys.argv:
+        setBackend(MemoryBackend())
+
     testDeleteMatches()
     testDelete()
     testCount()
@@ -284,5 +1164,33 @@ if __name__ == '__main__':
     testByes()
     testNoRepeatMatches()
     testDrawDoesNotAffectStandings()
+    testSessionRollsBackOnError()
+    testRebuildStandings()
+    testRegisterPlayersInBulk()
+    testReportMatchesInBatch()
+    testPairingsAvoidRematches()
+    if isinstance(getBackend(), PostgresBackend):
+        testHotQueriesUseIndexes()
+    testCachedReadsInvalidatedByWrites()
+    if isinstance(getBackend(), PostgresBackend):
+        testBackendsAgree()
+    testMetricsRecordCallsAndStatements()
+    testSessionContinuesAfterRejectedResult()
+    testPagedAndStreamedStandings()
+    testTiebreaks()
+    testCreateAndDropTournaments()
+    testExportAndImportTournament()
+    testBatchQueries()
+    testRatings()
+    testRounds()
+    if isinstance(getBackend(), PostgresBackend):
+        testStandingsFeed()
+    testConcurrentReports()
+    testSimulation()
+    # Needs a streaming standby of the test database, e.g.
+    # TOURNAMENT_REPLICA_DSN="port=5433 dbname=tournament".
+    if isinstance(getBackend(), PostgresBackend) and os.environ.get("TOURNAMENT_REPLICA_DSN"):
+        testReplicaRouting()
+    testColumnStandings()
 
     print "Success!  All tests pass!"
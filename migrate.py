@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+#
+# migrate.py -- upgrades a live tournament database in place
+#
+# Schema changes made after tournament.sql live in the migrations directory
+# as numbered SQL files (001_add_lookup_indexes.sql, ...). Each file is
+# written to be idempotent and is applied at most once, in number order; the
+# versions already applied are recorded in the schema_migrations table.
+#
+# Usage: python migrate.py [--database tournament] [--check]
+
+import argparse
+import os
+import re
+
+import psycopg2
+from tournament import DATABASE_NAME
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "migrations")
+
+# Arbitrary key for the advisory lock that stops two runners from applying
+# migrations to the same database at once.
+MIGRATION_LOCK_KEY = 7235170
+
+_MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# Statements mirroring the hot queries in tournament.py, each with the index
+# it should be able to use. The parameter values are arbitrary.
+HOT_QUERIES = [
+    ("countPlayers",
+     "SELECT COUNT(*) FROM players WHERE tournament_id = %s;",
+     (1,), "players_pkey"),
+    ("deletePlayers",
+     "DELETE FROM players WHERE tournament_id = %s;",
+     (1,), "players_pkey"),
+    ("deleteMatches",
+     "DELETE FROM matches WHERE tournament_id = %s;",
+     (1,), "matches_pkey"),
+    ("swissPairings opponent history",
+     "SELECT winner_id, loser_id FROM matches WHERE tournament_id = %s;",
+     (1,), "matches_pkey"),
+    ("player delete cascade to losses",
+     "SELECT 1 FROM matches WHERE loser_id = %s;",
+     (1,), "matches_loser_idx"),
+    ("reportMatch rematch check",
+     "SELECT count(*) FROM matches "
+     "WHERE tournament_id = %(tournament_id)s "
+     "AND LEAST(winner_id, loser_id) = LEAST(%(winner)s, %(loser)s) "
+     "AND GREATEST(winner_id, loser_id) = GREATEST(%(winner)s, %(loser)s);",
+     {'tournament_id': 1, 'winner': 1, 'loser': 2}, "matches_pair_idx"),
+    ("playerStandings",
+     "SELECT p.id, p.name, s.wins, s.matches "
+     "FROM standings s JOIN players p "
+     "ON p.tournament_id = s.tournament_id AND p.id = s.player_id "
+     "WHERE s.tournament_id = %s "
+     "ORDER BY s.wins DESC, s.matches, s.player_id;",
+     (1,), "standings_rank_idx"),
+    ("topStandings next page",
+     "SELECT p.id, p.name, s.wins, s.matches "
+     "FROM standings s JOIN players p "
+     "ON p.tournament_id = s.tournament_id AND p.id = s.player_id "
+     "WHERE s.tournament_id = %s AND s.wins < %s "
+     "ORDER BY s.wins DESC, s.matches, s.player_id LIMIT %s;",
+     (1, 3, 50), "standings_rank_idx"),
+    ("playerStandingsMany",
+     "SELECT s.tournament_id, p.id, p.name, s.wins, s.matches "
+     "FROM standings s JOIN players p "
+     "ON p.tournament_id = s.tournament_id AND p.id = s.player_id "
+     "WHERE s.tournament_id = ANY(%s) "
+     "ORDER BY s.tournament_id, s.wins DESC, s.matches, s.player_id;",
+     ([1, 2],), "standings_rank_idx"),
+    ("startRound current round",
+     "SELECT max(round) FROM rounds WHERE tournament_id = %s;",
+     (1,), "rounds_pkey"),
+    ("startRound bye history",
+     "SELECT player_id, round FROM assigned_byes WHERE tournament_id = %s;",
+     (1,), "assigned_byes_pkey"),
+    ("reportMatch pairing check",
+     "SELECT 1 FROM pairings "
+     "WHERE tournament_id = %(tournament_id)s AND round = %(round)s "
+     "AND LEAST(player1_id, player2_id) = LEAST(%(winner)s, %(loser)s) "
+     "AND GREATEST(player1_id, player2_id) = GREATEST(%(winner)s, %(loser)s);",
+     {'tournament_id': 1, 'round': 1, 'winner': 1, 'loser': 2}, "pairings_pair_idx"),
+]
+
+
+def listMigrations(directory=MIGRATIONS_DIR):
+    """Returns the migrations in a directory as (version, name, path) tuples,
+    sorted by version.
+
+    Raises:
+      ValueError: if two files share a version number
+    """
+
+    migrations = []
+    for filename in os.listdir(directory):
+        match = _MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2),
+                               os.path.join(directory, filename)))
+
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError("Migration version numbers must be unique.")
+
+    return migrations
+
+
+def migrate(database_name=DATABASE_NAME, directory=MIGRATIONS_DIR):
+    """Applies every migration that has not yet been applied.
+
+    Each migration runs in its own transaction together with the record of
+    it being applied, so a failing migration leaves the database at the
+    previous version.
+
+    Args:
+      database_name: name of the database to upgrade
+      directory: directory holding the numbered migration files
+
+    Returns:
+      A list of the (version, name) pairs that were applied.
+    """
+
+    db_conn = psycopg2.connect("dbname={}".format(database_name))
+    db_cursor = db_conn.cursor()
+
+    try:
+        db_cursor.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_KEY,))
+
+        db_cursor.execute("CREATE TABLE IF NOT EXISTS schema_migrations("
+                          "version INT PRIMARY KEY, "
+                          "name TEXT NOT NULL, "
+                          "applied_at TIMESTAMP NOT NULL DEFAULT now());")
+        db_conn.commit()
+
+        db_cursor.execute("SELECT version FROM schema_migrations;")
+        applied_versions = set(row[0] for row in db_cursor.fetchall())
+
+        applied = []
+        for version, name, path in listMigrations(directory):
+            if version in applied_versions:
+                continue
+
+            with open(path) as migration_file:
+                db_cursor.execute(migration_file.read())
+
+            db_cursor.execute("INSERT INTO schema_migrations (version, name) "
+                              "VALUES (%s, %s);", (version, name))
+            db_conn.commit()
+
+            applied.append((version, name))
+
+        return applied
+    finally:
+        db_conn.rollback()
+        db_cursor.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_KEY,))
+        db_conn.commit()
+        db_cursor.close()
+        db_conn.close()
+
+
+def checkIndexes(database_name=DATABASE_NAME):
+    """Confirms with EXPLAIN that each hot query can use its index.
+
+    Sequential scans are disabled for the check so that the result does not
+    depend on how many rows the tables currently hold. On partitioned tables
+    the plan names the partitions' own indexes, which count as the index
+    they were created from.
+
+    Args:
+      database_name: name of the database to check
+
+    Returns:
+      A list of (description, expected index, plan) tuples for the queries
+      whose plan does not use the expected index; empty if all of them do.
+    """
+
+    db_conn = psycopg2.connect("dbname={}".format(database_name))
+    db_cursor = db_conn.cursor()
+
+    try:
+        db_cursor.execute("SET LOCAL enable_seqscan = off;")
+
+        db_cursor.execute("SELECT parent.relname, child.relname "
+                          "FROM pg_inherits i "
+                          "JOIN pg_class parent ON parent.oid = i.inhparent "
+                          "JOIN pg_class child ON child.oid = i.inhrelid "
+                          "WHERE parent.relkind = 'I';")
+        partition_indexes = {}
+        for parent, child in db_cursor.fetchall():
+            partition_indexes.setdefault(parent, []).append(child)
+
+        failures = []
+        for description, query, params, index in HOT_QUERIES:
+            db_cursor.execute("EXPLAIN " + query, params)
+            plan = "\n".join(row[0] for row in db_cursor.fetchall())
+
+            names = [index] + partition_indexes.get(index, [])
+            if not any(name in plan for name in names):
+                failures.append((description, index, plan))
+
+        return failures
+    finally:
+        db_conn.rollback()
+        db_cursor.close()
+        db_conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Upgrade a tournament database to the latest schema.")
+    parser.add_argument("--database", default=DATABASE_NAME,
+                        help="name of the database to upgrade")
+    parser.add_argument("--check", action="store_true",
+                        help="after migrating, verify hot queries use their indexes")
+    args = parser.parse_args()
+
+    for version, name in migrate(args.database):
+        print("Applied migration {:03d} {}".format(version, name))
+
+    if args.check:
+        failures = checkIndexes(args.database)
+        for description, index, plan in failures:
+            print("{} does not use {}:\n{}".format(description, index, plan))
+
+        if failures:
+            raise SystemExit(1)
+
+        print("All hot queries use their indexes.")
+
+
+if __name__ == '__main__':
+    main()
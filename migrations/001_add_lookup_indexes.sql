@@ -0,0 +1,8 @@
+-- Indexes for the lookups tournament.py makes on every call:
+-- counting and deleting a tournament's players, deleting and loading a
+-- tournament's matches, and finding a deleted player's losses when
+-- ON DELETE CASCADE removes them (winner_id is already covered by the
+-- matches primary key).
+CREATE INDEX IF NOT EXISTS players_tournament_idx ON players (tournament_id);
+CREATE INDEX IF NOT EXISTS matches_tournament_idx ON matches (tournament_id);
+CREATE INDEX IF NOT EXISTS matches_loser_idx ON matches (loser_id);
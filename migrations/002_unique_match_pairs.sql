@@ -0,0 +1,7 @@
+-- Two players may only meet once, whichever of them won. The matches primary
+-- key is ordered (winner_id, loser_id), so it allows the same pair to be
+-- stored twice in opposite orders; indexing the pair in canonical
+-- (lowest ID, highest ID) order closes that gap and gives the rematch check
+-- a single index probe instead of an OR of two lookups.
+CREATE UNIQUE INDEX IF NOT EXISTS matches_pair_idx
+	ON matches (LEAST(winner_id, loser_id), GREATEST(winner_id, loser_id));
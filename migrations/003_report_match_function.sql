@@ -0,0 +1,38 @@
+-- Validates and records a match result in a single call, so reportMatch costs
+-- one round trip instead of three. PL/pgSQL prepares each statement once per
+-- connection and reuses the plan on later calls.
+--
+-- Rule violations are raised with their own SQLSTATEs, which the API turns
+-- into TournamentException:
+--   TM001  a player cannot play against themselves
+--   TM002  both players must be registered for the tournament
+--   TM003  the players have already met (also raised when a concurrent
+--          report of the same pairing wins the race to matches_pair_idx)
+CREATE OR REPLACE FUNCTION report_match(winner INT, loser INT, t INT) RETURNS VOID AS $$
+BEGIN
+	IF winner = loser THEN
+		RAISE EXCEPTION 'A player cannot play against themselves.'
+			USING ERRCODE = 'TM001';
+	END IF;
+
+	IF (SELECT count(*) FROM players
+	    WHERE id IN (winner, loser) AND tournament_id = t) <> 2 THEN
+		RAISE EXCEPTION 'Both players must exist and be registered for the correct tournament.'
+			USING ERRCODE = 'TM002';
+	END IF;
+
+	IF EXISTS (SELECT 1 FROM matches
+	           WHERE LEAST(winner_id, loser_id) = LEAST(winner, loser)
+	           AND GREATEST(winner_id, loser_id) = GREATEST(winner, loser)) THEN
+		RAISE EXCEPTION 'Players can only have played each other once.'
+			USING ERRCODE = 'TM003';
+	END IF;
+
+	INSERT INTO matches (winner_id, loser_id, tournament_id)
+	VALUES (winner, loser, t);
+EXCEPTION
+	WHEN unique_violation THEN
+		RAISE EXCEPTION 'Players can only have played each other once.'
+			USING ERRCODE = 'TM003';
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,306 @@
+-- Partitions players, matches, assigned_byes and standings by tournament_id
+-- (PostgreSQL 12 or later).
+--
+-- Tournaments made with create_tournament() get a partition of their own in
+-- each table, so their queries touch only their own rows and drop_tournament()
+-- can remove or archive them by detaching the partitions, however large they
+-- are. Rows for tournament IDs that were never created go to DEFAULT
+-- partitions, so code that just uses a tournament ID keeps working.
+--
+-- Keys and foreign keys on partitioned tables must include the partition key,
+-- so players are keyed by (tournament_id, id) and the other tables reference
+-- players by (tournament_id, player_id). This also makes the database itself
+-- refuse a match or bye between players of different tournaments.
+
+CREATE TABLE IF NOT EXISTS tournaments(
+	id SERIAL PRIMARY KEY,
+	name TEXT NOT NULL,
+	created_at TIMESTAMP NOT NULL DEFAULT now(),
+	archived_at TIMESTAMP
+);
+
+DO $convert$
+BEGIN
+	IF EXISTS (SELECT 1 FROM pg_partitioned_table
+	           WHERE partrelid = 'players'::regclass) THEN
+		RETURN;
+	END IF;
+
+	-- Set the data aside and drop the old tables, freeing their index names.
+	CREATE TEMP TABLE players_copy ON COMMIT DROP AS SELECT * FROM players;
+	CREATE TEMP TABLE matches_copy ON COMMIT DROP AS SELECT * FROM matches;
+	CREATE TEMP TABLE assigned_byes_copy ON COMMIT DROP AS SELECT * FROM assigned_byes;
+	CREATE TEMP TABLE standings_copy ON COMMIT DROP AS SELECT * FROM standings;
+
+	ALTER SEQUENCE players_id_seq OWNED BY NONE;
+	DROP VIEW IF EXISTS player_standings;
+	DROP TABLE standings, assigned_byes, matches, players;
+
+	CREATE TABLE players(
+		id INT NOT NULL DEFAULT nextval('players_id_seq'),
+		name TEXT NOT NULL,
+		tournament_id INT NOT NULL,
+		PRIMARY KEY(tournament_id, id)
+	) PARTITION BY LIST (tournament_id);
+
+	ALTER SEQUENCE players_id_seq OWNED BY players.id;
+
+	CREATE TABLE matches(
+		winner_id INT NOT NULL,
+		loser_id INT NOT NULL,
+		tournament_id INT NOT NULL,
+		PRIMARY KEY(tournament_id, winner_id, loser_id),
+		FOREIGN KEY(tournament_id, winner_id)
+			REFERENCES players(tournament_id, id) ON DELETE CASCADE,
+		FOREIGN KEY(tournament_id, loser_id)
+			REFERENCES players(tournament_id, id) ON DELETE CASCADE
+	) PARTITION BY LIST (tournament_id);
+
+	CREATE TABLE assigned_byes(
+		tournament_id INT NOT NULL,
+		player_id INT NOT NULL,
+		PRIMARY KEY(tournament_id, player_id),
+		FOREIGN KEY(tournament_id, player_id)
+			REFERENCES players(tournament_id, id) ON DELETE CASCADE
+	) PARTITION BY LIST (tournament_id);
+
+	CREATE TABLE standings(
+		player_id INT NOT NULL,
+		tournament_id INT NOT NULL,
+		wins INT NOT NULL DEFAULT 0,
+		matches INT NOT NULL DEFAULT 0,
+		byes INT NOT NULL DEFAULT 0,
+		PRIMARY KEY(player_id, tournament_id),
+		FOREIGN KEY(tournament_id, player_id)
+			REFERENCES players(tournament_id, id) ON DELETE CASCADE
+	) PARTITION BY LIST (tournament_id);
+
+	CREATE TABLE players_default PARTITION OF players DEFAULT;
+	CREATE TABLE matches_default PARTITION OF matches DEFAULT;
+	CREATE TABLE assigned_byes_default PARTITION OF assigned_byes DEFAULT;
+	CREATE TABLE standings_default PARTITION OF standings DEFAULT;
+
+	-- Copied before the triggers exist, so standings are taken as they were.
+	INSERT INTO players (id, name, tournament_id)
+	SELECT id, name, tournament_id FROM players_copy;
+	INSERT INTO matches (winner_id, loser_id, tournament_id)
+	SELECT winner_id, loser_id, tournament_id FROM matches_copy;
+	INSERT INTO assigned_byes (tournament_id, player_id)
+	SELECT tournament_id, player_id FROM assigned_byes_copy;
+	INSERT INTO standings (player_id, tournament_id, wins, matches, byes)
+	SELECT player_id, tournament_id, wins, matches, byes FROM standings_copy;
+
+	-- The indexes of tournament.sql and migrations 001 and 002. Two players
+	-- of a tournament may still only meet once: players belong to a single
+	-- tournament, so a pair is unique within it if it is unique anywhere.
+	-- The primary keys of players and matches now lead with tournament_id,
+	-- which makes players_tournament_idx and matches_tournament_idx
+	-- unnecessary; other indexes do not, so that each tournament lookup has
+	-- one index to use.
+	CREATE INDEX standings_rank_idx
+		ON standings (tournament_id, wins DESC, matches, player_id);
+	CREATE INDEX matches_loser_idx ON matches (loser_id);
+	CREATE UNIQUE INDEX matches_pair_idx
+		ON matches (LEAST(winner_id, loser_id), GREATEST(winner_id, loser_id), tournament_id);
+
+	CREATE TRIGGER players_standings
+		AFTER INSERT ON players
+		FOR EACH ROW EXECUTE PROCEDURE standings_add_player();
+
+	CREATE TRIGGER matches_standings
+		AFTER INSERT OR UPDATE OR DELETE ON matches
+		FOR EACH ROW EXECUTE PROCEDURE standings_count_match();
+
+	CREATE TRIGGER assigned_byes_standings
+		AFTER INSERT OR UPDATE OR DELETE ON assigned_byes
+		FOR EACH ROW EXECUTE PROCEDURE standings_count_bye();
+
+	CREATE VIEW player_standings AS
+		SELECT p.id, p.name, s.tournament_id, s.wins, s.matches, s.byes
+		FROM standings s
+		JOIN players p ON p.id = s.player_id AND p.tournament_id = s.tournament_id
+		ORDER BY s.tournament_id, s.wins DESC, s.matches, s.player_id;
+END;
+$convert$;
+
+-- Standings updates name the tournament so that they only visit its partition.
+CREATE OR REPLACE FUNCTION standings_count_match() RETURNS TRIGGER AS $$
+BEGIN
+	IF TG_OP IN ('UPDATE', 'DELETE') THEN
+		UPDATE standings SET wins = wins - 1, matches = matches - 1
+		WHERE tournament_id = OLD.tournament_id AND player_id = OLD.winner_id;
+		UPDATE standings SET matches = matches - 1
+		WHERE tournament_id = OLD.tournament_id AND player_id = OLD.loser_id;
+	END IF;
+
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		UPDATE standings SET wins = wins + 1, matches = matches + 1
+		WHERE tournament_id = NEW.tournament_id AND player_id = NEW.winner_id;
+		UPDATE standings SET matches = matches + 1
+		WHERE tournament_id = NEW.tournament_id AND player_id = NEW.loser_id;
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION standings_count_bye() RETURNS TRIGGER AS $$
+BEGIN
+	IF TG_OP IN ('UPDATE', 'DELETE') THEN
+		UPDATE standings
+		SET wins = wins - 1, matches = matches - 1, byes = byes - 1
+		WHERE tournament_id = OLD.tournament_id AND player_id = OLD.player_id;
+	END IF;
+
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		UPDATE standings
+		SET wins = wins + 1, matches = matches + 1, byes = byes + 1
+		WHERE tournament_id = NEW.tournament_id AND player_id = NEW.player_id;
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- As in migration 003, with the rematch check confined to the tournament's
+-- partition of matches_pair_idx.
+CREATE OR REPLACE FUNCTION report_match(winner INT, loser INT, t INT) RETURNS VOID AS $$
+BEGIN
+	IF winner = loser THEN
+		RAISE EXCEPTION 'A player cannot play against themselves.'
+			USING ERRCODE = 'TM001';
+	END IF;
+
+	IF (SELECT count(*) FROM players
+	    WHERE id IN (winner, loser) AND tournament_id = t) <> 2 THEN
+		RAISE EXCEPTION 'Both players must exist and be registered for the correct tournament.'
+			USING ERRCODE = 'TM002';
+	END IF;
+
+	IF EXISTS (SELECT 1 FROM matches
+	           WHERE tournament_id = t
+	           AND LEAST(winner_id, loser_id) = LEAST(winner, loser)
+	           AND GREATEST(winner_id, loser_id) = GREATEST(winner, loser)) THEN
+		RAISE EXCEPTION 'Players can only have played each other once.'
+			USING ERRCODE = 'TM003';
+	END IF;
+
+	INSERT INTO matches (winner_id, loser_id, tournament_id)
+	VALUES (winner, loser, t);
+EXCEPTION
+	WHEN unique_violation THEN
+		RAISE EXCEPTION 'Players can only have played each other once.'
+			USING ERRCODE = 'TM003';
+END;
+$$ LANGUAGE plpgsql;
+
+-- Creates a tournament with its own partition of each table and returns its
+-- ID. Without an ID, the next one from the tournaments sequence that is
+-- neither taken nor in use by players is chosen. Given the ID of a
+-- tournament whose rows are in the DEFAULT partitions, those rows are moved
+-- to the new partitions. Either way the DEFAULT partitions are scanned once,
+-- to confirm they hold no rows for the new partitions.
+--
+-- TM004 is raised if a tournament with the ID was already created.
+CREATE OR REPLACE FUNCTION create_tournament(tournament_name TEXT, t INT DEFAULT NULL)
+RETURNS INT AS $$
+DECLARE
+	parent TEXT;
+BEGIN
+	IF t IS NULL THEN
+		LOOP
+			t := nextval(pg_get_serial_sequence('tournaments', 'id'));
+			EXIT WHEN NOT EXISTS (SELECT 1 FROM tournaments WHERE id = t)
+			      AND NOT EXISTS (SELECT 1 FROM players WHERE tournament_id = t);
+		END LOOP;
+	ELSIF EXISTS (SELECT 1 FROM tournaments WHERE id = t) THEN
+		RAISE EXCEPTION 'Tournament % has already been created.', t
+			USING ERRCODE = 'TM004';
+	END IF;
+
+	INSERT INTO tournaments (id, name) VALUES (t, tournament_name);
+
+	-- Build each partition as a plain table holding the tournament's rows,
+	-- empty the DEFAULT partitions of them (the cascade from players
+	-- reaches the other tables), then attach.
+	FOREACH parent IN ARRAY ARRAY['players', 'matches', 'assigned_byes', 'standings'] LOOP
+		EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)',
+		               parent || '_t' || t, parent);
+		EXECUTE format('INSERT INTO %I SELECT * FROM %I WHERE tournament_id = $1',
+		               parent || '_t' || t, parent || '_default') USING t;
+	END LOOP;
+
+	DELETE FROM players_default WHERE tournament_id = t;
+
+	FOREACH parent IN ARRAY ARRAY['players', 'matches', 'assigned_byes', 'standings'] LOOP
+		EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES IN (%s)',
+		               parent, parent || '_t' || t, t);
+	END LOOP;
+
+	RETURN t;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Removes a tournament. A tournament made with create_tournament() has its
+-- partitions detached, which takes the same time however many rows they
+-- hold; they are then dropped, or with archive kept as standalone
+-- <table>_t<id>_archived tables. Any other tournament's rows are deleted.
+--
+-- TM005 is raised when archiving a tournament that has no partitions.
+CREATE OR REPLACE FUNCTION drop_tournament(t INT, archive BOOLEAN DEFAULT FALSE)
+RETURNS VOID AS $$
+DECLARE
+	parent TEXT;
+	part TEXT;
+	fk TEXT;
+BEGIN
+	IF NOT EXISTS (SELECT 1 FROM tournaments WHERE id = t AND archived_at IS NULL) THEN
+		IF archive THEN
+			RAISE EXCEPTION 'Only tournaments made with createTournament can be archived.'
+				USING ERRCODE = 'TM005';
+		END IF;
+
+		DELETE FROM players WHERE tournament_id = t;
+		RETURN;
+	END IF;
+
+	-- Referencing tables first. Detached tables keep copies of the foreign
+	-- keys, which are dropped so that players can be detached in turn.
+	FOREACH parent IN ARRAY ARRAY['standings', 'assigned_byes', 'matches', 'players'] LOOP
+		part := parent || '_t' || t;
+
+		EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', parent, part);
+
+		FOR fk IN SELECT conname FROM pg_constraint
+		          WHERE conrelid = part::regclass AND contype = 'f' LOOP
+			EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', part, fk);
+		END LOOP;
+
+		IF archive THEN
+			EXECUTE format('ALTER TABLE %I RENAME TO %I', part, part || '_archived');
+		ELSE
+			EXECUTE format('DROP TABLE %I', part);
+		END IF;
+	END LOOP;
+
+	IF archive THEN
+		UPDATE tournaments SET archived_at = now() WHERE id = t;
+	ELSE
+		DELETE FROM tournaments WHERE id = t;
+	END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Deletes a tournament's matches. A created tournament's partition of
+-- matches is truncated instead of deleted row by row, and its standings are
+-- reset to just the byes.
+CREATE OR REPLACE FUNCTION delete_matches(t INT) RETURNS VOID AS $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM tournaments WHERE id = t AND archived_at IS NULL) THEN
+		EXECUTE format('TRUNCATE %I', 'matches_t' || t);
+		UPDATE standings SET wins = byes, matches = byes WHERE tournament_id = t;
+	ELSE
+		DELETE FROM matches WHERE tournament_id = t;
+	END IF;
+END;
+$$ LANGUAGE plpgsql;
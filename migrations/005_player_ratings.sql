@@ -0,0 +1,211 @@
+-- Elo ratings for players, for seeding and for breaking ties in pairings.
+--
+-- Every player has a seed_rating, given at registration (1500 if not), and a
+-- rating that starts at the seed and is updated by the triggers below in the
+-- same transaction as each recorded match or draw. Draws, which do not count
+-- in the standings, are now kept in a draws table so that the ratings can be
+-- recomputed from the full history. K_FACTOR and INITIAL_RATING in
+-- tournament_ratings.py must match the values used here.
+
+ALTER TABLE players ADD COLUMN IF NOT EXISTS seed_rating DOUBLE PRECISION NOT NULL DEFAULT 1500;
+ALTER TABLE players ADD COLUMN IF NOT EXISTS rating DOUBLE PRECISION NOT NULL DEFAULT 1500;
+
+CREATE TABLE IF NOT EXISTS draws(
+	player1_id INT NOT NULL,
+	player2_id INT NOT NULL,
+	tournament_id INT NOT NULL,
+	CHECK (player1_id <> player2_id),
+	FOREIGN KEY(tournament_id, player1_id)
+		REFERENCES players(tournament_id, id) ON DELETE CASCADE,
+	FOREIGN KEY(tournament_id, player2_id)
+		REFERENCES players(tournament_id, id) ON DELETE CASCADE
+) PARTITION BY LIST (tournament_id);
+
+CREATE TABLE IF NOT EXISTS draws_default PARTITION OF draws DEFAULT;
+
+CREATE INDEX IF NOT EXISTS draws_tournament_idx ON draws (tournament_id);
+
+-- Tournaments created before this migration get their partition of draws.
+DO $partitions$
+DECLARE
+	t INT;
+BEGIN
+	FOR t IN SELECT id FROM tournaments WHERE archived_at IS NULL LOOP
+		EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF draws FOR VALUES IN (%s)',
+		               'draws_t' || t, t);
+	END LOOP;
+END;
+$partitions$;
+
+-- Expected score of a player rated a against a player rated b.
+CREATE OR REPLACE FUNCTION elo_expected(a DOUBLE PRECISION, b DOUBLE PRECISION)
+RETURNS DOUBLE PRECISION AS $$
+	SELECT 1 / (1 + power(10, (b - a) / 400));
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Applies one game's Elo update, where score is player a's result (1 for a
+-- win, 0.5 for a draw). Both rows are locked in ID order first, so games
+-- reported at the same time are applied one after the other.
+CREATE OR REPLACE FUNCTION rate_game(t INT, a INT, b INT, score DOUBLE PRECISION)
+RETURNS VOID AS $$
+DECLARE
+	rating_a DOUBLE PRECISION;
+	rating_b DOUBLE PRECISION;
+	change DOUBLE PRECISION;
+BEGIN
+	PERFORM 1 FROM players
+	WHERE tournament_id = t AND id IN (a, b)
+	ORDER BY id
+	FOR UPDATE;
+
+	SELECT rating INTO rating_a FROM players WHERE tournament_id = t AND id = a;
+	SELECT rating INTO rating_b FROM players WHERE tournament_id = t AND id = b;
+
+	change := 32 * (score - elo_expected(rating_a, rating_b));
+
+	UPDATE players SET rating = rating + change WHERE tournament_id = t AND id = a;
+	UPDATE players SET rating = rating - change WHERE tournament_id = t AND id = b;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ratings_count_match() RETURNS TRIGGER AS $$
+BEGIN
+	PERFORM rate_game(NEW.tournament_id, NEW.winner_id, NEW.loser_id, 1);
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ratings_count_draw() RETURNS TRIGGER AS $$
+BEGIN
+	PERFORM rate_game(NEW.tournament_id, NEW.player1_id, NEW.player2_id, 0.5);
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS matches_ratings ON matches;
+CREATE TRIGGER matches_ratings
+	AFTER INSERT ON matches
+	FOR EACH ROW EXECUTE PROCEDURE ratings_count_match();
+
+DROP TRIGGER IF EXISTS draws_ratings ON draws;
+CREATE TRIGGER draws_ratings
+	AFTER INSERT ON draws
+	FOR EACH ROW EXECUTE PROCEDURE ratings_count_draw();
+
+-- Records a draw in a single call, checking the same rules as report_match()
+-- apart from the one against rematches: draws are not counted as the
+-- players having met.
+CREATE OR REPLACE FUNCTION report_draw(a INT, b INT, t INT) RETURNS VOID AS $$
+BEGIN
+	IF a = b THEN
+		RAISE EXCEPTION 'A player cannot play against themselves.'
+			USING ERRCODE = 'TM001';
+	END IF;
+
+	IF (SELECT count(*) FROM players
+	    WHERE id IN (a, b) AND tournament_id = t) <> 2 THEN
+		RAISE EXCEPTION 'Both players must exist and be registered for the correct tournament.'
+			USING ERRCODE = 'TM002';
+	END IF;
+
+	INSERT INTO draws (player1_id, player2_id, tournament_id) VALUES (a, b, t);
+END;
+$$ LANGUAGE plpgsql;
+
+-- As in migration 004, with draws partitioned like the other tables. The
+-- partitions copy the parents' CHECK constraints too, as draws has one and
+-- ATTACH PARTITION refuses a table without it.
+CREATE OR REPLACE FUNCTION create_tournament(tournament_name TEXT, t INT DEFAULT NULL)
+RETURNS INT AS $$
+DECLARE
+	parent TEXT;
+BEGIN
+	IF t IS NULL THEN
+		LOOP
+			t := nextval(pg_get_serial_sequence('tournaments', 'id'));
+			EXIT WHEN NOT EXISTS (SELECT 1 FROM tournaments WHERE id = t)
+			      AND NOT EXISTS (SELECT 1 FROM players WHERE tournament_id = t);
+		END LOOP;
+	ELSIF EXISTS (SELECT 1 FROM tournaments WHERE id = t) THEN
+		RAISE EXCEPTION 'Tournament % has already been created.', t
+			USING ERRCODE = 'TM004';
+	END IF;
+
+	INSERT INTO tournaments (id, name) VALUES (t, tournament_name);
+
+	FOREACH parent IN ARRAY ARRAY['players', 'matches', 'draws', 'assigned_byes', 'standings'] LOOP
+		EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+		               parent || '_t' || t, parent);
+		EXECUTE format('INSERT INTO %I SELECT * FROM %I WHERE tournament_id = $1',
+		               parent || '_t' || t, parent || '_default') USING t;
+	END LOOP;
+
+	DELETE FROM players_default WHERE tournament_id = t;
+
+	FOREACH parent IN ARRAY ARRAY['players', 'matches', 'draws', 'assigned_byes', 'standings'] LOOP
+		EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES IN (%s)',
+		               parent, parent || '_t' || t, t);
+	END LOOP;
+
+	RETURN t;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION drop_tournament(t INT, archive BOOLEAN DEFAULT FALSE)
+RETURNS VOID AS $$
+DECLARE
+	parent TEXT;
+	part TEXT;
+	fk TEXT;
+BEGIN
+	IF NOT EXISTS (SELECT 1 FROM tournaments WHERE id = t AND archived_at IS NULL) THEN
+		IF archive THEN
+			RAISE EXCEPTION 'Only tournaments made with createTournament can be archived.'
+				USING ERRCODE = 'TM005';
+		END IF;
+
+		DELETE FROM players WHERE tournament_id = t;
+		RETURN;
+	END IF;
+
+	FOREACH parent IN ARRAY ARRAY['standings', 'assigned_byes', 'draws', 'matches', 'players'] LOOP
+		part := parent || '_t' || t;
+
+		EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', parent, part);
+
+		FOR fk IN SELECT conname FROM pg_constraint
+		          WHERE conrelid = part::regclass AND contype = 'f' LOOP
+			EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', part, fk);
+		END LOOP;
+
+		IF archive THEN
+			EXECUTE format('ALTER TABLE %I RENAME TO %I', part, part || '_archived');
+		ELSE
+			EXECUTE format('DROP TABLE %I', part);
+		END IF;
+	END LOOP;
+
+	IF archive THEN
+		UPDATE tournaments SET archived_at = now() WHERE id = t;
+	ELSE
+		DELETE FROM tournaments WHERE id = t;
+	END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Deletes a tournament's matches and draws, and puts every rating back to
+-- its seed.
+CREATE OR REPLACE FUNCTION delete_matches(t INT) RETURNS VOID AS $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM tournaments WHERE id = t AND archived_at IS NULL) THEN
+		EXECUTE format('TRUNCATE %I, %I', 'matches_t' || t, 'draws_t' || t);
+		UPDATE standings SET wins = byes, matches = byes WHERE tournament_id = t;
+	ELSE
+		DELETE FROM matches WHERE tournament_id = t;
+		DELETE FROM draws WHERE tournament_id = t;
+	END IF;
+
+	UPDATE players SET rating = seed_rating
+	WHERE tournament_id = t AND rating <> seed_rating;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,254 @@
+-- Rounds, and the pairings stored for each when it starts.
+--
+-- startRound() pairs a tournament's next round once and stores the result
+-- here, so later reads of the round's pairings are an index lookup and
+-- every reader sees the same ones. Once a tournament has a round, each
+-- result must be for a pairing of its current round that has not been
+-- reported yet (TM006), which replaces the rule checks against every
+-- recorded match. Tournaments that never start a round keep the old
+-- checks.
+
+CREATE TABLE IF NOT EXISTS rounds(
+	tournament_id INT NOT NULL,
+	round INT NOT NULL,
+	started_at TIMESTAMP NOT NULL DEFAULT now(),
+	PRIMARY KEY(tournament_id, round)
+) PARTITION BY LIST (tournament_id);
+
+CREATE TABLE IF NOT EXISTS pairings(
+	tournament_id INT NOT NULL,
+	round INT NOT NULL,
+	board INT NOT NULL,
+	player1_id INT NOT NULL,
+	player2_id INT NOT NULL,
+	reported BOOLEAN NOT NULL DEFAULT FALSE,
+	PRIMARY KEY(tournament_id, round, board),
+	FOREIGN KEY(tournament_id, round)
+		REFERENCES rounds(tournament_id, round) ON DELETE CASCADE,
+	FOREIGN KEY(tournament_id, player1_id)
+		REFERENCES players(tournament_id, id) ON DELETE CASCADE,
+	FOREIGN KEY(tournament_id, player2_id)
+		REFERENCES players(tournament_id, id) ON DELETE CASCADE
+) PARTITION BY LIST (tournament_id);
+
+CREATE TABLE IF NOT EXISTS rounds_default PARTITION OF rounds DEFAULT;
+CREATE TABLE IF NOT EXISTS pairings_default PARTITION OF pairings DEFAULT;
+
+-- Finds a result's pairing in a round, as matches_pair_idx does for matches.
+CREATE UNIQUE INDEX IF NOT EXISTS pairings_pair_idx
+	ON pairings (tournament_id, round, LEAST(player1_id, player2_id),
+	             GREATEST(player1_id, player2_id));
+
+-- Tournaments created before this migration get their partitions.
+DO $partitions$
+DECLARE
+	t INT;
+	parent TEXT;
+BEGIN
+	FOR t IN SELECT id FROM tournaments WHERE archived_at IS NULL LOOP
+		FOREACH parent IN ARRAY ARRAY['rounds', 'pairings'] LOOP
+			EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES IN (%s)',
+			               parent || '_t' || t, parent, t);
+		END LOOP;
+	END LOOP;
+END;
+$partitions$;
+
+-- Marks the pairing of a and b in tournament t's current round as reported.
+-- Returns FALSE, changing nothing, if the tournament has no rounds, and
+-- raises TM006 if the two were not paired in the current round or their
+-- result is already in. The row lock taken by the UPDATE makes a second,
+-- concurrent report of the same pairing wait and then fail.
+CREATE OR REPLACE FUNCTION claim_pairing(a INT, b INT, t INT) RETURNS BOOLEAN AS $$
+DECLARE
+	current INT;
+BEGIN
+	SELECT max(round) INTO current FROM rounds WHERE tournament_id = t;
+	IF current IS NULL THEN
+		RETURN FALSE;
+	END IF;
+
+	UPDATE pairings SET reported = TRUE
+	WHERE tournament_id = t AND round = current
+	AND LEAST(player1_id, player2_id) = LEAST(a, b)
+	AND GREATEST(player1_id, player2_id) = GREATEST(a, b)
+	AND NOT reported;
+
+	IF NOT FOUND THEN
+		RAISE EXCEPTION 'Players were not paired with each other in the current round, or their result has already been reported.'
+			USING ERRCODE = 'TM006';
+	END IF;
+
+	RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- As in migration 004, checking against the stored pairing once the
+-- tournament has rounds.
+CREATE OR REPLACE FUNCTION report_match(winner INT, loser INT, t INT) RETURNS VOID AS $$
+BEGIN
+	IF claim_pairing(winner, loser, t) THEN
+		INSERT INTO matches (winner_id, loser_id, tournament_id)
+		VALUES (winner, loser, t);
+		RETURN;
+	END IF;
+
+	IF winner = loser THEN
+		RAISE EXCEPTION 'A player cannot play against themselves.'
+			USING ERRCODE = 'TM001';
+	END IF;
+
+	IF (SELECT count(*) FROM players
+	    WHERE id IN (winner, loser) AND tournament_id = t) <> 2 THEN
+		RAISE EXCEPTION 'Both players must exist and be registered for the correct tournament.'
+			USING ERRCODE = 'TM002';
+	END IF;
+
+	IF EXISTS (SELECT 1 FROM matches
+	           WHERE tournament_id = t
+	           AND LEAST(winner_id, loser_id) = LEAST(winner, loser)
+	           AND GREATEST(winner_id, loser_id) = GREATEST(winner, loser)) THEN
+		RAISE EXCEPTION 'Players can only have played each other once.'
+			USING ERRCODE = 'TM003';
+	END IF;
+
+	INSERT INTO matches (winner_id, loser_id, tournament_id)
+	VALUES (winner, loser, t);
+EXCEPTION
+	WHEN unique_violation THEN
+		RAISE EXCEPTION 'Players can only have played each other once.'
+			USING ERRCODE = 'TM003';
+END;
+$$ LANGUAGE plpgsql;
+
+-- As in migration 005, checking against the stored pairing once the
+-- tournament has rounds.
+CREATE OR REPLACE FUNCTION report_draw(a INT, b INT, t INT) RETURNS VOID AS $$
+BEGIN
+	IF claim_pairing(a, b, t) THEN
+		INSERT INTO draws (player1_id, player2_id, tournament_id) VALUES (a, b, t);
+		RETURN;
+	END IF;
+
+	IF a = b THEN
+		RAISE EXCEPTION 'A player cannot play against themselves.'
+			USING ERRCODE = 'TM001';
+	END IF;
+
+	IF (SELECT count(*) FROM players
+	    WHERE id IN (a, b) AND tournament_id = t) <> 2 THEN
+		RAISE EXCEPTION 'Both players must exist and be registered for the correct tournament.'
+			USING ERRCODE = 'TM002';
+	END IF;
+
+	INSERT INTO draws (player1_id, player2_id, tournament_id) VALUES (a, b, t);
+END;
+$$ LANGUAGE plpgsql;
+
+-- As in migration 005, with rounds and pairings partitioned like the other
+-- tables. Rounds hold no player IDs, so the cascade from players_default
+-- does not reach them and they are emptied separately.
+CREATE OR REPLACE FUNCTION create_tournament(tournament_name TEXT, t INT DEFAULT NULL)
+RETURNS INT AS $$
+DECLARE
+	parent TEXT;
+BEGIN
+	IF t IS NULL THEN
+		LOOP
+			t := nextval(pg_get_serial_sequence('tournaments', 'id'));
+			EXIT WHEN NOT EXISTS (SELECT 1 FROM tournaments WHERE id = t)
+			      AND NOT EXISTS (SELECT 1 FROM players WHERE tournament_id = t);
+		END LOOP;
+	ELSIF EXISTS (SELECT 1 FROM tournaments WHERE id = t) THEN
+		RAISE EXCEPTION 'Tournament % has already been created.', t
+			USING ERRCODE = 'TM004';
+	END IF;
+
+	INSERT INTO tournaments (id, name) VALUES (t, tournament_name);
+
+	FOREACH parent IN ARRAY ARRAY['players', 'matches', 'draws', 'assigned_byes', 'standings',
+	                              'rounds', 'pairings'] LOOP
+		EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+		               parent || '_t' || t, parent);
+		EXECUTE format('INSERT INTO %I SELECT * FROM %I WHERE tournament_id = $1',
+		               parent || '_t' || t, parent || '_default') USING t;
+	END LOOP;
+
+	DELETE FROM rounds_default WHERE tournament_id = t;
+	DELETE FROM players_default WHERE tournament_id = t;
+
+	FOREACH parent IN ARRAY ARRAY['players', 'matches', 'draws', 'assigned_byes', 'standings',
+	                              'rounds', 'pairings'] LOOP
+		EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES IN (%s)',
+		               parent, parent || '_t' || t, t);
+	END LOOP;
+
+	RETURN t;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION drop_tournament(t INT, archive BOOLEAN DEFAULT FALSE)
+RETURNS VOID AS $$
+DECLARE
+	parent TEXT;
+	part TEXT;
+	fk TEXT;
+BEGIN
+	IF NOT EXISTS (SELECT 1 FROM tournaments WHERE id = t AND archived_at IS NULL) THEN
+		IF archive THEN
+			RAISE EXCEPTION 'Only tournaments made with createTournament can be archived.'
+				USING ERRCODE = 'TM005';
+		END IF;
+
+		DELETE FROM rounds WHERE tournament_id = t;
+		DELETE FROM players WHERE tournament_id = t;
+		RETURN;
+	END IF;
+
+	FOREACH parent IN ARRAY ARRAY['pairings', 'rounds', 'standings', 'assigned_byes', 'draws',
+	                              'matches', 'players'] LOOP
+		part := parent || '_t' || t;
+
+		EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', parent, part);
+
+		FOR fk IN SELECT conname FROM pg_constraint
+		          WHERE conrelid = part::regclass AND contype = 'f' LOOP
+			EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', part, fk);
+		END LOOP;
+
+		IF archive THEN
+			EXECUTE format('ALTER TABLE %I RENAME TO %I', part, part || '_archived');
+		ELSE
+			EXECUTE format('DROP TABLE %I', part);
+		END IF;
+	END LOOP;
+
+	IF archive THEN
+		UPDATE tournaments SET archived_at = now() WHERE id = t;
+	ELSE
+		DELETE FROM tournaments WHERE id = t;
+	END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- As in migration 005, also removing the tournament's rounds, so that the
+-- next round started is round 1 again. The rounds partition is emptied with
+-- DELETE, as TRUNCATE refuses a partition that pairings' foreign key
+-- references; a tournament has few rounds.
+CREATE OR REPLACE FUNCTION delete_matches(t INT) RETURNS VOID AS $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM tournaments WHERE id = t AND archived_at IS NULL) THEN
+		EXECUTE format('TRUNCATE %I, %I, %I', 'matches_t' || t, 'draws_t' || t,
+		               'pairings_t' || t);
+		EXECUTE format('DELETE FROM %I', 'rounds_t' || t);
+		UPDATE standings SET wins = byes, matches = byes WHERE tournament_id = t;
+	ELSE
+		DELETE FROM matches WHERE tournament_id = t;
+		DELETE FROM draws WHERE tournament_id = t;
+		DELETE FROM rounds WHERE tournament_id = t;
+	END IF;
+
+	UPDATE players SET rating = seed_rating
+	WHERE tournament_id = t AND rating <> seed_rating;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,44 @@
+-- Publishes every change to a standings row with NOTIFY, so that clients
+-- can keep a copy of the standings current instead of polling them.
+--
+-- The notification goes out on channel standings_<tournament id> when the
+-- changing transaction commits, with the payload
+--
+--   <tournament id>,<player id>:<wins>:<matches>
+--
+-- holding the row as committed, or <tournament id>,<player id>:- if the
+-- player is gone. The trigger is deferred to commit and reads the row then,
+-- so a player changed several times in one transaction (a match and a bye,
+-- a whole imported history) gives identical payloads, which PostgreSQL
+-- sends only once. A transaction that rolls back sends nothing.
+-- tournament_feed.py parses the payloads.
+
+CREATE OR REPLACE FUNCTION standings_notify() RETURNS TRIGGER AS $$
+DECLARE
+	t INT;
+	player INT;
+	counts TEXT;
+BEGIN
+	IF TG_OP = 'DELETE' THEN
+		t := OLD.tournament_id;
+		player := OLD.player_id;
+	ELSE
+		t := NEW.tournament_id;
+		player := NEW.player_id;
+	END IF;
+
+	SELECT wins || ':' || matches INTO counts FROM standings
+	WHERE tournament_id = t AND player_id = player;
+
+	PERFORM pg_notify('standings_' || t,
+	                  t || ',' || player || ':' || coalesce(counts, '-'));
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS standings_feed ON standings;
+CREATE CONSTRAINT TRIGGER standings_feed
+	AFTER INSERT OR UPDATE OR DELETE ON standings
+	DEFERRABLE INITIALLY DEFERRED
+	FOR EACH ROW EXECUTE PROCEDURE standings_notify();
@@ -0,0 +1,80 @@
+-- Makes reports of results safe to run concurrently without relying on a
+-- unique index to catch the race.
+--
+-- report_match() and report_draw() now lock both players' rows, in ID
+-- order, before they check anything. A second report involving either
+-- player waits for the first to commit, then sees its result, so the
+-- rematch check is exact and TM003 is raised by the check itself rather
+-- than by matches_pair_idx. rate_game() and reportMatches() lock players in
+-- the same order, so reports cannot deadlock on one another. In a
+-- tournament with rounds, the pairing row is claimed first, as before, and
+-- the players are locked by the rating trigger after it.
+
+-- Locks the rows of players a and b of tournament t, lowest ID first, and
+-- returns how many of the two are registered for it.
+CREATE OR REPLACE FUNCTION lock_players(t INT, a INT, b INT) RETURNS INT AS $$
+	SELECT count(*)::INT FROM (
+		SELECT id FROM players
+		WHERE tournament_id = t AND id IN (a, b)
+		ORDER BY id
+		FOR UPDATE
+	) locked;
+$$ LANGUAGE SQL;
+
+-- As in migration 006, locking the players before the rule checks.
+CREATE OR REPLACE FUNCTION report_match(winner INT, loser INT, t INT) RETURNS VOID AS $$
+BEGIN
+	IF claim_pairing(winner, loser, t) THEN
+		INSERT INTO matches (winner_id, loser_id, tournament_id)
+		VALUES (winner, loser, t);
+		RETURN;
+	END IF;
+
+	IF winner = loser THEN
+		RAISE EXCEPTION 'A player cannot play against themselves.'
+			USING ERRCODE = 'TM001';
+	END IF;
+
+	IF lock_players(t, winner, loser) <> 2 THEN
+		RAISE EXCEPTION 'Both players must exist and be registered for the correct tournament.'
+			USING ERRCODE = 'TM002';
+	END IF;
+
+	IF EXISTS (SELECT 1 FROM matches
+	           WHERE tournament_id = t
+	           AND LEAST(winner_id, loser_id) = LEAST(winner, loser)
+	           AND GREATEST(winner_id, loser_id) = GREATEST(winner, loser)) THEN
+		RAISE EXCEPTION 'Players can only have played each other once.'
+			USING ERRCODE = 'TM003';
+	END IF;
+
+	INSERT INTO matches (winner_id, loser_id, tournament_id)
+	VALUES (winner, loser, t);
+EXCEPTION
+	WHEN unique_violation THEN
+		RAISE EXCEPTION 'Players can only have played each other once.'
+			USING ERRCODE = 'TM003';
+END;
+$$ LANGUAGE plpgsql;
+
+-- As in migration 006, locking the players before the rule checks.
+CREATE OR REPLACE FUNCTION report_draw(a INT, b INT, t INT) RETURNS VOID AS $$
+BEGIN
+	IF claim_pairing(a, b, t) THEN
+		INSERT INTO draws (player1_id, player2_id, tournament_id) VALUES (a, b, t);
+		RETURN;
+	END IF;
+
+	IF a = b THEN
+		RAISE EXCEPTION 'A player cannot play against themselves.'
+			USING ERRCODE = 'TM001';
+	END IF;
+
+	IF lock_players(t, a, b) <> 2 THEN
+		RAISE EXCEPTION 'Both players must exist and be registered for the correct tournament.'
+			USING ERRCODE = 'TM002';
+	END IF;
+
+	INSERT INTO draws (player1_id, player2_id, tournament_id) VALUES (a, b, t);
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,138 @@
+-- Byes given once per round, when it is paired, instead of settled again
+-- after every registration.
+--
+-- startRound() now gives a round's bye to the lowest-ranked player who has
+-- not had one yet, and records it here with the round it was given for.
+-- The primary key (tournament_id, player_id) is the history startRound()
+-- reads to find who has had a bye, and keeps any player from getting a
+-- second one. Registering players no longer touches this table. Byes given
+-- before this migration, or restored from a snapshot, have no round.
+--
+-- Standings keep counting byes through the standings_count_bye() trigger,
+-- so the player_standings view still reads them from standings.byes.
+
+ALTER TABLE assigned_byes ADD COLUMN IF NOT EXISTS round INT;
+
+DO $round_key$
+BEGIN
+	IF NOT EXISTS (SELECT 1 FROM pg_constraint
+	               WHERE conrelid = 'assigned_byes'::regclass
+	               AND conname = 'assigned_byes_round_fkey') THEN
+		ALTER TABLE assigned_byes ADD CONSTRAINT assigned_byes_round_fkey
+			FOREIGN KEY(tournament_id, round)
+			REFERENCES rounds(tournament_id, round) ON DELETE CASCADE;
+	END IF;
+END;
+$round_key$;
+
+-- No index on (tournament_id, round): the primary key already leads with
+-- tournament_id, which is all the bye history and the cascade from rounds
+-- need, and a second index would take the history query away from it.
+
+-- As in migration 006, detaching assigned_byes before the rounds it now
+-- references.
+CREATE OR REPLACE FUNCTION drop_tournament(t INT, archive BOOLEAN DEFAULT FALSE)
+RETURNS VOID AS $$
+DECLARE
+	parent TEXT;
+	part TEXT;
+	fk TEXT;
+BEGIN
+	IF NOT EXISTS (SELECT 1 FROM tournaments WHERE id = t AND archived_at IS NULL) THEN
+		IF archive THEN
+			RAISE EXCEPTION 'Only tournaments made with createTournament can be archived.'
+				USING ERRCODE = 'TM005';
+		END IF;
+
+		DELETE FROM rounds WHERE tournament_id = t;
+		DELETE FROM players WHERE tournament_id = t;
+		RETURN;
+	END IF;
+
+	FOREACH parent IN ARRAY ARRAY['pairings', 'assigned_byes', 'rounds', 'standings', 'draws',
+	                              'matches', 'players'] LOOP
+		part := parent || '_t' || t;
+
+		EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', parent, part);
+
+		FOR fk IN SELECT conname FROM pg_constraint
+		          WHERE conrelid = part::regclass AND contype = 'f' LOOP
+			EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', part, fk);
+		END LOOP;
+
+		IF archive THEN
+			EXECUTE format('ALTER TABLE %I RENAME TO %I', part, part || '_archived');
+		ELSE
+			EXECUTE format('DROP TABLE %I', part);
+		END IF;
+	END LOOP;
+
+	IF archive THEN
+		UPDATE tournaments SET archived_at = now() WHERE id = t;
+	ELSE
+		DELETE FROM tournaments WHERE id = t;
+	END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- As in migration 006, attaching assigned_byes after the rounds it now
+-- references, so that byes given in a round pass the foreign key check.
+CREATE OR REPLACE FUNCTION create_tournament(tournament_name TEXT, t INT DEFAULT NULL)
+RETURNS INT AS $$
+DECLARE
+	parent TEXT;
+BEGIN
+	IF t IS NULL THEN
+		LOOP
+			t := nextval(pg_get_serial_sequence('tournaments', 'id'));
+			EXIT WHEN NOT EXISTS (SELECT 1 FROM tournaments WHERE id = t)
+			      AND NOT EXISTS (SELECT 1 FROM players WHERE tournament_id = t);
+		END LOOP;
+	ELSIF EXISTS (SELECT 1 FROM tournaments WHERE id = t) THEN
+		RAISE EXCEPTION 'Tournament % has already been created.', t
+			USING ERRCODE = 'TM004';
+	END IF;
+
+	INSERT INTO tournaments (id, name) VALUES (t, tournament_name);
+
+	FOREACH parent IN ARRAY ARRAY['players', 'matches', 'draws', 'assigned_byes', 'standings',
+	                              'rounds', 'pairings'] LOOP
+		EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+		               parent || '_t' || t, parent);
+		EXECUTE format('INSERT INTO %I SELECT * FROM %I WHERE tournament_id = $1',
+		               parent || '_t' || t, parent || '_default') USING t;
+	END LOOP;
+
+	DELETE FROM rounds_default WHERE tournament_id = t;
+	DELETE FROM players_default WHERE tournament_id = t;
+
+	FOREACH parent IN ARRAY ARRAY['players', 'matches', 'draws', 'standings', 'rounds',
+	                              'assigned_byes', 'pairings'] LOOP
+		EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES IN (%s)',
+		               parent, parent || '_t' || t, t);
+	END LOOP;
+
+	RETURN t;
+END;
+$$ LANGUAGE plpgsql;
+
+-- As in migration 006, also removing the tournament's byes, which belong to
+-- its rounds now, so every standings counter goes back to zero.
+CREATE OR REPLACE FUNCTION delete_matches(t INT) RETURNS VOID AS $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM tournaments WHERE id = t AND archived_at IS NULL) THEN
+		EXECUTE format('TRUNCATE %I, %I, %I, %I', 'matches_t' || t, 'draws_t' || t,
+		               'pairings_t' || t, 'assigned_byes_t' || t);
+		EXECUTE format('DELETE FROM %I', 'rounds_t' || t);
+		UPDATE standings SET wins = 0, matches = 0, byes = 0 WHERE tournament_id = t;
+	ELSE
+		DELETE FROM assigned_byes WHERE tournament_id = t;
+		DELETE FROM matches WHERE tournament_id = t;
+		DELETE FROM draws WHERE tournament_id = t;
+		DELETE FROM rounds WHERE tournament_id = t;
+	END IF;
+
+	UPDATE players SET rating = seed_rating
+	WHERE tournament_id = t AND rating <> seed_rating;
+END;
+$$ LANGUAGE plpgsql;
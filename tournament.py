@@ -1,115 +1,1689 @@
 #!/usr/bin/env python
-# 
+#
 # tournament.py -- implementation of a Swiss-system tournament
 #
 
-import psycopg2
-from tournament_exception import TournamentException
+import functools
+import io
+import itertools
+import random
+import threading
+import time
+import timeit
+
+import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+from tournament_cache import TournamentCache
+from tournament_columns import StandingsColumns
+from tournament_exception import TournamentException
+from tournament_metrics import TournamentMetrics
+from tournament_pairing import pairRound
+from tournament_ratings import INITIAL_RATING, computeRatings
+from tournament_snapshot import TournamentSnapshot, readSnapshot, writeSnapshot
+from tournament_tiebreaks import computeTiebreaks, rankStandings
+
+
+DATABASE_NAME = "tournament"
+
+# Bounds for the shared connection pool. Callers block once all
+# POOL_MAX_CONNECTIONS connections are checked out.
+POOL_MIN_CONNECTIONS = 1
+POOL_MAX_CONNECTIONS = 10
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Optional pool on a streaming replica for read-only calls; see
+# configureReplica().
+_replica_pool = None
+_read_your_writes = True
+
+# Per thread, the primary's WAL position after this thread's last write,
+# until the replica is known to have replayed it.
+_last_write = threading.local()
+
+# Optional read cache for standings and pairings; see enableCache().
+_cache = None
+
+# Where the module-level API keeps its data; see setBackend().
+_backend = None
+
+# Optional timing of API calls and SQL statements; see enableMetrics().
+_metrics = None
+
+# SQLSTATEs raised by the report_match(), report_draw(), create_tournament()
+# and drop_tournament() database functions when a call breaks a tournament
+# rule; see migrations/003_report_match_function.sql,
+# migrations/004_partition_by_tournament.sql and
+# migrations/006_rounds_and_pairings.sql.
+RULE_VIOLATIONS = frozenset(["TM001", "TM002", "TM003", "TM004", "TM005", "TM006"])
+
+# Arbitrary first key of the advisory lock that stops two sessions from
+# starting a tournament's next round at once; the second key is the
+# tournament ID.
+ROUND_LOCK_KEY = 7235171
+
+# Times a module-level write is retried when PostgreSQL rolls its
+# transaction back to resolve a deadlock or serialization failure.
+TRANSACTION_RETRIES = 5
+
+# Reason given for a result that does not match an open pairing of the
+# current round, as with TM006 from the database.
+NOT_PAIRED = "Players were not paired with each other in the current round, " \
+             "or their result has already been reported."
+
+# Suffixes that keep the names of server-side cursors unique.
+_cursor_ids = itertools.count(1)
+
+
+def connect(database_name=DATABASE_NAME, dsn=None):
+    """Connect to the PostgreSQL database.  Returns a database connection.
+
+    Args:
+      database_name: name of the database to connect to
+      dsn: libpq connection string (e.g. "host=replica1 dbname=tournament"),
+        used instead of database_name if given
+    """
+    metrics = _metrics
+    start = timeit.default_timer()
+
+    db_conn = psycopg2.connect(dsn or "dbname={}".format(database_name))
+    db_cursor = db_conn.cursor()
+
+    if metrics is not None:
+        metrics.observeConnect(timeit.default_timer() - start)
+
+    return db_conn, db_cursor
+
+
+class _ThreadedConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """ThreadedConnectionPool that times new connections when metrics are enabled."""
+
+    def _connect(self, key=None):
+        metrics = _metrics
+        if metrics is None:
+            return super(_ThreadedConnectionPool, self)._connect(key)
+
+        start = timeit.default_timer()
+        db_conn = super(_ThreadedConnectionPool, self)._connect(key)
+        metrics.observeConnect(timeit.default_timer() - start)
+
+        return db_conn
+
+
+class _InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor that records every statement it runs in a TournamentMetrics.
+
+    The collector is set on the cursor's metrics attribute after creation.
+    """
+
+    def execute(self, query, vars=None):
+        return self._timed(query, super(_InstrumentedCursor, self).execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._timed(query, super(_InstrumentedCursor, self).executemany,
+                           query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._timed(sql, super(_InstrumentedCursor, self).copy_expert,
+                           sql, file, size)
+
+    def _timed(self, query, method, *args):
+        start = timeit.default_timer()
+        try:
+            result = method(*args)
+        except Exception:
+            self.metrics.observeStatement(query, timeit.default_timer() - start,
+                                          failed=True)
+            raise
+
+        self.metrics.observeStatement(query, timeit.default_timer() - start,
+                                      self.rowcount)
+
+        return result
+
+
+class ConnectionPool(object):
+    """Bounded, thread-safe pool of database connections.
+
+    Wraps psycopg2's ThreadedConnectionPool so that a caller asking for a
+    connection while all of them are in use waits for one to be returned,
+    rather than getting a PoolError.
+    """
+
+    def __init__(self, database_name=DATABASE_NAME,
+                 minconn=POOL_MIN_CONNECTIONS, maxconn=POOL_MAX_CONNECTIONS, dsn=None):
+        self._pool = _ThreadedConnectionPool(
+            minconn, maxconn, dsn or "dbname={}".format(database_name))
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self):
+        """Checks out a connection, blocking until one is available."""
+        self._slots.acquire()
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, db_conn, close=False):
+        """Returns a connection to the pool.
+
+        Args:
+          db_conn: connection previously obtained from getconn()
+          close: if True, the connection is discarded instead of reused
+        """
+        try:
+            self._pool.putconn(db_conn, close=close)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        """Closes every connection held by the pool."""
+        self._pool.closeall()
+
+
+def configurePool(database_name=DATABASE_NAME,
+                  minconn=POOL_MIN_CONNECTIONS, maxconn=POOL_MAX_CONNECTIONS, dsn=None):
+    """Replaces the shared connection pool used by the module-level API.
+
+    Connections held by the previous pool are closed.
+
+    Args:
+      database_name: name of the database to connect to
+      minconn: number of connections opened up front
+      maxconn: maximum number of connections open at once
+      dsn: libpq connection string, used instead of database_name if given
+
+    Returns:
+      The new ConnectionPool.
+    """
+    global _pool
+
+    with _pool_lock:
+        old_pool = _pool
+        _pool = ConnectionPool(database_name, minconn, maxconn, dsn)
+
+    if old_pool is not None:
+        old_pool.closeall()
+
+    return _pool
+
+
+def configureReplica(database_name=DATABASE_NAME,
+                     minconn=POOL_MIN_CONNECTIONS, maxconn=POOL_MAX_CONNECTIONS,
+                     dsn=None, read_your_writes=True):
+    """Sends the module-level API's read-only calls to a replica.
+
+    From then on, countPlayers(), playerStandings(), columnStandings(),
+    iterStandings(), topStandings(), playerTiebreaks(), playerRatings(),
+    swissPairings(), exportTournament() and their batch forms read from a pool of
+    connections to the replica, which must be a streaming standby of the
+    primary. Every other call, and every TournamentSession opened directly,
+    still goes to the primary.
+
+    With read_your_writes, a thread that has just written keeps reading from
+    the primary until the replica has replayed that write, so it always sees
+    its own changes. Without it, reads may briefly miss writes that the
+    replica has yet to receive.
+
+    Args:
+      database_name: name of the database to connect to on the replica
+      minconn: number of connections opened up front
+      maxconn: maximum number of connections open at once
+      dsn: libpq connection string of the replica, used instead of
+        database_name if given
+      read_your_writes: whether a thread's reads follow its own writes
+
+    Returns:
+      The new ConnectionPool.
+    """
+    global _replica_pool, _read_your_writes
+
+    with _pool_lock:
+        old_pool = _replica_pool
+        _replica_pool = ConnectionPool(database_name, minconn, maxconn, dsn)
+        _read_your_writes = read_your_writes
+
+    if old_pool is not None:
+        old_pool.closeall()
+
+    return _replica_pool
+
+
+def disableReplica():
+    """Sends read-only calls back to the primary and closes the replica's pool."""
+    global _replica_pool
+
+    with _pool_lock:
+        old_pool, _replica_pool = _replica_pool, None
+
+    if old_pool is not None:
+        old_pool.closeall()
+
+
+def _replicaConnection(replica_pool):
+    """Checks out a replica connection for a read-only session.
+
+    If read-your-writes is on and this thread has written since the replica
+    was last seen to have caught up, the replica is first asked whether it
+    has replayed that write.
+
+    Returns:
+      A connection from replica_pool, or None if the replica is behind and
+      the session should read from the primary instead.
+    """
+
+    lsn = getattr(_last_write, "lsn", None)
+    db_conn = replica_pool.getconn()
+    if lsn is None or not _read_your_writes:
+        return db_conn
+
+    try:
+        db_cursor = db_conn.cursor()
+        # NULL, taken as behind, if the replica is not in recovery at all.
+        db_cursor.execute("SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn;", (lsn,))
+        caught_up = db_cursor.fetchone()[0]
+        db_cursor.close()
+        db_conn.rollback()
+    except Exception:
+        replica_pool.putconn(db_conn, close=True)
+        raise
+
+    if not caught_up:
+        replica_pool.putconn(db_conn)
+        return None
+
+    _last_write.lsn = None
+
+    return db_conn
+
+
+def _getPool():
+    """Returns the shared connection pool, creating it on first use."""
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+
+    return _pool
+
+
+def enableCache(maxsize=128, ttl=None):
+    """Caches playerStandings() and swissPairings() results in this process.
+
+    Cached results for a tournament are dropped whenever players, matches or
+    byes for that tournament are changed through this module. Set ttl to
+    bound how stale results can get when the database is also written by
+    other processes.
+
+    Args:
+      maxsize: maximum number of tournaments whose results are kept
+      ttl: seconds a cached result may be served, or None for no limit
+
+    Returns:
+      The new TournamentCache.
+    """
+    global _cache
+
+    _cache = TournamentCache(maxsize, ttl)
+
+    return _cache
+
+
+def disableCache():
+    """Stops caching read results and discards anything cached."""
+    global _cache
+
+    _cache = None
+
+
+def cacheStats():
+    """Returns the read cache's hit, miss and eviction counters as a dict,
+    or None if caching is disabled."""
+    cache = _cache
+
+    return cache.stats() if cache is not None else None
+
+
+def enableMetrics(slow_query_threshold=None):
+    """Starts timing API calls, SQL statements and new connections.
+
+    Every public function's calls and every statement run by the PostgreSQL
+    backend are counted, with their latency and (for statements) rows
+    returned or affected. Recording a call costs a few microseconds, so
+    metrics can be left on in production.
+
+    Args:
+      slow_query_threshold: seconds above which a statement is logged as a
+        warning on the "tournament" logger, or None to log nothing
+
+    Returns:
+      The new TournamentMetrics.
+    """
+    global _metrics
+
+    _metrics = TournamentMetrics(slow_query_threshold)
+
+    return _metrics
+
+
+def disableMetrics():
+    """Stops timing API calls and discards everything recorded."""
+    global _metrics
+
+    _metrics = None
+
+
+def metricsStats():
+    """Returns everything recorded by enableMetrics() as a dict, or None if
+    metrics are disabled. See TournamentMetrics.stats()."""
+    metrics = _metrics
+
+    return metrics.stats() if metrics is not None else None
+
+
+def metricsText():
+    """Returns everything recorded by enableMetrics() in the Prometheus text
+    exposition format, or None if metrics are disabled."""
+    metrics = _metrics
+
+    return metrics.prometheus() if metrics is not None else None
+
+
+def _instrumented(function):
+    """Records the latency of a public API function's calls while metrics are on."""
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        metrics = _metrics
+        if metrics is None:
+            return function(*args, **kwargs)
+
+        start = timeit.default_timer()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            metrics.observeCall(name, timeit.default_timer() - start, failed=True)
+            raise
+
+        metrics.observeCall(name, timeit.default_timer() - start)
+
+        return result
+
+    return wrapper
+
+
+def _retried(function):
+    """Reruns a module-level write, in a new session, when its transaction is
+    rolled back by a deadlock or serialization failure.
+
+    The transaction has changed nothing by then, so running the call again
+    is safe. It is rerun up to TRANSACTION_RETRIES times, after a short,
+    growing and randomized wait so that the callers that collided do not
+    collide again.
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        for attempt in range(TRANSACTION_RETRIES):
+            try:
+                return function(*args, **kwargs)
+            except psycopg2.extensions.TransactionRollbackError:
+                time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+        return function(*args, **kwargs)
+
+    return wrapper
+
+
+class PostgresBackend(object):
+    """Storage backend that keeps tournaments in PostgreSQL (the default).
+
+    A backend is any object with a session() method returning a context
+    manager that yields a session with the methods of TournamentSession
+    (countPlayers, registerPlayer, reportMatch, playerStandings, ...), runs
+    them as one unit of work, and undoes them all if the block raises.
+
+    session() also takes a read_only flag, set by the module-level API for
+    calls that only read, which a backend may use to serve them from
+    somewhere else and otherwise ignores.
+
+    Args:
+      pool: ConnectionPool to draw from; defaults to the shared pool
+    """
+
+    def __init__(self, pool=None):
+        self.pool = pool
+
+    def session(self, read_only=False):
+        """Returns a new TournamentSession on this backend's pool.
+
+        Args:
+          read_only: whether the session only reads, so that it may go to
+            the replica set with configureReplica()
+        """
+        return TournamentSession(self.pool, read_only)
+
+
+def setBackend(backend):
+    """Switches the storage backend used by the module-level API.
+
+    Args:
+      backend: a PostgresBackend, tournament_memory.MemoryBackend, or any
+        other object implementing the same session() interface
+
+    Returns:
+      The backend that was in use before.
+    """
+    global _backend
+
+    old_backend, _backend = getBackend(), backend
+
+    # Anything cached came from the old backend.
+    cache = _cache
+    if cache is not None:
+        cache.clear()
+
+    return old_backend
+
+
+def getBackend():
+    """Returns the storage backend used by the module-level API."""
+    global _backend
+
+    if _backend is None:
+        _backend = PostgresBackend()
+
+    return _backend
+
+
+class TournamentSession(object):
+    """A unit of work against the tournament database.
+
+    A session checks out a single pooled connection when its ``with`` block
+    is entered and runs every call made through it in one transaction. The
+    transaction is committed when the block exits normally and rolled back
+    if it raises; either way the connection goes back to the pool.
+
+        with TournamentSession() as session:
+            session.registerPlayer("Flynn Taggart")
+            session.registerPlayer("B.J. Blazkowicz")
+            print session.playerStandings()
+
+    Args:
+      pool: ConnectionPool to draw from; defaults to the shared pool
+      read_only: whether the session only reads; if so, and no pool is
+        given, it uses the replica set with configureReplica(), if any and
+        if it has caught up with this thread's writes
+    """
+
+    def __init__(self, pool=None, read_only=False):
+        self._pool = pool
+        self._read_only = read_only
+        self.db_conn = None
+        self.db_cursor = None
+        # Tournaments written to during this session, whose cached reads are
+        # dropped when the session ends.
+        self._changed = set()
+
+    def __enter__(self):
+        if self._pool is None:
+            replica_pool = _replica_pool
+            if self._read_only and replica_pool is not None:
+                self.db_conn = _replicaConnection(replica_pool)
+
+            if self.db_conn is not None:
+                self._pool = replica_pool
+            else:
+                self._pool = _getPool()
+
+        if self.db_conn is None:
+            self.db_conn = self._pool.getconn()
+        try:
+            self.db_cursor = self._cursor()
+        except Exception:
+            self._pool.putconn(self.db_conn, close=True)
+            raise
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        db_conn, db_cursor = self.db_conn, self.db_cursor
+        self.db_conn, self.db_cursor = None, None
+
+        discard = False
+        try:
+            if exc_type is None:
+                db_conn.commit()
+
+                if self._changed and _replica_pool is not None and _read_your_writes:
+                    # The position just past this commit; see _replicaConnection().
+                    db_cursor.execute("SELECT pg_current_wal_lsn()::text;")
+                    _last_write.lsn = db_cursor.fetchone()[0]
+        finally:
+            # Roll back whatever is left open (a no-op after a successful
+            # commit) so the connection is clean for its next user. Broken
+            # connections are dropped rather than returned to the pool.
+            try:
+                if not db_conn.closed:
+                    db_conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+            db_cursor.close()
+            self._pool.putconn(db_conn, close=discard or bool(db_conn.closed))
+
+            _invalidateCache(self._changed)
+            self._changed.clear()
+
+        return False
+
+    def _cursor(self, name=None):
+        """Opens a cursor on the session's connection, timed if metrics are on.
+
+        Args:
+          name: if given, the name of a server-side cursor to declare
+        """
+        metrics = _metrics
+        if metrics is None:
+            return self.db_conn.cursor(name)
+
+        db_cursor = self.db_conn.cursor(name, cursor_factory=_InstrumentedCursor)
+        db_cursor.metrics = metrics
+
+        return db_cursor
+
+    def createTournament(self, name, tournament_id=None):
+        """Creates a tournament with partitions of its own and returns its ID.
+
+        Without tournament_id, the next free ID is chosen. Players and
+        matches already recorded under tournament_id are moved into the new
+        partitions.
+
+        Raises:
+          TournamentException: if a tournament with that ID was already created
+        """
+
+        query = "SELECT create_tournament(%s, %s);"
+
+        params = (name, tournament_id)
+
+        self.db_cursor.execute("SAVEPOINT create_tournament;")
+        try:
+            self.db_cursor.execute(query, params)
+        except psycopg2.Error as e:
+            if e.pgcode not in RULE_VIOLATIONS:
+                raise
+
+            self.db_cursor.execute("ROLLBACK TO SAVEPOINT create_tournament;")
+            raise TournamentException(e.diag.message_primary)
+
+        tournament_id = self.db_cursor.fetchone()[0]
+        self._changed.add(tournament_id)
+        self.db_cursor.execute("RELEASE SAVEPOINT create_tournament;")
+
+        return tournament_id
+
+    def dropTournament(self, tournament_id, archive=False):
+        """Removes a tournament with all of its players and matches.
+
+        A tournament made with createTournament() has its partitions detached,
+        which takes the same time however large they are, and then dropped or,
+        with archive, kept as standalone <table>_t<id>_archived tables. Any
+        other tournament's rows are deleted.
+
+        Raises:
+          TournamentException: if archive is set for a tournament that was
+            not made with createTournament()
+        """
+
+        self._changed.add(tournament_id)
+
+        query = "SAVEPOINT drop_tournament; " \
+                "SELECT drop_tournament(%s, %s); " \
+                "RELEASE SAVEPOINT drop_tournament;"
+
+        params = (tournament_id, archive)
+
+        try:
+            self.db_cursor.execute(query, params)
+        except psycopg2.Error as e:
+            if e.pgcode not in RULE_VIOLATIONS:
+                raise
+
+            self.db_cursor.execute("ROLLBACK TO SAVEPOINT drop_tournament;")
+            raise TournamentException(e.diag.message_primary)
+
+    def exportTournament(self, tournament_id, path):
+        """Writes a tournament's players, matches, draws and byes to a snapshot file."""
+
+        players_query = "SELECT id, name, seed_rating, rating FROM players " \
+                        "WHERE tournament_id = %s " \
+                        "ORDER BY id;"
+
+        byes_query = "SELECT player_id FROM assigned_byes " \
+                     "WHERE tournament_id = %s;"
+
+        params = (tournament_id,)
+
+        self.db_cursor.execute(players_query, params)
+        players = self.db_cursor.fetchall()
+
+        results = self._results(tournament_id)
+        draws = self._draws(tournament_id)
+
+        self.db_cursor.execute(byes_query, params)
+        byes = [row[0] for row in self.db_cursor.fetchall()]
+
+        writeSnapshot(path, TournamentSnapshot(
+            tournament_id,
+            [row[0] for row in players], [row[1] for row in players],
+            [row[0] for row in results], [row[1] for row in results],
+            byes,
+            [row[2] for row in players], [row[3] for row in players],
+            [row[0] for row in draws], [row[1] for row in draws]))
+
+    def importTournament(self, path, tournament_id=None):
+        """Loads a snapshot file into a tournament that has no players.
+
+        Players keep the IDs they had in the snapshot, and each table is
+        filled with a single COPY. Byes are restored as they were rather than
+        re-evaluated, and so are ratings if the snapshot has them.
+
+        Returns:
+          The ID of the tournament the snapshot was loaded into.
+
+        Raises:
+          TournamentException: if the tournament already has players
+        """
+
+        snapshot = readSnapshot(path)
+        if tournament_id is None:
+            tournament_id = snapshot.tournament_id
+
+        if self.countPlayers(tournament_id):
+            raise TournamentException(
+                "Tournament {} already has players.".format(tournament_id))
+
+        self._changed.add(tournament_id)
+
+        if not snapshot.player_ids:
+            return tournament_id
+
+        suffix = ("\t{}\n".format(tournament_id)).encode("ascii")
+
+        players = b"".join(("{}\t".format(player_id)).encode("ascii") + _copyText(name) +
+                           ("\t{}\t{!r}\t{!r}\n".format(tournament_id, seed, seed))
+                           .encode("ascii")
+                           for player_id, name, seed in zip(snapshot.player_ids,
+                                                            snapshot.names,
+                                                            snapshot.seed_ratings))
+
+        self.db_cursor.copy_expert(
+            "COPY players (id, name, tournament_id, seed_rating, rating) "
+            "FROM STDIN WITH (FORMAT text, ENCODING 'UTF8');",
+            io.BytesIO(players))
+
+        # Later registrations must not be given the restored IDs again.
+        sequence_query = "SELECT setval(pg_get_serial_sequence('players', 'id'), " \
+                         "GREATEST(nextval(pg_get_serial_sequence('players', 'id')), %s));"
+
+        sequence_params = (max(snapshot.player_ids),)
+
+        self.db_cursor.execute(sequence_query, sequence_params)
+
+        if snapshot.winners:
+            matches = b"".join(("{}\t{}".format(winner, loser)).encode("ascii") + suffix
+                               for winner, loser in zip(snapshot.winners, snapshot.losers))
+
+            self.db_cursor.copy_expert(
+                "COPY matches (winner_id, loser_id, tournament_id) FROM STDIN;",
+                io.BytesIO(matches))
+
+        if snapshot.byes:
+            byes = b"".join(("{}\t{}\n".format(tournament_id, player_id)).encode("ascii")
+                            for player_id in snapshot.byes)
+
+            self.db_cursor.copy_expert(
+                "COPY assigned_byes (tournament_id, player_id) FROM STDIN;",
+                io.BytesIO(byes))
+
+        if snapshot.draws1:
+            draws = b"".join(("{}\t{}".format(a, b)).encode("ascii") + suffix
+                             for a, b in zip(snapshot.draws1, snapshot.draws2))
+
+            self.db_cursor.copy_expert(
+                "COPY draws (player1_id, player2_id, tournament_id) FROM STDIN;",
+                io.BytesIO(draws))
+
+        # The triggers have rated the games in the order they were copied;
+        # the snapshot's own ratings replace theirs.
+        if snapshot.ratings is not None:
+            self._setRatings(tournament_id, snapshot.player_ids, snapshot.ratings)
+
+        return tournament_id
+
+    def deleteMatches(self, tournament_id=1):
+        """Removes all the match records for a tournament, with its rounds
+        and byes.
+
+        A tournament made with createTournament() has its partitions of the
+        tables truncated rather than deleted row by row.
+        """
+
+        self._changed.add(tournament_id)
+
+        query = "SELECT delete_matches(%s);"
+
+        params = (tournament_id,)
+
+        self.db_cursor.execute(query, params)
+
+    def deletePlayers(self, tournament_id=1):
+        """Removes all the player records for a tournament, and its rounds."""
+
+        self._changed.add(tournament_id)
+
+        # Pairings go with the players; rounds have to be removed themselves.
+        query = "DELETE FROM rounds " \
+                "WHERE tournament_id = %s; " \
+                "DELETE FROM players " \
+                "WHERE tournament_id = %s;"
+
+        params = (tournament_id, tournament_id)
+
+        self.db_cursor.execute(query, params)
+
+    def countPlayers(self, tournament_id=1):
+        """Returns the number of players registered for a tournament."""
+
+        query = "SELECT COUNT(*) FROM players " \
+                "WHERE tournament_id = %s;"
+
+        params = (tournament_id,)
+
+        self.db_cursor.execute(query, params)
+        player_count = self.db_cursor.fetchone()[0]  # Column 0 contains number of players.
+
+        return int(player_count)  # Convert to int before returning.
+
+    def registerPlayer(self, name, tournament_id=1, rating=None):
+        """Adds a player to a tournament.
+
+        The player's rating starts at rating, or INITIAL_RATING if None.
+        """
+
+        self._changed.add(tournament_id)
+
+        if rating is None:
+            rating = INITIAL_RATING
+
+        query = "INSERT INTO players (name, tournament_id, seed_rating, rating)" \
+                "VALUES (%s, %s, %s, %s);"
+
+        paramters = (name, tournament_id, rating, rating)
+
+        self.db_cursor.execute(query, paramters)
+
+    def registerPlayers(self, names, tournament_id=1, ratings=None):
+        """Adds many players to a tournament at once.
+
+        Player IDs are reserved from the players sequence up front and the rows
+        are streamed in with a single COPY, so the cost is a few round trips
+        regardless of how many players are registered.
+
+        Args:
+          names: the players' names
+          tournament_id: ID of tournament players are registering for
+          ratings: the players' starting ratings, in the same order as names,
+            or None to start everyone at INITIAL_RATING
+
+        Returns:
+          A list of the new players' IDs, in the same order as names.
+        """
+
+        names = list(names)
+        if not names:
+            return []
+
+        self._changed.add(tournament_id)
+
+        if ratings is None:
+            ratings = [INITIAL_RATING] * len(names)
+
+        id_query = "SELECT nextval(pg_get_serial_sequence('players', 'id')) " \
+                   "FROM generate_series(1, %s);"
+
+        id_params = (len(names),)
+
+        self.db_cursor.execute(id_query, id_params)
+        player_ids = [row[0] for row in self.db_cursor.fetchall()]
+
+        rows = b"".join(("{}\t".format(player_id)).encode("ascii") +
+                        _copyText(name) +
+                        ("\t{}\t{!r}\t{!r}\n".format(tournament_id, float(rating),
+                                                    float(rating))).encode("ascii")
+                        for player_id, name, rating in zip(player_ids, names, ratings))
+
+        copy_query = "COPY players (id, name, tournament_id, seed_rating, rating) " \
+                     "FROM STDIN WITH (FORMAT text, ENCODING 'UTF8');"
+
+        self.db_cursor.copy_expert(copy_query, io.BytesIO(rows))
+
+        return player_ids
+
+    def playerStandings(self, tournament_id=1):
+        """Returns (id, name, wins, matches) rows for a tournament, sorted by
+        wins and then by tiebreaks."""
+
+        return list(self.columnStandings(tournament_id))
+
+    def columnStandings(self, tournament_id=1):
+        """Returns a tournament's standings, sorted as by playerStandings(),
+        as a StandingsColumns that holds the players' ratings too."""
+
+        return rankStandings(self._standings(tournament_id), self._results(tournament_id))
+
+    def playerTiebreaks(self, tournament_id=1):
+        """Returns a dict mapping each player ID to their (omw, buchholz,
+        median_buchholz, sonneborn_berger) tiebreaks."""
+
+        standings = self._standings(tournament_id)
+        tiebreaks = computeTiebreaks(standings, self._results(tournament_id))
+
+        return dict(zip(standings.ids, tiebreaks))
+
+    def playerRatings(self, tournament_id=1):
+        """Returns a dict mapping each player ID to their current rating."""
+
+        query = "SELECT id, rating FROM players " \
+                "WHERE tournament_id = %s;"
+
+        params = (tournament_id,)
+
+        self.db_cursor.execute(query, params)
+
+        return dict(self.db_cursor.fetchall())
+
+    def recomputeRatings(self, tournament_id=1):
+        """Recomputes every rating in a tournament from its whole history.
+
+        The triggers rate each game as it is reported, so the ratings depend
+        on the order results came in. This replaces them with the
+        order-independent ratings from computeRatings(), read and written
+        back in one query each.
+
+        Returns:
+          A dict mapping each player ID to their new rating.
+        """
+
+        self._changed.add(tournament_id)
+
+        query = "SELECT id, seed_rating FROM players " \
+                "WHERE tournament_id = %s;"
+
+        params = (tournament_id,)
+
+        self.db_cursor.execute(query, params)
+        seeds = dict(self.db_cursor.fetchall())
+
+        ratings = computeRatings(seeds, self._results(tournament_id),
+                                 self._draws(tournament_id))
+
+        if ratings:
+            self._setRatings(tournament_id, list(ratings), list(ratings.values()))
+
+        return ratings
+
+    def iterStandings(self, tournament_id=1, batch_size=1000):
+        """Yields (id, name, wins, matches) rows for a tournament, sorted by wins.
+
+        Rows are read through a server-side cursor, batch_size at a time, so
+        only one batch is held in memory. The rows must be consumed before
+        the session ends. Players level on wins and matches come in player ID
+        order, since tiebreaks need every result at once.
+        """
+
+        query = "SELECT p.id, p.name, s.wins, s.matches " \
+                "FROM standings s JOIN players p " \
+                "ON p.tournament_id = s.tournament_id AND p.id = s.player_id " \
+                "WHERE s.tournament_id = %s " \
+                "ORDER BY s.wins DESC, s.matches, s.player_id;"
+
+        params = (tournament_id,)
+
+        db_cursor = self._cursor("standings_{}".format(next(_cursor_ids)))
+        db_cursor.itersize = batch_size
+        try:
+            db_cursor.execute(query, params)
+            for row in db_cursor:
+                yield row
+        finally:
+            if not self.db_conn.closed:
+                db_cursor.close()
+
+    def topStandings(self, tournament_id=1, limit=50, after=None):
+        """Returns one page of (id, name, wins, matches) rows, sorted by wins.
+
+        Pages are found by seeking in standings_rank_idx to the row after the
+        previous page, so later pages cost no more than the first. As with
+        iterStandings(), players level on wins and matches come in player ID
+        order rather than by tiebreaks.
+
+        Args:
+          tournament_id: ID of tournament whose standings are being paged
+          limit: maximum number of rows to return
+          after: last row of the previous page, or None for the first page
+        """
+
+        if after is None:
+            query = "SELECT p.id, p.name, s.wins, s.matches " \
+                    "FROM standings s JOIN players p " \
+                    "ON p.tournament_id = s.tournament_id AND p.id = s.player_id " \
+                    "WHERE s.tournament_id = %(tournament_id)s " \
+                    "ORDER BY s.wins DESC, s.matches, s.player_id " \
+                    "LIMIT %(limit)s;"
+        else:
+            # The sort key mixes descending wins with ascending matches and
+            # IDs, which no single row comparison can express, so the rest of
+            # the tied group and the groups below it are each read as an
+            # index range.
+            query = "SELECT * FROM (" \
+                    "(SELECT p.id, p.name, s.wins, s.matches " \
+                    "FROM standings s JOIN players p " \
+                    "ON p.tournament_id = s.tournament_id AND p.id = s.player_id " \
+                    "WHERE s.tournament_id = %(tournament_id)s AND s.wins = %(wins)s " \
+                    "AND (s.matches, s.player_id) > (%(matches)s, %(player_id)s) " \
+                    "ORDER BY s.matches, s.player_id LIMIT %(limit)s) " \
+                    "UNION ALL " \
+                    "(SELECT p.id, p.name, s.wins, s.matches " \
+                    "FROM standings s JOIN players p " \
+                    "ON p.tournament_id = s.tournament_id AND p.id = s.player_id " \
+                    "WHERE s.tournament_id = %(tournament_id)s AND s.wins < %(wins)s " \
+                    "ORDER BY s.wins DESC, s.matches, s.player_id LIMIT %(limit)s)" \
+                    ") page " \
+                    "ORDER BY wins DESC, matches, id " \
+                    "LIMIT %(limit)s;"
+
+        params = _pageParams(tournament_id, limit, after)
+
+        self.db_cursor.execute(query, params)
+
+        return self.db_cursor.fetchall()
+
+    def rebuildStandings(self, tournament_id=1):
+        """Recomputes a tournament's standings counters from its match records."""
+
+        self._changed.add(tournament_id)
+
+        query = "SELECT rebuild_standings(%s);"
+
+        params = (tournament_id,)
+
+        self.db_cursor.execute(query, params)
+
+    def reportMatch(self, winner, loser, tournament_id=1, draw=False):
+        """Records the outcome of a single match between two players.
+
+        A draw leaves the standings as they are but is kept for the players'
+        ratings, and does not stop the two from being paired again.
+
+        Raises:
+          TournamentException: if the players are the same, either player is
+            not registered for the tournament, or the two have already met;
+            once the tournament has rounds, if the two are not paired in the
+            current round or their result is already in
+        """
+
+        self._changed.add(tournament_id)
+
+        # report_match() checks the rules and records the result on the server,
+        # in one round trip. The savepoint lets a session carry on after a
+        # rejected result, as it could when the checks were made from here.
+        query = "SAVEPOINT report_match; " \
+                "SELECT {}(%s, %s, %s); " \
+                "RELEASE SAVEPOINT report_match;".format(
+                    "report_draw" if draw else "report_match")
+
+        params = (winner, loser, tournament_id)
+
+        try:
+            self.db_cursor.execute(query, params)
+        except psycopg2.Error as e:
+            if e.pgcode not in RULE_VIOLATIONS:
+                raise
+
+            self.db_cursor.execute("ROLLBACK TO SAVEPOINT report_match;")
+            raise TournamentException(e.diag.message_primary)
+
+    def reportMatches(self, results, tournament_id=1):
+        """Records a whole round of results, validating them as a set.
+
+        Every result is checked before anything is written, and all rule
+        violations are reported together.
+
+        Raises:
+          TournamentException: if any result breaks a rule; its errors
+            attribute lists each offending (winner, loser, draw) tuple with
+            the reason it was rejected
+        """
+
+        results = list(results)
+        decided = [(winner, loser) for winner, loser, draw in results if not draw]
+        drawn = [(winner, loser) for winner, loser, draw in results if draw]
+        if not results:
+            return
+
+        self._changed.add(tournament_id)
+
+        # Once the tournament has rounds, results are checked against the
+        # pairings of the current round that are still open, locked so that
+        # none can be reported by another session meanwhile. They are locked
+        # in board order, so that two batches for the same round queue up
+        # rather than deadlock.
+        round_query = "SELECT max(round) FROM rounds " \
+                      "WHERE tournament_id = %s;"
+
+        round_params = (tournament_id,)
+
+        self.db_cursor.execute(round_query, round_params)
+        current = self.db_cursor.fetchone()[0]
+
+        if current is not None:
+            paired_query = "SELECT LEAST(player1_id, player2_id), " \
+                           "GREATEST(player1_id, player2_id) " \
+                           "FROM pairings " \
+                           "WHERE tournament_id = %s AND round = %s AND NOT reported " \
+                           "ORDER BY board " \
+                           "FOR UPDATE;"
+
+            paired_params = (tournament_id, current)
+
+            self.db_cursor.execute(paired_query, paired_params)
+            paired = set(self.db_cursor.fetchall())
+
+            errors = _checkResults(decided, (), (), drawn, paired)
+        else:
+            errors = self._checkRules(decided, drawn, tournament_id)
+
+        if errors:
+            raise TournamentException(
+                "{} of {} match results were rejected.".format(len(errors), len(results)),
+                errors)
+
+        if current is not None:
+            reported = [(min(pair), max(pair)) for pair in decided + drawn]
+
+            reported_query = "UPDATE pairings SET reported = TRUE " \
+                             "WHERE tournament_id = %s AND round = %s " \
+                             "AND (LEAST(player1_id, player2_id), " \
+                             "GREATEST(player1_id, player2_id)) IN " \
+                             "(SELECT * FROM unnest(%s::int[], %s::int[]));"
+
+            reported_params = (tournament_id, current,
+                               [pair[0] for pair in reported], [pair[1] for pair in reported])
+
+            self.db_cursor.execute(reported_query, reported_params)
+
+        if decided:
+            insert_query = "INSERT INTO matches (winner_id, loser_id, tournament_id) " \
+                           "VALUES %s;"
+
+            psycopg2.extras.execute_values(
+                self.db_cursor, insert_query,
+                [(winner, loser, tournament_id) for winner, loser in decided],
+                page_size=len(decided))
+
+        if drawn:
+            draw_query = "INSERT INTO draws (player1_id, player2_id, tournament_id) " \
+                         "VALUES %s;"
+
+            psycopg2.extras.execute_values(
+                self.db_cursor, draw_query,
+                [(player1, player2, tournament_id) for player1, player2 in drawn],
+                page_size=len(drawn))
+
+    def startRound(self, tournament_id=1):
+        """Pairs a tournament's next round and stores the pairings.
+
+        If the current round still has results to come, nothing is paired
+        and its pairings are returned instead, so that calling this again,
+        or from another session at the same time, is harmless.
+
+        Returns:
+          The round's (id1, name1, id2, name2) pairings.
+        """
+
+        self._changed.add(tournament_id)
+
+        # Held until the transaction ends, so the round is stored before a
+        # concurrent call gets to look for it.
+        lock_query = "SELECT pg_advisory_xact_lock(%s, %s);"
+
+        lock_params = (ROUND_LOCK_KEY, tournament_id)
+
+        self.db_cursor.execute(lock_query, lock_params)
+
+        current, pairings = self._roundPairings(tournament_id)
+        if pairings is not None:
+            return pairings
+
+        pairings, bye = self._nextPairings(tournament_id, allow_rematches=False)
+        next_round = (current or 0) + 1
+
+        round_query = "INSERT INTO rounds (tournament_id, round) " \
+                      "VALUES (%s, %s);"
+
+        round_params = (tournament_id, next_round)
+
+        self.db_cursor.execute(round_query, round_params)
+
+        if bye is not None:
+            bye_query = "INSERT INTO assigned_byes (tournament_id, player_id, round) " \
+                        "VALUES (%s, %s, %s);"
+
+            bye_params = (tournament_id, bye, next_round)
+
+            self.db_cursor.execute(bye_query, bye_params)
+
+        if pairings:
+            pairings_query = "INSERT INTO pairings " \
+                             "(tournament_id, round, board, player1_id, player2_id) " \
+                             "VALUES %s;"
+
+            psycopg2.extras.execute_values(
+                self.db_cursor, pairings_query,
+                [(tournament_id, next_round, board, row[0], row[2])
+                 for board, row in enumerate(pairings, 1)],
+                page_size=len(pairings))
+
+        return pairings
+
+    def swissPairings(self, tournament_id=1):
+        """Returns (id1, name1, id2, name2) pairings for the next round.
+
+        While a round started with startRound() has results to come, its
+        stored pairings are returned.
+        """
+
+        _, pairings = self._roundPairings(tournament_id)
+        if pairings is not None:
+            return pairings
+
+        return self._nextPairings(tournament_id)[0]
+
+    def byeHistory(self, tournament_id=1):
+        """Returns a dict mapping the ID of each player of a tournament who
+        has had a bye to the round it was given for, or None if it has no
+        round."""
+
+        query = "SELECT player_id, round FROM assigned_byes " \
+                "WHERE tournament_id = %s;"
+
+        params = (tournament_id,)
+
+        self.db_cursor.execute(query, params)
+
+        return dict(self.db_cursor.fetchall())
+
+    def countPlayersMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to its number of players,
+        counted with a single query."""
+
+        tournament_ids = list(tournament_ids)
+
+        query = "SELECT tournament_id, COUNT(*) FROM players " \
+                "WHERE tournament_id = ANY(%s) " \
+                "GROUP BY tournament_id;"
+
+        params = (tournament_ids,)
+
+        self.db_cursor.execute(query, params)
+        counts = dict((tournament_id, 0) for tournament_id in tournament_ids)
+        counts.update((tournament_id, int(count))
+                      for tournament_id, count in self.db_cursor.fetchall())
+
+        return counts
+
+    def playerStandingsMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to its standings, as
+        playerStandings() would return them.
+
+        The standings and results of every tournament are each read with a
+        single query, whatever the number of tournaments.
+        """
+
+        standings, results = self._standingsMany(tournament_ids), \
+            self._resultsMany(tournament_ids)
+
+        return dict((tournament_id, list(rankStandings(columns, results[tournament_id])))
+                    for tournament_id, columns in standings.items())
+
+    def swissPairingsMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to its pairings for the
+        next round, read with the same two queries as playerStandingsMany(),
+        one for the bye history and one for the stored pairings of rounds in
+        progress."""
+
+        tournament_ids = list(tournament_ids)
+        pairings = self._roundPairingsMany(tournament_ids)
+
+        unpaired = [tournament_id for tournament_id in tournament_ids
+                    if tournament_id not in pairings]
+        if unpaired:
+            standings, results, byes = self._standingsMany(unpaired), \
+                self._resultsMany(unpaired), self._byeHistoryMany(unpaired)
+
+            pairings.update(
+                (tournament_id,
+                 pairRound(rankStandings(columns, results[tournament_id]),
+                           _opponentSets(results[tournament_id]), byes[tournament_id])[0])
+                for tournament_id, columns in standings.items())
+
+        return pairings
+
+    def _standings(self, tournament_id=1):
+        """Returns a StandingsColumns of a tournament's players, with their
+        ratings, in standings_rank_idx order."""
+
+        # Walks standings_rank_idx in rank order rather than counting matches.
+        query = "SELECT p.id, p.name, s.wins, s.matches, p.rating " \
+                "FROM standings s JOIN players p " \
+                "ON p.tournament_id = s.tournament_id AND p.id = s.player_id " \
+                "WHERE s.tournament_id = %s " \
+                "ORDER BY s.wins DESC, s.matches, s.player_id;"
+
+        params = (tournament_id,)
+
+        self.db_cursor.execute(query, params)
 
+        return StandingsColumns.fromCursor(self.db_cursor, ratings=True)
 
-def connect(database_name="tournament"):
-    """Connect to the PostgreSQL database.  Returns a database connection."""
-    db_conn = psycopg2.connect("dbname={}".format(database_name))
-    db_cursor = db_conn.cursor()
+    def _results(self, tournament_id=1):
+        """Returns a tournament's matches as a list of (winner ID, loser ID) pairs."""
 
-    return db_conn, db_cursor
+        query = "SELECT winner_id, loser_id FROM matches " \
+                "WHERE tournament_id = %s;"
 
+        params = (tournament_id,)
 
-def deleteMatches(tournament_id=1):
-    """Remove all the match records from the database.
+        self.db_cursor.execute(query, params)
+
+        return self.db_cursor.fetchall()
+
+    def _roundPairings(self, tournament_id=1):
+        """Returns a tournament's current round number, or None if it has no
+        rounds, and the round's (id1, name1, id2, name2) pairings if any of
+        their results are still to come, or None if not."""
+
+        query = "SELECT r.round, p.player1_id, a.name, p.player2_id, b.name, p.reported " \
+                "FROM (SELECT max(round) AS round FROM rounds WHERE tournament_id = %s) r " \
+                "LEFT JOIN pairings p " \
+                "ON p.tournament_id = %s AND p.round = r.round " \
+                "LEFT JOIN players a ON a.tournament_id = p.tournament_id AND a.id = p.player1_id " \
+                "LEFT JOIN players b ON b.tournament_id = p.tournament_id AND b.id = p.player2_id " \
+                "ORDER BY p.board;"
+
+        params = (tournament_id, tournament_id)
+
+        self.db_cursor.execute(query, params)
+        rows = self.db_cursor.fetchall()
+
+        return rows[0][0], _openPairings([row[1:] for row in rows if row[1] is not None])
+
+    def _roundPairingsMany(self, tournament_ids):
+        """Returns a dict mapping the ID of each of the tournaments with a
+        round in progress to that round's pairings."""
+
+        query = "SELECT p.tournament_id, p.player1_id, a.name, p.player2_id, b.name, " \
+                "p.reported " \
+                "FROM pairings p " \
+                "JOIN players a ON a.tournament_id = p.tournament_id AND a.id = p.player1_id " \
+                "JOIN players b ON b.tournament_id = p.tournament_id AND b.id = p.player2_id " \
+                "WHERE (p.tournament_id, p.round) IN " \
+                "(SELECT tournament_id, max(round) FROM rounds " \
+                "WHERE tournament_id = ANY(%s) GROUP BY tournament_id) " \
+                "ORDER BY p.tournament_id, p.board;"
+
+        params = (list(tournament_ids),)
+
+        self.db_cursor.execute(query, params)
+
+        groups = _groupRows(tournament_ids, self.db_cursor.fetchall())
+        pairings = dict((tournament_id, _openPairings(rows))
+                        for tournament_id, rows in groups.items())
+
+        return dict((tournament_id, rows) for tournament_id, rows in pairings.items()
+                    if rows is not None)
+
+    def _draws(self, tournament_id=1):
+        """Returns a tournament's draws as a list of (player ID, player ID) pairs."""
+
+        query = "SELECT player1_id, player2_id FROM draws " \
+                "WHERE tournament_id = %s;"
+
+        params = (tournament_id,)
+
+        self.db_cursor.execute(query, params)
+
+        return self.db_cursor.fetchall()
+
+    def _setRatings(self, tournament_id, player_ids, ratings):
+        """Overwrites the ratings of the given players in a single UPDATE."""
+
+        query = "UPDATE players SET rating = r.rating " \
+                "FROM unnest(%s::int[], %s::float8[]) AS r(id, rating) " \
+                "WHERE players.tournament_id = %s AND players.id = r.id;"
+
+        params = (list(player_ids), [float(rating) for rating in ratings], tournament_id)
+
+        self.db_cursor.execute(query, params)
+
+    def _standingsMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to its StandingsColumns,
+        as returned by _standings()."""
+
+        tournament_ids = list(tournament_ids)
+
+        query = "SELECT s.tournament_id, p.id, p.name, s.wins, s.matches, p.rating " \
+                "FROM standings s JOIN players p " \
+                "ON p.tournament_id = s.tournament_id AND p.id = s.player_id " \
+                "WHERE s.tournament_id = ANY(%s) " \
+                "ORDER BY s.tournament_id, s.wins DESC, s.matches, s.player_id;"
+
+        params = (tournament_ids,)
+
+        self.db_cursor.execute(query, params)
+
+        # Each row goes straight into its tournament's columns as it is read.
+        groups = dict((tournament_id, StandingsColumns(ratings=()))
+                      for tournament_id in tournament_ids)
+        for row in self.db_cursor:
+            groups[row[0]].append(row[1:])
+
+        return groups
+
+    def _resultsMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to its (winner ID, loser
+        ID) pairs."""
+
+        tournament_ids = list(tournament_ids)
+
+        query = "SELECT tournament_id, winner_id, loser_id FROM matches " \
+                "WHERE tournament_id = ANY(%s);"
+
+        params = (tournament_ids,)
+
+        self.db_cursor.execute(query, params)
+
+        return _groupRows(tournament_ids, self.db_cursor.fetchall())
+
+    def _byeHistoryMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to the set of IDs of
+        its players who have had a bye."""
+
+        tournament_ids = list(tournament_ids)
+
+        query = "SELECT tournament_id, player_id FROM assigned_byes " \
+                "WHERE tournament_id = ANY(%s);"
+
+        params = (tournament_ids,)
+
+        self.db_cursor.execute(query, params)
+
+        return dict((tournament_id, set(row[0] for row in rows))
+                    for tournament_id, rows in
+                    _groupRows(tournament_ids, self.db_cursor.fetchall()).items())
+
+    def _nextPairings(self, tournament_id=1, allow_rematches=True):
+        """Pairs the next round from the standings, without storing it.
+
+        Args:
+          tournament_id: ID of the tournament to pair
+          allow_rematches: whether to fall back on a pairing with rematches
+            when no other can be found, rather than raise
+
+        Returns:
+          A pair of the (id1, name1, id2, name2) pairings and the ID of the
+          player who would get the round's bye, or None.
+
+        Raises:
+          TournamentException: if allow_rematches is false and every pairing
+            found has a rematch
+        """
+
+        results = self._results(tournament_id)
+        standings = rankStandings(self._standings(tournament_id), results)
+
+        # Player standings are already sorted by wins, tiebreaks and rating
+        # (which seeds the first round, when everyone is level), so the
+        # pairing engine only needs to know who has played whom to steer clear
+        # of rematches, and who has had a bye. If the number of players is
+        # odd, the lowest-ranked player without a bye gets it and is not
+        # paired.
+
+        opponents = _opponentSets(results)
+        pairings, bye = pairRound(standings, opponents, self.byeHistory(tournament_id))
+        if not allow_rematches:
+            _checkRematches(pairings, opponents)
+
+        return pairings, bye
+
+    def _checkRules(self, decided, drawn, tournament_id=1):
+        """Checks results for a tournament without rounds against the rules
+        of reportMatch(); see _checkResults()."""
+
+        # Fetch every player in the round that belongs to this tournament at
+        # once, locking them in ID order as report_match() and the rating
+        # trigger do, so that no other session can record a result for them
+        # between the checks below and the insert.
+        player_query = "SELECT id FROM players " \
+                       "WHERE tournament_id = %s AND id = ANY(%s) " \
+                       "ORDER BY id " \
+                       "FOR UPDATE;"
+
+        player_params = (tournament_id,
+                         list(set(player_id for pair in decided + drawn for player_id in pair)))
+
+        self.db_cursor.execute(player_query, player_params)
+        registered = set(row[0] for row in self.db_cursor.fetchall())
+
+        # Fetch every pairing in the round that has already been played.
+        played_query = "SELECT LEAST(winner_id, loser_id), GREATEST(winner_id, loser_id) " \
+                       "FROM matches " \
+                       "WHERE tournament_id = %s " \
+                       "AND (LEAST(winner_id, loser_id), GREATEST(winner_id, loser_id)) IN " \
+                       "(SELECT * FROM unnest(%s::int[], %s::int[]));"
+
+        played_params = (tournament_id,
+                         [min(pair) for pair in decided],
+                         [max(pair) for pair in decided])
+
+        self.db_cursor.execute(played_query, played_params)
+        played = set(self.db_cursor.fetchall())
+
+        return _checkResults(decided, registered, played, drawn)
+
+
+@_instrumented
+def createTournament(name, tournament_id=None):
+    """Creates a tournament whose players and matches are kept apart from
+    every other tournament's, and returns its ID.
+
+    Tournaments need not be created before players register for them, but
+    a created tournament's queries touch only its own rows, and it can be
+    dropped or archived in constant time with dropTournament().
 
     Args:
-      tournament_id: ID of tournament from which matches are being deleted
+      name: the tournament's name
+      tournament_id: ID to give the tournament; the next free ID if None.
+        Players already registered under this ID become part of it.
+
+    Returns:
+      The ID of the new tournament.
 
+    Raises:
+      TournamentException: if a tournament with that ID was already created
     """
 
-    db_conn, db_cursor = connect()
+    with getBackend().session() as session:
+        return session.createTournament(name, tournament_id)
 
-    query = "DELETE FROM matches " \
-            "WHERE tournament_id = %s;"
 
-    params = (tournament_id,)
+@_instrumented
+def dropTournament(tournament_id, archive=False):
+    """Removes a finished tournament with all of its players and matches.
 
-    db_cursor.execute(query, params)
-    db_conn.commit()
+    Args:
+      tournament_id: ID of the tournament to remove
+      archive: if True, keep the tournament's data out of the way of live
+        tournaments instead of discarding it. Only tournaments made with
+        createTournament() can be archived.
+
+    Raises:
+      TournamentException: if archive is set for a tournament that was not
+        made with createTournament()
+    """
 
-    _closeDb(db_conn, db_cursor)
+    with getBackend().session() as session:
+        session.dropTournament(tournament_id, archive)
 
 
-def deletePlayers(tournament_id=1):
-    """Remove all the player records from the database.
+@_instrumented
+def exportTournament(tournament_id, path):
+    """Saves a tournament's players, matches, draws and byes to a snapshot file.
+
+    The file is a compact binary format (see tournament_snapshot.py) that
+    importTournament() restores in one transaction, far faster than
+    replaying the tournament through registerPlayer() and reportMatch().
 
     Args:
-      tournament_id: ID of tournament from which players are being deleted
+      tournament_id: ID of the tournament to save
+      path: file the snapshot is written to
     """
 
-    db_conn, db_cursor = connect()
+    with getBackend().session(read_only=True) as session:
+        session.exportTournament(tournament_id, path)
 
-    query = "DELETE FROM players " \
-            "WHERE tournament_id = %s;"
 
-    params = (tournament_id,)
+@_instrumented
+def importTournament(path, tournament_id=None):
+    """Restores a tournament from a file written by exportTournament().
 
-    db_cursor.execute(query, params)
-    db_conn.commit()
+    Players keep the IDs they had when the snapshot was taken, and byes and
+    ratings are restored as they were. Snapshots written before ratings were
+    kept start every player at INITIAL_RATING.
+
+    Args:
+      path: snapshot file to read
+      tournament_id: ID of the tournament to restore into; the ID the
+        snapshot was taken from if None. It must have no players.
 
-    _closeDb(db_conn, db_cursor)
+    Returns:
+      The ID of the restored tournament.
 
+    Raises:
+      TournamentException: if the tournament already has players
+      ValueError: if the file is not a snapshot this version can read
+    """
 
-def countPlayers(tournament_id=1):
-    """Returns the number of players currently registered.
+    with getBackend().session() as session:
+        return session.importTournament(path, tournament_id)
+
+
+@_instrumented
+def deleteMatches(tournament_id=1):
+    """Remove all the match records from the database.
 
     Args:
-        tournament_id: ID of tournament for which players are being counted
+      tournament_id: ID of tournament from which matches are being deleted
+
     """
 
-    db_conn, db_cursor = connect()
+    with getBackend().session() as session:
+        session.deleteMatches(tournament_id)
+
 
-    query = "SELECT COUNT(*) FROM players " \
-            "WHERE tournament_id = %s;"
+@_instrumented
+def deletePlayers(tournament_id=1):
+    """Remove all the player records from the database.
+
+    Args:
+      tournament_id: ID of tournament from which players are being deleted
+    """
 
-    params = (tournament_id,)
+    with getBackend().session() as session:
+        session.deletePlayers(tournament_id)
 
-    db_cursor.execute(query, params)
-    player_count = db_cursor.fetchone()[0]  # Column 0 contains number of players.
 
-    _closeDb(db_conn, db_cursor)
+@_instrumented
+def countPlayers(tournament_id=1):
+    """Returns the number of players currently registered.
+
+    Args:
+        tournament_id: ID of tournament for which players are being counted
+    """
 
-    return int(player_count)  # Convert to int before returning.
+    with getBackend().session(read_only=True) as session:
+        return session.countPlayers(tournament_id)
 
 
-def registerPlayer(name, tournament_id=1):
+@_instrumented
+@_retried
+def registerPlayer(name, tournament_id=1, rating=None):
     """Adds a player to the tournament database.
-  
+
     The database assigns a unique serial id number for the player.  (This
     should be handled by your SQL database schema, not in your Python code.)
-  
+
     Args:
       name: the player's full name (need not be unique).
       tournament_id: ID of tournament player is registering for
+      rating: the player's seed rating, e.g. from a national rating list;
+        INITIAL_RATING if None
     """
 
-    db_conn, db_cursor = connect()
+    with getBackend().session() as session:
+        session.registerPlayer(name, tournament_id, rating)
 
-    query = "INSERT INTO players (name, tournament_id)" \
-            "VALUES (%s, %s);"
 
-    paramters = (name, tournament_id)
+@_instrumented
+def registerPlayers(names, tournament_id=1, ratings=None):
+    """Adds many players to the tournament database in one transaction.
 
-    db_cursor.execute(query, paramters)
-    db_conn.commit()
+    Much faster than calling registerPlayer() once per player when importing
+    a large field.
+
+    Args:
+      names: iterable of the players' full names (need not be unique)
+      tournament_id: ID of tournament players are registering for
+      ratings: iterable of the players' seed ratings, in the same order as
+        names; everyone starts at INITIAL_RATING if None
 
-    _closeDb(db_conn, db_cursor)
+    Returns:
+      A list of the new players' IDs, in the same order as names.
+    """
 
-    _assignBye(tournament_id)
+    with getBackend().session() as session:
+        return session.registerPlayers(names, tournament_id, ratings)
 
 
+@_instrumented
 def playerStandings(tournament_id=1):
     """Returns a list of the players and their win records, sorted by wins.
 
     The first entry in the list should be the player in first place, or a player
     tied for first place if there is currently a tie.
 
+    Players with the same number of wins are ordered by fewest matches played,
+    then by the tiebreaks returned by playerTiebreaks(), best first, and
+    finally by lowest id.
+
     Args:
       tournament_id: ID of tournament for which standings are being compiled
 
@@ -121,87 +1695,213 @@ def playerStandings(tournament_id=1):
         matches: the number of matches the player has played
     """
 
-    db_conn, db_cursor = connect()
+    return _cachedRead("playerStandings", tournament_id)
 
-    query = "SELECT ps.id, ps.name, ps.wins, ps.matches FROM " \
-            "(SELECT * FROM player_standings WHERE tournament_id = %s) ps;"
 
-    params = (tournament_id,)
+@_instrumented
+def columnStandings(tournament_id=1):
+    """Returns the standings playerStandings() returns, held column by column.
 
-    db_cursor.execute(query, params)
-    results = db_cursor.fetchall()
+    For very large tournaments: the IDs, wins, matches and ratings are kept
+    in typed arrays and the names are interned, rather than every row being
+    a tuple of its own. The result still iterates, indexes and compares like
+    playerStandings()'s list, and can be passed to rankStandings(),
+    computeTiebreaks() and pairPlayers() as it is.
 
-    _closeDb(db_conn, db_cursor)
+    Args:
+      tournament_id: ID of tournament for which standings are being compiled
 
-    return results
+    Returns:
+      A tournament_columns.StandingsColumns, whose ids, names, wins, matches
+      and ratings attributes hold each column in rank order.
+    """
 
+    return _cachedRead("columnStandings", tournament_id)
 
-def reportMatch(winner, loser, tournament_id=1, draw=False):
-    """Records the outcome of a single match between two players.
-    If draw is True, no wins or losses are recorded.
+
+def iterStandings(tournament_id=1, batch_size=1000):
+    """Yields the players and their win records one at a time, sorted by wins.
+
+    Unlike playerStandings(), the standings are never held in memory all at
+    once: rows are fetched from the database batch_size at a time. A pooled
+    connection is held until the last row has been read or the generator is
+    closed. Tiebreaks need every result at once, so players level on wins
+    and matches are not ordered by them here but by lowest id.
 
     Args:
-      winner:  the id number of the player who won
-      loser:  the id number of the player who lost
-      tournament_id: ID of tournament match belongs to
-      draw: boolean value indicating whether result of match was a draw
+      tournament_id: ID of tournament for which standings are being read
+      batch_size: number of rows fetched from the database at a time
+
+    Yields:
+      (id, name, wins, matches) tuples, as for playerStandings().
+    """
+
+    with getBackend().session(read_only=True) as session:
+        for row in session.iterStandings(tournament_id, batch_size):
+            yield row
+
+
+@_instrumented
+def playerTiebreaks(tournament_id=1):
+    """Returns every player's tiebreaks, as used to order playerStandings().
+
+    Args:
+      tournament_id: ID of tournament for which tiebreaks are being computed
+
+    Returns:
+      A dict mapping each player's id to a tuple of (omw, buchholz,
+      median_buchholz, sonneborn_berger):
+        omw: average match-win percentage of the player's opponents, each
+          counted as at least 1/3
+        buchholz: sum of the opponents' wins
+        median_buchholz: buchholz without the best and worst opponent
+        sonneborn_berger: sum of the wins of the opponents the player beat
     """
 
-    if not draw:
-        db_conn, db_cursor = connect()
+    with getBackend().session(read_only=True) as session:
+        return session.playerTiebreaks(tournament_id)
 
-        # Select player rows to ensure players are in the correct tournament.
-        player_row_query = "SELECT tournament_id " \
-                           "FROM players " \
-                           "WHERE id = %s OR id = %s;"
 
-        player_row_params = (winner, loser)
+@_instrumented
+def playerRatings(tournament_id=1):
+    """Returns every player's current Elo rating.
 
-        db_cursor.execute(player_row_query, player_row_params)
-        player_rows = db_cursor.fetchall()
+    Ratings start at each player's seed rating and are updated as each match
+    or draw is recorded. They order players level on wins and tiebreaks in
+    playerStandings() and swissPairings().
 
-        # Make sure that winner and loser are not equal, that both players are registered
-        # for the correct tournament.
-        if winner != loser and (db_cursor.rowcount != 2
-                                or player_rows[0][0] != tournament_id
-                                or player_rows[1][0] != tournament_id):
-            raise TournamentException("Both players must exist and be registered "
-                                      "for the correct tournament.")
+    Args:
+      tournament_id: ID of tournament for which ratings are being read
+
+    Returns:
+      A dict mapping each player's id to their rating.
+    """
+
+    with getBackend().session(read_only=True) as session:
+        return session.playerRatings(tournament_id)
+
+
+@_instrumented
+def recomputeRatings(tournament_id=1):
+    """Recomputes every player's rating from the tournament's whole history.
+
+    Ratings updated game by game depend on the order results were reported
+    in. This rates every game at once instead (see
+    tournament_ratings.computeRatings), so the result depends only on the
+    seeds, matches and draws.
+
+    Args:
+      tournament_id: ID of tournament whose ratings are being recomputed
+
+    Returns:
+      A dict mapping each player's id to their new rating.
+    """
+
+    with getBackend().session() as session:
+        return session.recomputeRatings(tournament_id)
+
+
+@_instrumented
+def topStandings(tournament_id=1, limit=50, after=None):
+    """Returns one page of the standings, e.g. for a leaderboard.
+
+    To read the next page, pass the last row of the current one as after.
+    Each page is found with an index seek, so reading deep into a large
+    tournament is as cheap as reading the top. As with iterStandings(),
+    players level on wins and matches are ordered by lowest id, not by
+    tiebreaks.
+
+    Args:
+      tournament_id: ID of tournament for which standings are being read
+      limit: maximum number of rows to return
+      after: last (id, name, wins, matches) row of the previous page, or
+        None for the first page
+
+    Returns:
+      A list of up to limit (id, name, wins, matches) tuples, in the same
+      order as playerStandings().
+    """
+
+    with getBackend().session(read_only=True) as session:
+        return session.topStandings(tournament_id, limit, after)
+
+
+@_instrumented
+def rebuildStandings(tournament_id=1):
+    """Recomputes standings for a tournament from its recorded matches and byes.
+
+    Standings are normally kept current as matches and byes are recorded, so
+    this is only needed to repair counters that have drifted, e.g. after rows
+    were edited by hand.
+
+    Args:
+      tournament_id: ID of tournament whose standings are being rebuilt
+    """
+
+    with getBackend().session() as session:
+        session.rebuildStandings(tournament_id)
+
+
+@_instrumented
+@_retried
+def reportMatch(winner, loser, tournament_id=1, draw=False):
+    """Records the outcome of a single match between two players.
+    If draw is True, no wins or losses are recorded, but the draw still
+    counts towards both players' ratings.
 
-        # Ensure that players have not already played each other.
-        duplicate_match_query = "SELECT count(*) FROM matches " \
-                                "WHERE winner_id = %(winner)s AND loser_id = %(loser)s " \
-                                "OR winner_id = %(loser)s AND loser_id = %(winner)s;"
+    Once a round has been started with startRound(), a result is only
+    accepted for a pairing of the current round, once.
 
-        duplicate_match_params = {'winner': winner, 'loser': loser}
+    Safe to call from many threads at once: of two reports of the same
+    pairing made at the same time, in either order, one is recorded and the
+    other raises TournamentException.
+
+    Args:
+      winner:  the id number of the player who won
+      loser:  the id number of the player who lost
+      tournament_id: ID of tournament match belongs to
+      draw: boolean value indicating whether result of match was a draw
+    """
 
-        db_cursor.execute(duplicate_match_query, duplicate_match_params)
+    with getBackend().session() as session:
+        session.reportMatch(winner, loser, tournament_id, draw)
 
-        if db_cursor.fetchone()[0] != 0:
-            raise TournamentException("Players can only have played each other once.")
 
-        insert_query = "INSERT INTO matches (winner_id, loser_id, tournament_id) " \
-                       "VALUES (%s, %s, %s);"
+@_instrumented
+def reportMatches(results, tournament_id=1):
+    """Records the outcomes of a whole round of matches in one transaction.
 
-        insert_params = (winner, loser, tournament_id)
+    All results are validated before any of them is recorded. If any result
+    breaks a rule, none are recorded and a single TournamentException lists
+    every violation in its errors attribute.
 
-        db_cursor.execute(insert_query, insert_params)
-        db_conn.commit()
+    Args:
+      results: iterable of (winner, loser, draw) tuples, as for reportMatch()
+      tournament_id: ID of tournament the matches belong to
+    """
 
-        _closeDb(db_conn, db_cursor)
+    with getBackend().session() as session:
+        session.reportMatches(results, tournament_id)
 
 
+@_instrumented
 def swissPairings(tournament_id=1):
     """Returns a list of pairs of players for the next round of a match.
-  
+
     Assuming that there are an even number of players registered, each player
     appears exactly once in the pairings.  Each player is paired with another
     player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
+    to him or her in the standings, skipping over players they have already
+    played so that rematches are avoided whenever possible.
+
+    With an odd number of players, the player who would get the round's bye
+    from startRound() is left out of the pairings. While a round started
+    with startRound() has results to come, its stored pairings are returned
+    instead of new ones.
 
     Args:
       tournament_id: ID of tournament for which pairings are being compiled
-  
+
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
         id1: the first player's unique id
@@ -210,67 +1910,307 @@ def swissPairings(tournament_id=1):
         name2: the second player's name
     """
 
-    standings = playerStandings(tournament_id)
+    return _cachedRead("swissPairings", tournament_id)
+
+
+@_instrumented
+@_retried
+def startRound(tournament_id=1):
+    """Starts a tournament's next round, pairing it once and for all.
+
+    The pairings are computed as by swissPairings() and stored, so every
+    later read of them, by swissPairings() or by this function, returns the
+    same ones with an index lookup. From then on each reported result must
+    be for one of the current round's pairings, and only one result is
+    accepted per pairing. Calling this again before every result of the
+    round is in returns the round's pairings without starting another.
+
+    If the tournament has an odd number of players, the round's bye goes to
+    the lowest-ranked player who has not had one yet; see byeHistory().
+
+    Raises:
+      TournamentException: if every pairing of the round found would have a
+        rematch, which could never be reported
+
+    Args:
+      tournament_id: ID of tournament whose next round is being started
+
+    Returns:
+      The round's pairings, as (id1, name1, id2, name2) tuples.
+    """
+
+    with getBackend().session() as session:
+        return session.startRound(tournament_id)
+
+
+@_instrumented
+def byeHistory(tournament_id=1):
+    """Returns which players of a tournament have had a bye, and when.
+
+    When a tournament has an odd number of players, startRound() gives the
+    round's bye to the lowest-ranked player who has not had one yet, which
+    counts as a win and a match. Each player gets at most one bye.
+
+    Args:
+      tournament_id: ID of tournament whose byes are being read
+
+    Returns:
+      A dict mapping the ID of each player who has had a bye to the round it
+      was given for, or None for a bye restored from a snapshot or given
+      before byes were given per round.
+    """
+
+    with getBackend().session(read_only=True) as session:
+        return session.byeHistory(tournament_id)
+
+
+@_instrumented
+def countPlayersMany(tournament_ids):
+    """Returns the number of players registered for each of many tournaments.
+
+    Every tournament is counted with a single query, so this is much cheaper
+    than calling countPlayers() in a loop, e.g. for a dashboard.
+
+    Args:
+      tournament_ids: iterable of IDs of the tournaments to count
+
+    Returns:
+      A dict mapping each tournament ID to its number of players.
+    """
+
+    with getBackend().session(read_only=True) as session:
+        return session.countPlayersMany(tournament_ids)
+
+
+@_instrumented
+def playerStandingsMany(tournament_ids):
+    """Returns the standings of many tournaments at once.
+
+    The standings and results of all the tournaments are read with one query
+    each, rather than two per tournament. Cached standings are used where
+    the cache is enabled.
+
+    Args:
+      tournament_ids: iterable of IDs of the tournaments to read
+
+    Returns:
+      A dict mapping each tournament ID to a list of (id, name, wins,
+      matches) tuples, as returned by playerStandings().
+    """
 
-    # Player standings are already sorted by wins, so just select pairs
-    # from rows returned by playerStandings() function. Player in last place
-    # is not paired if number of players is odd.
+    return _cachedReadMany("playerStandings", tournament_ids)
 
-    return [(standings[i][0], standings[i][1],
-             standings[i + 1][0], standings[i + 1][1])
-            for i in range(0, len(standings) - 1, 2)]
 
+@_instrumented
+def swissPairingsMany(tournament_ids):
+    """Returns the next round's pairings of many tournaments at once.
 
-def _assignBye(tournament_id=1):
-    """Assigns a bye on tournaments with odd number of players, increasing
-    player's record by 1 win and 1 match. If a tournament has an even number
-    of players, the bye is revoked.
+    As with playerStandingsMany(), the tournaments' data is read with one
+    query per table rather than per tournament.
 
     Args:
-      tournament_id: tournament ID which bye may be assigned to
+      tournament_ids: iterable of IDs of the tournaments to pair
+
+    Returns:
+      A dict mapping each tournament ID to a list of (id1, name1, id2, name2)
+      tuples, as returned by swissPairings().
+    """
+
+    return _cachedReadMany("swissPairings", tournament_ids)
+
+
+def _cachedRead(method, tournament_id):
+    """Calls a read-only TournamentSession method, through the cache if enabled."""
+    cache = _cache
+
+    if cache is None:
+        with getBackend().session(read_only=True) as session:
+            return getattr(session, method)(tournament_id)
+
+    found, results = cache.get(tournament_id, method)
+    if not found:
+        generation = cache.generation(tournament_id)
+        with getBackend().session(read_only=True) as session:
+            results = getattr(session, method)(tournament_id)
+        cache.put(tournament_id, method, results, generation)
+
+    # Hand out a copy so callers cannot change the cached list or columns.
+    return results[:]
+
+
+def _cachedReadMany(method, tournament_ids):
+    """Calls the batch form of a read-only TournamentSession method (e.g.
+    playerStandingsMany for playerStandings), reading only the tournaments
+    missing from the cache if it is enabled."""
+    cache = _cache
+    tournament_ids = list(tournament_ids)
+
+    if cache is None:
+        with getBackend().session(read_only=True) as session:
+            return getattr(session, method + "Many")(tournament_ids)
+
+    found = {}
+    missing = []
+    for tournament_id in tournament_ids:
+        hit, results = cache.get(tournament_id, method)
+        if hit:
+            found[tournament_id] = list(results)
+        else:
+            missing.append(tournament_id)
+
+    if missing:
+        generations = dict((tournament_id, cache.generation(tournament_id))
+                           for tournament_id in missing)
+        with getBackend().session(read_only=True) as session:
+            read = getattr(session, method + "Many")(missing)
+
+        for tournament_id, results in read.items():
+            cache.put(tournament_id, method, results, generations[tournament_id])
+            found[tournament_id] = list(results)
+
+    return found
+
+
+def _invalidateCache(tournament_ids):
+    """Drops cached reads for tournaments that have just been written to."""
+    cache = _cache
+
+    if cache is not None:
+        for tournament_id in tournament_ids:
+            cache.invalidate(tournament_id)
+
+
+def _opponentSets(results):
+    """Returns a dict mapping each player ID to the set of IDs they have played."""
+    opponents = {}
+    for winner, loser in results:
+        opponents.setdefault(winner, set()).add(loser)
+        opponents.setdefault(loser, set()).add(winner)
+
+    return opponents
+
+
+def _groupRows(tournament_ids, rows):
+    """Groups rows whose first column is a tournament ID by that ID.
+
+    Returns:
+      A dict mapping each of tournament_ids to the list of its rows without
+      the tournament ID, in their original order.
     """
-    db_conn, db_cursor = connect()
+    groups = dict((tournament_id, []) for tournament_id in tournament_ids)
+    for row in rows:
+        groups[row[0]].append(row[1:])
+
+    return groups
 
-    # If number of players registered for a given tournament is odd, assign
-    # a bye. Otherwise, revoke any previously assigned bye by deleting from
-    # the assigned_byes table.
-    if countPlayers(tournament_id) % 2 != 0:
-        # Bye is automatically assigned to the lowest player ID.
-        low_player_id_query = "SELECT id FROM players " \
-                              "WHERE tournament_id = %s " \
-                              "ORDER BY id LIMIT 1;"
 
-        low_player_id_params = (tournament_id,)
+def _openPairings(rows):
+    """Returns the (id1, name1, id2, name2) pairings of a round's (id1, name1,
+    id2, name2, reported) rows if any of them is still to be reported, or
+    None if none is."""
+    if all(row[4] for row in rows):
+        return None
 
-        db_cursor.execute(low_player_id_query, low_player_id_params)
-        player_id = db_cursor.fetchone()[0]
+    return [row[:4] for row in rows]
 
-        insert_query = "INSERT INTO assigned_byes (tournament_id, player_id)" \
-                       "VALUES (%s, %s);"
 
-        insert_params = (tournament_id, player_id)
+def _pageParams(tournament_id, limit, after):
+    """Returns the query parameters for a page of topStandings()."""
+    params = {'tournament_id': tournament_id, 'limit': limit}
 
-        db_cursor.execute(insert_query, insert_params)
-    else:
-        delete_query = "DELETE FROM assigned_byes " \
-                       "WHERE tournament_id = %s;"
+    if after is not None:
+        player_id, _, wins, matches = after
+        params.update(wins=wins, matches=matches, player_id=player_id)
 
-        delete_params = (tournament_id,)
+    return params
 
-        db_cursor.execute(delete_query, delete_params)
 
-    db_conn.commit()
+def _checkRematches(pairings, opponents):
+    """Raises TournamentException if any of a round's (id1, name1, id2,
+    name2) pairings is between players who have already played, since the
+    round could then never be completed."""
 
-    _closeDb(db_conn, db_cursor)
+    for id1, _, id2, _ in pairings:
+        if id2 in opponents.get(id1, ()):
+            raise TournamentException(
+                "The next round cannot be paired without a rematch.")
 
 
-def _closeDb(db_conn, db_cursor):
-    """Closes database connection and cursor.
+def _checkResults(decided, registered, played, drawn=(), paired=None):
+    """Checks a round of results against the tournament's rules.
 
     Args:
-      db_conn: Database connection object
-      db_cursor: Database cursor object
+      decided: list of (winner, loser) pairs being reported
+      registered: set of the IDs among them registered for the tournament
+      played: set of (lowest ID, highest ID) pairs that have already met
+      drawn: list of (player, player) pairs reported as draws, which are
+        checked like decided results except that they may be rematches
+      paired: set of (lowest ID, highest ID) pairs of the current round
+        whose results are still to come, or None if the tournament has no
+        rounds. If given, each result need only be for one of these pairs,
+        and registered and played are not used.
+
+    Returns:
+      A list of ((winner, loser, draw), reason) tuples, one per rejected result.
     """
 
-    db_cursor.close()
-    db_conn.close()
+    if paired is not None:
+        return _checkPairings(decided, drawn, paired)
+
+    played = set(played)
+    errors = []
+
+    for winner, loser in decided:
+        result = (winner, loser, False)
+        pair = (min(winner, loser), max(winner, loser))
+
+        if winner == loser:
+            errors.append((result, "A player cannot play against themselves."))
+        elif winner not in registered or loser not in registered:
+            errors.append((result, "Both players must exist and be registered "
+                                   "for the correct tournament."))
+        elif pair in played:
+            errors.append((result, "Players can only have played each other once."))
+
+        # Later results in the same round may not repeat this pairing either.
+        played.add(pair)
+
+    for player1, player2 in drawn:
+        result = (player1, player2, True)
+
+        if player1 == player2:
+            errors.append((result, "A player cannot play against themselves."))
+        elif player1 not in registered or player2 not in registered:
+            errors.append((result, "Both players must exist and be registered "
+                                   "for the correct tournament."))
+
+    return errors
+
+
+def _checkPairings(decided, drawn, paired):
+    """Checks a round of results against the pairings still open in the
+    current round; see _checkResults()."""
+
+    paired = set(paired)
+    errors = []
+
+    for results, draw in ((decided, False), (drawn, True)):
+        for player1, player2 in results:
+            pair = (min(player1, player2), max(player1, player2))
+
+            if pair in paired:
+                # A second result for the same pairing is rejected.
+                paired.discard(pair)
+            else:
+                errors.append(((player1, player2, draw), NOT_PAIRED))
+
+    return errors
+
+
+def _copyText(value):
+    """Encodes a value as a field of COPY's text format."""
+    if not isinstance(value, bytes):
+        value = value.encode("utf-8")
+
+    return value.replace(b"\\", b"\\\\").replace(b"\t", b"\\t") \
+        .replace(b"\n", b"\\n").replace(b"\r", b"\\r")
@@ -6,10 +6,11 @@ CREATE DATABASE tournament;
 \c tournament
 
 -- Drop existing tables and views
-DROP VIEW player_standings;
+DROP VIEW IF EXISTS player_standings;
+DROP TABLE IF EXISTS standings;
 DROP TABLE IF EXISTS matches;
-DROP TABLE IF EXISTS players;
 DROP TABLE IF EXISTS assigned_byes;
+DROP TABLE IF EXISTS players;
 
 -- Players table: tracks only players' names and ID's
 CREATE TABLE IF NOT EXISTS players(
@@ -34,15 +35,114 @@ CREATE TABLE IF NOT EXISTS assigned_byes(
 	PRIMARY KEY(tournament_id, player_id)
 );
 
+-- Standings table: one row of counters per player, kept current by the
+-- triggers below so that reading standings never has to count matches.
+-- A bye counts as one win and one match, so wins and matches include byes;
+-- byes records how many of them came from byes.
+CREATE TABLE IF NOT EXISTS standings(
+	player_id INT PRIMARY KEY REFERENCES players(id) ON DELETE CASCADE,
+	tournament_id INT NOT NULL,
+	wins INT NOT NULL DEFAULT 0,
+	matches INT NOT NULL DEFAULT 0,
+	byes INT NOT NULL DEFAULT 0
+);
+
+-- Standings are read one tournament at a time in rank order: most wins first,
+-- then fewest matches (the better win ratio), then player ID.
+CREATE INDEX standings_rank_idx
+	ON standings (tournament_id, wins DESC, matches, player_id);
+
+-- Every registered player starts with an empty standings row.
+CREATE OR REPLACE FUNCTION standings_add_player() RETURNS TRIGGER AS $$
+BEGIN
+	INSERT INTO standings (player_id, tournament_id)
+	VALUES (NEW.id, NEW.tournament_id);
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER players_standings
+	AFTER INSERT ON players
+	FOR EACH ROW EXECUTE PROCEDURE standings_add_player();
+
+-- Recorded matches add a win and a match to the winner and a match to the
+-- loser; deleted matches take them away again.
+CREATE OR REPLACE FUNCTION standings_count_match() RETURNS TRIGGER AS $$
+BEGIN
+	IF TG_OP IN ('UPDATE', 'DELETE') THEN
+		UPDATE standings SET wins = wins - 1, matches = matches - 1
+		WHERE player_id = OLD.winner_id;
+		UPDATE standings SET matches = matches - 1
+		WHERE player_id = OLD.loser_id;
+	END IF;
+
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		UPDATE standings SET wins = wins + 1, matches = matches + 1
+		WHERE player_id = NEW.winner_id;
+		UPDATE standings SET matches = matches + 1
+		WHERE player_id = NEW.loser_id;
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER matches_standings
+	AFTER INSERT OR UPDATE OR DELETE ON matches
+	FOR EACH ROW EXECUTE PROCEDURE standings_count_match();
+
+-- Assigned byes count as a win and a match; revoked byes take them away.
+CREATE OR REPLACE FUNCTION standings_count_bye() RETURNS TRIGGER AS $$
+BEGIN
+	IF TG_OP IN ('UPDATE', 'DELETE') THEN
+		UPDATE standings
+		SET wins = wins - 1, matches = matches - 1, byes = byes - 1
+		WHERE player_id = OLD.player_id;
+	END IF;
+
+	IF TG_OP IN ('INSERT', 'UPDATE') THEN
+		UPDATE standings
+		SET wins = wins + 1, matches = matches + 1, byes = byes + 1
+		WHERE player_id = NEW.player_id;
+	END IF;
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER assigned_byes_standings
+	AFTER INSERT OR UPDATE OR DELETE ON assigned_byes
+	FOR EACH ROW EXECUTE PROCEDURE standings_count_bye();
+
+-- Recomputes a tournament's standings rows from players, matches and
+-- assigned_byes, repairing any drift in the counters.
+CREATE OR REPLACE FUNCTION rebuild_standings(t INT) RETURNS VOID AS $$
+	DELETE FROM standings WHERE tournament_id = t;
+
+	INSERT INTO standings (player_id, tournament_id, wins, matches, byes)
+	SELECT p.id, p.tournament_id,
+		COALESCE(w.n, 0) + COALESCE(b.n, 0),
+		COALESCE(m.n, 0) + COALESCE(b.n, 0),
+		COALESCE(b.n, 0)
+	FROM players p
+	LEFT JOIN (SELECT winner_id AS id, COUNT(*) AS n FROM matches
+	           WHERE tournament_id = t GROUP BY winner_id) w ON w.id = p.id
+	LEFT JOIN (SELECT id, COUNT(*) AS n FROM
+	               (SELECT winner_id AS id FROM matches WHERE tournament_id = t
+	                UNION ALL
+	                SELECT loser_id FROM matches WHERE tournament_id = t) played
+	           GROUP BY id) m ON m.id = p.id
+	LEFT JOIN (SELECT player_id AS id, COUNT(*) AS n FROM assigned_byes
+	           WHERE tournament_id = t GROUP BY player_id) b ON b.id = p.id
+	WHERE p.tournament_id = t;
+$$ LANGUAGE SQL;
+
 -- Player standings view: displays table of rows with player ID, player name,
--- wins, and matches columns. Sorted first by number of wins, then OWM (number of wins / number of players).
--- Because players cannot re-play one another, number of opponents equals number of matches.
+-- wins, and matches columns, read straight from the standings table. Sorted
+-- first by number of wins, then by fewest matches (the better win ratio).
 -- If a player is assigned a bye, their win & match totals are both increased by 1.
 CREATE VIEW player_standings AS
-	SELECT q.* FROM (SELECT p.*, ((SELECT COUNT(*) FROM matches m WHERE m.winner_id =
-	p.id) + (SELECT COUNT(*) FROM assigned_byes b WHERE p.id = b.player_id)) AS wins,
-	((SELECT COUNT(*) FROM matches m WHERE m.winner_id = p.id OR m.loser_id = p.id) +
-	(SELECT COUNT(*) FROM assigned_byes b WHERE p.id = b.player_id)) AS matches
-	FROM players p
-	ORDER BY wins DESC) q
-	ORDER BY (q.wins / greatest(q.matches, 1)) DESC;
\ No newline at end of file
+	SELECT p.id, p.name, s.tournament_id, s.wins, s.matches, s.byes
+	FROM standings s
+	JOIN players p ON p.id = s.player_id
+	ORDER BY s.tournament_id, s.wins DESC, s.matches, s.player_id;
@@ -0,0 +1,1361 @@
+#!/usr/bin/env python3
+#
+# tournament_async.py -- asyncio implementation of the Swiss-system tournament API
+#
+# Mirrors the API in tournament.py with coroutines, on top of aiopg's
+# asynchronous psycopg2 connections. Requires Python 3.7 or later and aiopg
+# (pip install aiopg).
+#
+
+import asyncio
+import contextvars
+import functools
+import random
+
+import aiopg
+import psycopg2
+from tournament import DATABASE_NAME, POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS, \
+    ROUND_LOCK_KEY, RULE_VIOLATIONS, TRANSACTION_RETRIES, _checkRematches, _checkResults, \
+    _cursor_ids, _groupRows, _invalidateCache, _openPairings, _opponentSets, _pageParams
+from tournament_columns import FETCH_BATCH_SIZE, StandingsColumns
+from tournament_exception import TournamentException
+from tournament_feed import FEED_CHANNEL, NAMES_QUERY, STANDINGS_QUERY, parseDelta, \
+    _applyDeltas, _indexOrder, _loadStandings, _namesByPlayer, _namesParams, _newPlayers
+from tournament_pairing import pairRound
+from tournament_ratings import INITIAL_RATING, computeRatings
+from tournament_snapshot import TournamentSnapshot, readSnapshot, writeSnapshot
+from tournament_tiebreaks import computeTiebreaks, rankStandings
+
+
+_pool = None
+_pool_lock = None
+
+# Optional pool on a streaming replica for read-only calls; see
+# configureReplica().
+_replica_pool = None
+_read_your_writes = True
+
+# Per task, the primary's WAL position after its last write, until the
+# replica is known to have replayed it. Tasks started afterwards inherit it.
+_last_write = contextvars.ContextVar("tournament_last_write", default=None)
+
+
+async def configurePool(database_name=DATABASE_NAME,
+                        minconn=POOL_MIN_CONNECTIONS, maxconn=POOL_MAX_CONNECTIONS, dsn=None):
+    """Replaces the shared connection pool used by the module-level API.
+
+    Connections held by the previous pool are closed once they are released.
+
+    Args:
+      database_name: name of the database to connect to
+      minconn: number of connections opened up front
+      maxconn: maximum number of connections open at once
+      dsn: libpq connection string, used instead of database_name if given
+
+    Returns:
+      The new aiopg pool.
+    """
+    global _pool
+
+    async with _poolLock():
+        old_pool = _pool
+        _pool = await aiopg.create_pool(dsn or "dbname={}".format(database_name),
+                                        minsize=minconn, maxsize=maxconn)
+
+    if old_pool is not None:
+        old_pool.close()
+        await old_pool.wait_closed()
+
+    return _pool
+
+
+async def configureReplica(database_name=DATABASE_NAME,
+                           minconn=POOL_MIN_CONNECTIONS, maxconn=POOL_MAX_CONNECTIONS,
+                           dsn=None, read_your_writes=True):
+    """Sends the module-level API's read-only calls to a replica. See
+    tournament.configureReplica; with read_your_writes, a task's reads
+    follow its own writes, and those of the task that started it.
+
+    Returns:
+      The new aiopg pool.
+    """
+    global _replica_pool, _read_your_writes
+
+    async with _poolLock():
+        old_pool = _replica_pool
+        _replica_pool = await aiopg.create_pool(dsn or "dbname={}".format(database_name),
+                                                minsize=minconn, maxsize=maxconn)
+        _read_your_writes = read_your_writes
+
+    if old_pool is not None:
+        old_pool.close()
+        await old_pool.wait_closed()
+
+    return _replica_pool
+
+
+async def disableReplica():
+    """Sends read-only calls back to the primary and closes the replica's pool."""
+    global _replica_pool
+
+    async with _poolLock():
+        old_pool, _replica_pool = _replica_pool, None
+
+    if old_pool is not None:
+        old_pool.close()
+        await old_pool.wait_closed()
+
+
+async def closePool():
+    """Closes the shared connection pool, e.g. before the event loop stops."""
+    global _pool
+
+    async with _poolLock():
+        old_pool, _pool = _pool, None
+
+    if old_pool is not None:
+        old_pool.close()
+        await old_pool.wait_closed()
+
+
+def _poolLock():
+    """Returns the lock guarding the shared pool.
+
+    Created on first use rather than at import, so that it belongs to the
+    event loop that is actually running.
+    """
+    global _pool_lock
+
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+
+    return _pool_lock
+
+
+async def _replicaConnection(replica_pool):
+    """Acquires a replica connection for a read-only session, or returns
+    None if the replica has not yet replayed this task's last write. See
+    tournament._replicaConnection."""
+
+    lsn = _last_write.get()
+    db_conn = await replica_pool.acquire()
+    if lsn is None or not _read_your_writes:
+        return db_conn
+
+    try:
+        db_cursor = await db_conn.cursor()
+        await db_cursor.execute("SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn;", (lsn,))
+        caught_up = (await db_cursor.fetchone())[0]
+        db_cursor.close()
+    except BaseException:
+        db_conn.close()
+        await replica_pool.release(db_conn)
+        raise
+
+    if not caught_up:
+        await replica_pool.release(db_conn)
+        return None
+
+    _last_write.set(None)
+
+    return db_conn
+
+
+async def _getPool():
+    """Returns the shared connection pool, creating it on first use."""
+    global _pool
+
+    if _pool is None:
+        async with _poolLock():
+            if _pool is None:
+                _pool = await aiopg.create_pool("dbname={}".format(DATABASE_NAME),
+                                                minsize=POOL_MIN_CONNECTIONS,
+                                                maxsize=POOL_MAX_CONNECTIONS)
+
+    return _pool
+
+
+class AsyncTournamentSession(object):
+    """A unit of work against the tournament database, for use with asyncio.
+
+    The asynchronous counterpart of tournament.TournamentSession: one pooled
+    connection and one transaction for the whole ``async with`` block,
+    committed on normal exit and rolled back if the block raises.
+
+        async with AsyncTournamentSession() as session:
+            await session.registerPlayer("Flynn Taggart")
+            standings = await session.playerStandings()
+
+    Args:
+      pool: aiopg pool to draw from; defaults to the shared pool
+      read_only: whether the session only reads; if so, and no pool is
+        given, it uses the replica set with configureReplica(), if any and
+        if it has caught up with this task's writes
+    """
+
+    def __init__(self, pool=None, read_only=False):
+        self._pool = pool
+        self._read_only = read_only
+        self.db_conn = None
+        self.db_cursor = None
+        # Tournaments written to during this session, whose cached reads in
+        # tournament.py are dropped when the session ends.
+        self._changed = set()
+
+    async def __aenter__(self):
+        if self._pool is None:
+            replica_pool = _replica_pool
+            if self._read_only and replica_pool is not None:
+                self.db_conn = await _replicaConnection(replica_pool)
+
+            if self.db_conn is not None:
+                self._pool = replica_pool
+            else:
+                self._pool = await _getPool()
+
+        if self.db_conn is None:
+            self.db_conn = await self._pool.acquire()
+        try:
+            self.db_cursor = await self.db_conn.cursor()
+            # aiopg connections run in autocommit mode, so open the
+            # transaction explicitly.
+            await self.db_cursor.execute("BEGIN;")
+        except BaseException:
+            if self.db_cursor is not None:
+                self.db_cursor.close()
+            self.db_conn.close()
+            await self._pool.release(self.db_conn)
+            raise
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        db_conn, db_cursor = self.db_conn, self.db_cursor
+        self.db_conn, self.db_cursor = None, None
+
+        try:
+            await db_cursor.execute("COMMIT;" if exc_type is None else "ROLLBACK;")
+
+            if exc_type is None and self._changed and _replica_pool is not None \
+                    and _read_your_writes:
+                await db_cursor.execute("SELECT pg_current_wal_lsn()::text;")
+                _last_write.set((await db_cursor.fetchone())[0])
+        except BaseException:
+            # A connection that failed mid-transaction is not reused.
+            db_conn.close()
+            raise
+        finally:
+            db_cursor.close()
+            await self._pool.release(db_conn)
+
+            _invalidateCache(self._changed)
+            self._changed.clear()
+
+        return False
+
+    async def createTournament(self, name, tournament_id=None):
+        """Creates a tournament with partitions of its own and returns its ID.
+
+        Raises:
+          TournamentException: if a tournament with that ID was already created
+        """
+
+        query = "SELECT create_tournament(%s, %s);"
+
+        params = (name, tournament_id)
+
+        await self.db_cursor.execute("SAVEPOINT create_tournament;")
+        try:
+            await self.db_cursor.execute(query, params)
+        except psycopg2.Error as e:
+            if e.pgcode not in RULE_VIOLATIONS:
+                raise
+
+            await self.db_cursor.execute("ROLLBACK TO SAVEPOINT create_tournament;")
+            raise TournamentException(e.diag.message_primary)
+
+        tournament_id = (await self.db_cursor.fetchone())[0]
+        self._changed.add(tournament_id)
+        await self.db_cursor.execute("RELEASE SAVEPOINT create_tournament;")
+
+        return tournament_id
+
+    async def dropTournament(self, tournament_id, archive=False):
+        """Removes a tournament with all of its players and matches.
+
+        Raises:
+          TournamentException: if archive is set for a tournament that was
+            not made with createTournament()
+        """
+
+        self._changed.add(tournament_id)
+
+        query = "SAVEPOINT drop_tournament; " \
+                "SELECT drop_tournament(%s, %s); " \
+                "RELEASE SAVEPOINT drop_tournament;"
+
+        params = (tournament_id, archive)
+
+        try:
+            await self.db_cursor.execute(query, params)
+        except psycopg2.Error as e:
+            if e.pgcode not in RULE_VIOLATIONS:
+                raise
+
+            await self.db_cursor.execute("ROLLBACK TO SAVEPOINT drop_tournament;")
+            raise TournamentException(e.diag.message_primary)
+
+    async def exportTournament(self, tournament_id, path):
+        """Writes a tournament's players, matches, draws and byes to a snapshot file."""
+
+        players_query = "SELECT id, name, seed_rating, rating FROM players " \
+                        "WHERE tournament_id = %s " \
+                        "ORDER BY id;"
+
+        byes_query = "SELECT player_id FROM assigned_byes " \
+                     "WHERE tournament_id = %s;"
+
+        params = (tournament_id,)
+
+        await self.db_cursor.execute(players_query, params)
+        players = await self.db_cursor.fetchall()
+
+        results = await self._results(tournament_id)
+        draws = await self._draws(tournament_id)
+
+        await self.db_cursor.execute(byes_query, params)
+        byes = [row[0] for row in await self.db_cursor.fetchall()]
+
+        writeSnapshot(path, TournamentSnapshot(
+            tournament_id,
+            [row[0] for row in players], [row[1] for row in players],
+            [row[0] for row in results], [row[1] for row in results],
+            byes,
+            [row[2] for row in players], [row[3] for row in players],
+            [row[0] for row in draws], [row[1] for row in draws]))
+
+    async def importTournament(self, path, tournament_id=None):
+        """Loads a snapshot file into a tournament that has no players.
+
+        Asynchronous connections cannot run COPY, so each table is filled
+        with one INSERT over unnested arrays instead.
+
+        Returns:
+          The ID of the tournament the snapshot was loaded into.
+
+        Raises:
+          TournamentException: if the tournament already has players
+        """
+
+        snapshot = readSnapshot(path)
+        if tournament_id is None:
+            tournament_id = snapshot.tournament_id
+
+        if await self.countPlayers(tournament_id):
+            raise TournamentException(
+                "Tournament {} already has players.".format(tournament_id))
+
+        self._changed.add(tournament_id)
+
+        if not snapshot.player_ids:
+            return tournament_id
+
+        players_query = "INSERT INTO players (id, name, tournament_id, seed_rating, rating) " \
+                        "SELECT id, name, %s, seed, seed " \
+                        "FROM unnest(%s::int[], %s::text[], %s::float8[]) AS p(id, name, seed);"
+
+        players_params = (tournament_id, list(snapshot.player_ids), snapshot.names,
+                          list(snapshot.seed_ratings))
+
+        await self.db_cursor.execute(players_query, players_params)
+
+        sequence_query = "SELECT setval(pg_get_serial_sequence('players', 'id'), " \
+                         "GREATEST(nextval(pg_get_serial_sequence('players', 'id')), %s));"
+
+        sequence_params = (max(snapshot.player_ids),)
+
+        await self.db_cursor.execute(sequence_query, sequence_params)
+
+        matches_query = "INSERT INTO matches (winner_id, loser_id, tournament_id) " \
+                        "SELECT w, l, %s FROM unnest(%s::int[], %s::int[]) AS m(w, l);"
+
+        matches_params = (tournament_id, list(snapshot.winners), list(snapshot.losers))
+
+        await self.db_cursor.execute(matches_query, matches_params)
+
+        byes_query = "INSERT INTO assigned_byes (tournament_id, player_id) " \
+                     "SELECT %s, unnest(%s::int[]);"
+
+        byes_params = (tournament_id, list(snapshot.byes))
+
+        await self.db_cursor.execute(byes_query, byes_params)
+
+        draws_query = "INSERT INTO draws (player1_id, player2_id, tournament_id) " \
+                      "SELECT a, b, %s FROM unnest(%s::int[], %s::int[]) AS d(a, b);"
+
+        draws_params = (tournament_id, list(snapshot.draws1), list(snapshot.draws2))
+
+        await self.db_cursor.execute(draws_query, draws_params)
+
+        if snapshot.ratings is not None:
+            await self._setRatings(tournament_id, snapshot.player_ids, snapshot.ratings)
+
+        return tournament_id
+
+    async def deleteMatches(self, tournament_id=1):
+        """Removes all the match records for a tournament, with its rounds
+        and byes."""
+
+        self._changed.add(tournament_id)
+
+        query = "SELECT delete_matches(%s);"
+
+        params = (tournament_id,)
+
+        await self.db_cursor.execute(query, params)
+
+    async def deletePlayers(self, tournament_id=1):
+        """Removes all the player records for a tournament, and its rounds."""
+
+        self._changed.add(tournament_id)
+
+        query = "DELETE FROM rounds " \
+                "WHERE tournament_id = %s; " \
+                "DELETE FROM players " \
+                "WHERE tournament_id = %s;"
+
+        params = (tournament_id, tournament_id)
+
+        await self.db_cursor.execute(query, params)
+
+    async def countPlayers(self, tournament_id=1):
+        """Returns the number of players registered for a tournament."""
+
+        query = "SELECT COUNT(*) FROM players " \
+                "WHERE tournament_id = %s;"
+
+        params = (tournament_id,)
+
+        await self.db_cursor.execute(query, params)
+        player_count = (await self.db_cursor.fetchone())[0]
+
+        return int(player_count)
+
+    async def registerPlayer(self, name, tournament_id=1, rating=None):
+        """Adds a player to a tournament."""
+
+        self._changed.add(tournament_id)
+
+        if rating is None:
+            rating = INITIAL_RATING
+
+        query = "INSERT INTO players (name, tournament_id, seed_rating, rating)" \
+                "VALUES (%s, %s, %s, %s);"
+
+        params = (name, tournament_id, rating, rating)
+
+        await self.db_cursor.execute(query, params)
+
+    async def registerPlayers(self, names, tournament_id=1, ratings=None):
+        """Adds many players to a tournament at once.
+
+        Asynchronous connections cannot run COPY, so the rows go in as a
+        single multi-row INSERT instead.
+
+        Returns:
+          A list of the new players' IDs, in the same order as names.
+        """
+
+        names = list(names)
+        if not names:
+            return []
+
+        self._changed.add(tournament_id)
+
+        if ratings is None:
+            ratings = [INITIAL_RATING] * len(names)
+
+        id_query = "SELECT nextval(pg_get_serial_sequence('players', 'id')) " \
+                   "FROM generate_series(1, %s);"
+
+        id_params = (len(names),)
+
+        await self.db_cursor.execute(id_query, id_params)
+        player_ids = [row[0] for row in await self.db_cursor.fetchall()]
+
+        insert_query = "INSERT INTO players (id, name, tournament_id, seed_rating, rating) " \
+                       "VALUES " + ", ".join(["(%s, %s, %s, %s, %s)"] * len(names)) + ";"
+
+        insert_params = [value for player_id, name, rating in zip(player_ids, names, ratings)
+                         for value in (player_id, name, tournament_id, rating, rating)]
+
+        await self.db_cursor.execute(insert_query, insert_params)
+
+        return player_ids
+
+    async def playerStandings(self, tournament_id=1):
+        """Returns (id, name, wins, matches) rows for a tournament, sorted by
+        wins and then by tiebreaks."""
+
+        return list(await self.columnStandings(tournament_id))
+
+    async def columnStandings(self, tournament_id=1):
+        """Returns a tournament's standings, sorted as by playerStandings(),
+        as a StandingsColumns that holds the players' ratings too."""
+
+        standings = await self._standings(tournament_id)
+
+        return rankStandings(standings, await self._results(tournament_id))
+
+    async def playerTiebreaks(self, tournament_id=1):
+        """Returns a dict mapping each player ID to their (omw, buchholz,
+        median_buchholz, sonneborn_berger) tiebreaks."""
+
+        standings = await self._standings(tournament_id)
+        tiebreaks = computeTiebreaks(standings, await self._results(tournament_id))
+
+        return dict(zip(standings.ids, tiebreaks))
+
+    async def playerRatings(self, tournament_id=1):
+        """Returns a dict mapping each player ID to their current rating."""
+
+        query = "SELECT id, rating FROM players " \
+                "WHERE tournament_id = %s;"
+
+        params = (tournament_id,)
+
+        await self.db_cursor.execute(query, params)
+
+        return dict(await self.db_cursor.fetchall())
+
+    async def recomputeRatings(self, tournament_id=1):
+        """Recomputes every rating in a tournament from its whole history.
+
+        See tournament.TournamentSession.recomputeRatings.
+        """
+
+        self._changed.add(tournament_id)
+
+        query = "SELECT id, seed_rating FROM players " \
+                "WHERE tournament_id = %s;"
+
+        params = (tournament_id,)
+
+        await self.db_cursor.execute(query, params)
+        seeds = dict(await self.db_cursor.fetchall())
+
+        ratings = computeRatings(seeds, await self._results(tournament_id),
+                                 await self._draws(tournament_id))
+
+        if ratings:
+            await self._setRatings(tournament_id, list(ratings), list(ratings.values()))
+
+        return ratings
+
+    async def iterStandings(self, tournament_id=1, batch_size=1000):
+        """Yields (id, name, wins, matches) rows for a tournament, sorted by wins.
+
+        Rows are read through a server-side cursor, batch_size at a time. The
+        rows must be consumed before the session ends. Players level on wins
+        and matches come in player ID order rather than by tiebreaks.
+        """
+
+        cursor_name = "standings_{}".format(next(_cursor_ids))
+
+        declare_query = "DECLARE {} NO SCROLL CURSOR FOR " \
+                        "SELECT p.id, p.name, s.wins, s.matches " \
+                        "FROM standings s JOIN players p " \
+                        "ON p.tournament_id = s.tournament_id AND p.id = s.player_id " \
+                        "WHERE s.tournament_id = %s " \
+                        "ORDER BY s.wins DESC, s.matches, s.player_id;".format(cursor_name)
+
+        declare_params = (tournament_id,)
+
+        await self.db_cursor.execute(declare_query, declare_params)
+
+        fetch_query = "FETCH FORWARD %s FROM {};".format(cursor_name)
+
+        fetch_params = (batch_size,)
+
+        while True:
+            await self.db_cursor.execute(fetch_query, fetch_params)
+            rows = await self.db_cursor.fetchall()
+
+            for row in rows:
+                yield row
+
+            if len(rows) < batch_size:
+                break
+
+        await self.db_cursor.execute("CLOSE {};".format(cursor_name))
+
+    async def topStandings(self, tournament_id=1, limit=50, after=None):
+        """Returns one page of (id, name, wins, matches) rows, sorted by wins.
+
+        See tournament.TournamentSession.topStandings.
+        """
+
+        if after is None:
+            query = "SELECT p.id, p.name, s.wins, s.matches " \
+                    "FROM standings s JOIN players p " \
+                    "ON p.tournament_id = s.tournament_id AND p.id = s.player_id " \
+                    "WHERE s.tournament_id = %(tournament_id)s " \
+                    "ORDER BY s.wins DESC, s.matches, s.player_id " \
+                    "LIMIT %(limit)s;"
+        else:
+            query = "SELECT * FROM (" \
+                    "(SELECT p.id, p.name, s.wins, s.matches " \
+                    "FROM standings s JOIN players p " \
+                    "ON p.tournament_id = s.tournament_id AND p.id = s.player_id " \
+                    "WHERE s.tournament_id = %(tournament_id)s AND s.wins = %(wins)s " \
+                    "AND (s.matches, s.player_id) > (%(matches)s, %(player_id)s) " \
+                    "ORDER BY s.matches, s.player_id LIMIT %(limit)s) " \
+                    "UNION ALL " \
+                    "(SELECT p.id, p.name, s.wins, s.matches " \
+                    "FROM standings s JOIN players p " \
+                    "ON p.tournament_id = s.tournament_id AND p.id = s.player_id " \
+                    "WHERE s.tournament_id = %(tournament_id)s AND s.wins < %(wins)s " \
+                    "ORDER BY s.wins DESC, s.matches, s.player_id LIMIT %(limit)s)" \
+                    ") page " \
+                    "ORDER BY wins DESC, matches, id " \
+                    "LIMIT %(limit)s;"
+
+        params = _pageParams(tournament_id, limit, after)
+
+        await self.db_cursor.execute(query, params)
+
+        return await self.db_cursor.fetchall()
+
+    async def rebuildStandings(self, tournament_id=1):
+        """Recomputes a tournament's standings counters from its match records."""
+
+        self._changed.add(tournament_id)
+
+        query = "SELECT rebuild_standings(%s);"
+
+        params = (tournament_id,)
+
+        await self.db_cursor.execute(query, params)
+
+    async def reportMatch(self, winner, loser, tournament_id=1, draw=False):
+        """Records the outcome of a single match between two players.
+
+        Raises:
+          TournamentException: if the players are the same, either player is
+            not registered for the tournament, or the two have already met;
+            once the tournament has rounds, if the two are not paired in the
+            current round or their result is already in
+        """
+
+        self._changed.add(tournament_id)
+
+        # One round trip; see TournamentSession.reportMatch.
+        query = "SAVEPOINT report_match; " \
+                "SELECT {}(%s, %s, %s); " \
+                "RELEASE SAVEPOINT report_match;".format(
+                    "report_draw" if draw else "report_match")
+
+        params = (winner, loser, tournament_id)
+
+        try:
+            await self.db_cursor.execute(query, params)
+        except psycopg2.Error as e:
+            if e.pgcode not in RULE_VIOLATIONS:
+                raise
+
+            await self.db_cursor.execute("ROLLBACK TO SAVEPOINT report_match;")
+            raise TournamentException(e.diag.message_primary)
+
+    async def reportMatches(self, results, tournament_id=1):
+        """Records a whole round of results, validating them as a set.
+
+        Raises:
+          TournamentException: if any result breaks a rule; its errors
+            attribute lists each offending (winner, loser, draw) tuple with
+            the reason it was rejected
+        """
+
+        results = list(results)
+        decided = [(winner, loser) for winner, loser, draw in results if not draw]
+        drawn = [(winner, loser) for winner, loser, draw in results if draw]
+        if not results:
+            return
+
+        self._changed.add(tournament_id)
+
+        # See TournamentSession.reportMatches.
+        round_query = "SELECT max(round) FROM rounds " \
+                      "WHERE tournament_id = %s;"
+
+        round_params = (tournament_id,)
+
+        await self.db_cursor.execute(round_query, round_params)
+        current = (await self.db_cursor.fetchone())[0]
+
+        if current is not None:
+            paired_query = "SELECT LEAST(player1_id, player2_id), " \
+                           "GREATEST(player1_id, player2_id) " \
+                           "FROM pairings " \
+                           "WHERE tournament_id = %s AND round = %s AND NOT reported " \
+                           "ORDER BY board " \
+                           "FOR UPDATE;"
+
+            paired_params = (tournament_id, current)
+
+            await self.db_cursor.execute(paired_query, paired_params)
+            paired = set(await self.db_cursor.fetchall())
+
+            errors = _checkResults(decided, (), (), drawn, paired)
+        else:
+            errors = await self._checkRules(decided, drawn, tournament_id)
+
+        if errors:
+            raise TournamentException(
+                "{} of {} match results were rejected.".format(len(errors), len(results)),
+                errors)
+
+        if current is not None:
+            reported = [(min(pair), max(pair)) for pair in decided + drawn]
+
+            reported_query = "UPDATE pairings SET reported = TRUE " \
+                             "WHERE tournament_id = %s AND round = %s " \
+                             "AND (LEAST(player1_id, player2_id), " \
+                             "GREATEST(player1_id, player2_id)) IN " \
+                             "(SELECT * FROM unnest(%s::int[], %s::int[]));"
+
+            reported_params = (tournament_id, current,
+                               [pair[0] for pair in reported], [pair[1] for pair in reported])
+
+            await self.db_cursor.execute(reported_query, reported_params)
+
+        if decided:
+            insert_query = "INSERT INTO matches (winner_id, loser_id, tournament_id) VALUES " + \
+                           ", ".join(["(%s, %s, %s)"] * len(decided)) + ";"
+
+            insert_params = [value for winner, loser in decided
+                             for value in (winner, loser, tournament_id)]
+
+            await self.db_cursor.execute(insert_query, insert_params)
+
+        if drawn:
+            draw_query = "INSERT INTO draws (player1_id, player2_id, tournament_id) VALUES " + \
+                         ", ".join(["(%s, %s, %s)"] * len(drawn)) + ";"
+
+            draw_params = [value for player1, player2 in drawn
+                           for value in (player1, player2, tournament_id)]
+
+            await self.db_cursor.execute(draw_query, draw_params)
+
+    async def startRound(self, tournament_id=1):
+        """Pairs a tournament's next round and stores the pairings.
+
+        See tournament.TournamentSession.startRound.
+        """
+
+        self._changed.add(tournament_id)
+
+        lock_query = "SELECT pg_advisory_xact_lock(%s, %s);"
+
+        lock_params = (ROUND_LOCK_KEY, tournament_id)
+
+        await self.db_cursor.execute(lock_query, lock_params)
+
+        current, pairings = await self._roundPairings(tournament_id)
+        if pairings is not None:
+            return pairings
+
+        pairings, bye = await self._nextPairings(tournament_id, allow_rematches=False)
+        next_round = (current or 0) + 1
+
+        round_query = "INSERT INTO rounds (tournament_id, round) " \
+                      "VALUES (%s, %s);"
+
+        round_params = (tournament_id, next_round)
+
+        await self.db_cursor.execute(round_query, round_params)
+
+        if bye is not None:
+            bye_query = "INSERT INTO assigned_byes (tournament_id, player_id, round) " \
+                        "VALUES (%s, %s, %s);"
+
+            bye_params = (tournament_id, bye, next_round)
+
+            await self.db_cursor.execute(bye_query, bye_params)
+
+        if pairings:
+            pairings_query = "INSERT INTO pairings " \
+                             "(tournament_id, round, board, player1_id, player2_id) " \
+                             "VALUES " + ", ".join(["(%s, %s, %s, %s, %s)"] * len(pairings)) + ";"
+
+            pairings_params = [value for board, row in enumerate(pairings, 1)
+                               for value in (tournament_id, next_round, board, row[0], row[2])]
+
+            await self.db_cursor.execute(pairings_query, pairings_params)
+
+        return pairings
+
+    async def swissPairings(self, tournament_id=1):
+        """Returns (id1, name1, id2, name2) pairings for the next round, or
+        the current round's stored pairings while it has results to come."""
+
+        _, pairings = await self._roundPairings(tournament_id)
+        if pairings is not None:
+            return pairings
+
+        return (await self._nextPairings(tournament_id))[0]
+
+    async def byeHistory(self, tournament_id=1):
+        """Returns a dict mapping the ID of each player of a tournament who
+        has had a bye to the round it was given for, or None."""
+
+        query = "SELECT player_id, round FROM assigned_byes " \
+                "WHERE tournament_id = %s;"
+
+        params = (tournament_id,)
+
+        await self.db_cursor.execute(query, params)
+
+        return dict(await self.db_cursor.fetchall())
+
+    async def countPlayersMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to its number of players,
+        counted with a single query."""
+
+        tournament_ids = list(tournament_ids)
+
+        query = "SELECT tournament_id, COUNT(*) FROM players " \
+                "WHERE tournament_id = ANY(%s) " \
+                "GROUP BY tournament_id;"
+
+        params = (tournament_ids,)
+
+        await self.db_cursor.execute(query, params)
+        counts = dict((tournament_id, 0) for tournament_id in tournament_ids)
+        counts.update((tournament_id, int(count))
+                      for tournament_id, count in await self.db_cursor.fetchall())
+
+        return counts
+
+    async def playerStandingsMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to its standings."""
+
+        standings = await self._standingsMany(tournament_ids)
+        results = await self._resultsMany(tournament_ids)
+
+        return dict((tournament_id, list(rankStandings(columns, results[tournament_id])))
+                    for tournament_id, columns in standings.items())
+
+    async def swissPairingsMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to its next pairings."""
+
+        tournament_ids = list(tournament_ids)
+        pairings = await self._roundPairingsMany(tournament_ids)
+
+        unpaired = [tournament_id for tournament_id in tournament_ids
+                    if tournament_id not in pairings]
+        if unpaired:
+            standings = await self._standingsMany(unpaired)
+            results = await self._resultsMany(unpaired)
+            byes = await self._byeHistoryMany(unpaired)
+
+            pairings.update(
+                (tournament_id,
+                 pairRound(rankStandings(columns, results[tournament_id]),
+                           _opponentSets(results[tournament_id]), byes[tournament_id])[0])
+                for tournament_id, columns in standings.items())
+
+        return pairings
+
+    async def _standings(self, tournament_id=1):
+        """Returns a StandingsColumns of a tournament's players, with their
+        ratings, in standings_rank_idx order."""
+
+        query = "SELECT p.id, p.name, s.wins, s.matches, p.rating " \
+                "FROM standings s JOIN players p " \
+                "ON p.tournament_id = s.tournament_id AND p.id = s.player_id " \
+                "WHERE s.tournament_id = %s " \
+                "ORDER BY s.wins DESC, s.matches, s.player_id;"
+
+        params = (tournament_id,)
+
+        await self.db_cursor.execute(query, params)
+
+        columns = StandingsColumns(ratings=())
+        while True:
+            rows = await self.db_cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                return columns
+            columns.extend(rows)
+
+    async def _results(self, tournament_id=1):
+        """Returns a tournament's matches as a list of (winner ID, loser ID) pairs."""
+
+        query = "SELECT winner_id, loser_id FROM matches " \
+                "WHERE tournament_id = %s;"
+
+        params = (tournament_id,)
+
+        await self.db_cursor.execute(query, params)
+
+        return await self.db_cursor.fetchall()
+
+    async def _roundPairings(self, tournament_id=1):
+        """Returns a tournament's current round number and its open pairings;
+        see TournamentSession._roundPairings."""
+
+        query = "SELECT r.round, p.player1_id, a.name, p.player2_id, b.name, p.reported " \
+                "FROM (SELECT max(round) AS round FROM rounds WHERE tournament_id = %s) r " \
+                "LEFT JOIN pairings p " \
+                "ON p.tournament_id = %s AND p.round = r.round " \
+                "LEFT JOIN players a ON a.tournament_id = p.tournament_id AND a.id = p.player1_id " \
+                "LEFT JOIN players b ON b.tournament_id = p.tournament_id AND b.id = p.player2_id " \
+                "ORDER BY p.board;"
+
+        params = (tournament_id, tournament_id)
+
+        await self.db_cursor.execute(query, params)
+        rows = await self.db_cursor.fetchall()
+
+        return rows[0][0], _openPairings([row[1:] for row in rows if row[1] is not None])
+
+    async def _roundPairingsMany(self, tournament_ids):
+        """Returns a dict mapping the ID of each of the tournaments with a
+        round in progress to that round's pairings."""
+
+        query = "SELECT p.tournament_id, p.player1_id, a.name, p.player2_id, b.name, " \
+                "p.reported " \
+                "FROM pairings p " \
+                "JOIN players a ON a.tournament_id = p.tournament_id AND a.id = p.player1_id " \
+                "JOIN players b ON b.tournament_id = p.tournament_id AND b.id = p.player2_id " \
+                "WHERE (p.tournament_id, p.round) IN " \
+                "(SELECT tournament_id, max(round) FROM rounds " \
+                "WHERE tournament_id = ANY(%s) GROUP BY tournament_id) " \
+                "ORDER BY p.tournament_id, p.board;"
+
+        params = (list(tournament_ids),)
+
+        await self.db_cursor.execute(query, params)
+
+        groups = _groupRows(tournament_ids, await self.db_cursor.fetchall())
+        pairings = dict((tournament_id, _openPairings(rows))
+                        for tournament_id, rows in groups.items())
+
+        return dict((tournament_id, rows) for tournament_id, rows in pairings.items()
+                    if rows is not None)
+
+    async def _draws(self, tournament_id=1):
+        """Returns a tournament's draws as a list of (player ID, player ID) pairs."""
+
+        query = "SELECT player1_id, player2_id FROM draws " \
+                "WHERE tournament_id = %s;"
+
+        params = (tournament_id,)
+
+        await self.db_cursor.execute(query, params)
+
+        return await self.db_cursor.fetchall()
+
+    async def _setRatings(self, tournament_id, player_ids, ratings):
+        """Overwrites the ratings of the given players in a single UPDATE."""
+
+        query = "UPDATE players SET rating = r.rating " \
+                "FROM unnest(%s::int[], %s::float8[]) AS r(id, rating) " \
+                "WHERE players.tournament_id = %s AND players.id = r.id;"
+
+        params = (list(player_ids), [float(rating) for rating in ratings], tournament_id)
+
+        await self.db_cursor.execute(query, params)
+
+    async def _standingsMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to its StandingsColumns,
+        as returned by _standings()."""
+
+        tournament_ids = list(tournament_ids)
+
+        query = "SELECT s.tournament_id, p.id, p.name, s.wins, s.matches, p.rating " \
+                "FROM standings s JOIN players p " \
+                "ON p.tournament_id = s.tournament_id AND p.id = s.player_id " \
+                "WHERE s.tournament_id = ANY(%s) " \
+                "ORDER BY s.tournament_id, s.wins DESC, s.matches, s.player_id;"
+
+        params = (tournament_ids,)
+
+        await self.db_cursor.execute(query, params)
+
+        groups = dict((tournament_id, StandingsColumns(ratings=()))
+                      for tournament_id in tournament_ids)
+        while True:
+            rows = await self.db_cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                return groups
+            for row in rows:
+                groups[row[0]].append(row[1:])
+
+    async def _resultsMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to its (winner ID, loser
+        ID) pairs."""
+
+        tournament_ids = list(tournament_ids)
+
+        query = "SELECT tournament_id, winner_id, loser_id FROM matches " \
+                "WHERE tournament_id = ANY(%s);"
+
+        params = (tournament_ids,)
+
+        await self.db_cursor.execute(query, params)
+
+        return _groupRows(tournament_ids, await self.db_cursor.fetchall())
+
+    async def _byeHistoryMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to the set of IDs of
+        its players who have had a bye."""
+
+        tournament_ids = list(tournament_ids)
+
+        query = "SELECT tournament_id, player_id FROM assigned_byes " \
+                "WHERE tournament_id = ANY(%s);"
+
+        params = (tournament_ids,)
+
+        await self.db_cursor.execute(query, params)
+
+        return dict((tournament_id, set(row[0] for row in rows))
+                    for tournament_id, rows in
+                    _groupRows(tournament_ids, await self.db_cursor.fetchall()).items())
+
+    async def _nextPairings(self, tournament_id=1, allow_rematches=True):
+        """Pairs the next round from the standings, without storing it, and
+        chooses who would get its bye; see tournament.TournamentSession._nextPairings."""
+
+        results = await self._results(tournament_id)
+        standings = rankStandings(await self._standings(tournament_id), results)
+
+        opponents = _opponentSets(results)
+        pairings, bye = pairRound(standings, opponents, await self.byeHistory(tournament_id))
+        if not allow_rematches:
+            _checkRematches(pairings, opponents)
+
+        return pairings, bye
+
+    async def _checkRules(self, decided, drawn, tournament_id=1):
+        """Checks results for a tournament without rounds against the rules
+        of reportMatch(); see tournament._checkResults."""
+
+        # Locked in ID order, as in tournament.TournamentSession._checkRules.
+        player_query = "SELECT id FROM players " \
+                       "WHERE tournament_id = %s AND id = ANY(%s) " \
+                       "ORDER BY id " \
+                       "FOR UPDATE;"
+
+        player_params = (tournament_id,
+                         list(set(player_id for pair in decided + drawn for player_id in pair)))
+
+        await self.db_cursor.execute(player_query, player_params)
+        registered = set(row[0] for row in await self.db_cursor.fetchall())
+
+        played_query = "SELECT LEAST(winner_id, loser_id), GREATEST(winner_id, loser_id) " \
+                       "FROM matches " \
+                       "WHERE tournament_id = %s " \
+                       "AND (LEAST(winner_id, loser_id), GREATEST(winner_id, loser_id)) IN " \
+                       "(SELECT * FROM unnest(%s::int[], %s::int[]));"
+
+        played_params = (tournament_id,
+                         [min(pair) for pair in decided],
+                         [max(pair) for pair in decided])
+
+        await self.db_cursor.execute(played_query, played_params)
+        played = set(await self.db_cursor.fetchall())
+
+        return _checkResults(decided, registered, played, drawn)
+
+
+class AsyncStandingsReplica(object):
+    """A copy of some tournaments' standings, kept current from the change feed.
+
+    The asyncio counterpart of tournament_feed.StandingsReplica, holding an
+    aiopg connection of its own while open:
+
+        async with AsyncStandingsReplica([1, 2]) as replica:
+            while True:
+                for tournament_id in await replica.poll(timeout=5):
+                    show(replica.standings(tournament_id))
+
+    Args:
+      tournament_ids: iterable of IDs of the tournaments to follow
+      database_name: name of the database to connect to
+    """
+
+    def __init__(self, tournament_ids, database_name=DATABASE_NAME):
+        self._players = dict((int(tournament_id), {}) for tournament_id in tournament_ids)
+        self._database_name = database_name
+        self.db_conn = None
+        self.db_cursor = None
+
+    async def __aenter__(self):
+        self.db_conn = await aiopg.connect("dbname={}".format(self._database_name))
+        try:
+            self.db_cursor = await self.db_conn.cursor()
+
+            for tournament_id in self._players:
+                await self.db_cursor.execute(
+                    "LISTEN {};".format(FEED_CHANNEL.format(tournament_id)))
+
+            await self.db_cursor.execute(STANDINGS_QUERY, (list(self._players),))
+            _loadStandings(self._players, await self.db_cursor.fetchall())
+        except BaseException:
+            self.close()
+            raise
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """Stops listening and closes the replica's connection."""
+        if self.db_conn is not None and not self.db_conn.closed:
+            self.db_conn.close()
+
+    async def poll(self, timeout=0):
+        """Applies the changes that have arrived.
+
+        Args:
+          timeout: seconds to wait for a change if none has arrived yet, or
+            None to wait until one does
+
+        Returns:
+          The set of IDs of the tournaments whose standings changed.
+        """
+
+        queue = self.db_conn.notifies
+        notifies = []
+
+        if queue.empty() and timeout != 0:
+            try:
+                notifies.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                pass
+
+        while not queue.empty():
+            notifies.append(queue.get_nowait())
+
+        deltas = [parseDelta(notify.payload) for notify in notifies]
+        new_players = _newPlayers(self._players, deltas)
+
+        names = {}
+        if new_players:
+            await self.db_cursor.execute(NAMES_QUERY, _namesParams(new_players))
+            names = _namesByPlayer(await self.db_cursor.fetchall())
+
+        return _applyDeltas(self._players, deltas, names)
+
+    def standings(self, tournament_id):
+        """Returns a followed tournament's (id, name, wins, matches) rows,
+        ordered as by iterStandings().
+
+        Raises:
+          KeyError: if the replica does not follow the tournament
+        """
+
+        return _indexOrder(self._players[tournament_id].values())
+
+
+async def createTournament(name, tournament_id=None):
+    """Creates a tournament and returns its ID. See tournament.createTournament."""
+
+    async with AsyncTournamentSession() as session:
+        return await session.createTournament(name, tournament_id)
+
+
+async def dropTournament(tournament_id, archive=False):
+    """Removes a tournament with all of its data. See tournament.dropTournament."""
+
+    async with AsyncTournamentSession() as session:
+        await session.dropTournament(tournament_id, archive)
+
+
+async def exportTournament(tournament_id, path):
+    """Saves a tournament to a snapshot file. See tournament.exportTournament."""
+
+    async with AsyncTournamentSession(read_only=True) as session:
+        await session.exportTournament(tournament_id, path)
+
+
+async def importTournament(path, tournament_id=None):
+    """Restores a tournament from a snapshot file. See tournament.importTournament."""
+
+    async with AsyncTournamentSession() as session:
+        return await session.importTournament(path, tournament_id)
+
+
+async def deleteMatches(tournament_id=1):
+    """Remove all the match records for a tournament. See tournament.deleteMatches."""
+
+    async with AsyncTournamentSession() as session:
+        await session.deleteMatches(tournament_id)
+
+
+async def deletePlayers(tournament_id=1):
+    """Remove all the player records for a tournament. See tournament.deletePlayers."""
+
+    async with AsyncTournamentSession() as session:
+        await session.deletePlayers(tournament_id)
+
+
+async def countPlayers(tournament_id=1):
+    """Returns the number of players registered. See tournament.countPlayers."""
+
+    async with AsyncTournamentSession(read_only=True) as session:
+        return await session.countPlayers(tournament_id)
+
+
+def _retried(function):
+    """Reruns a module-level write after a deadlock or serialization failure.
+    See tournament._retried."""
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        for attempt in range(TRANSACTION_RETRIES):
+            try:
+                return await function(*args, **kwargs)
+            except psycopg2.extensions.TransactionRollbackError:
+                await asyncio.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+        return await function(*args, **kwargs)
+
+    return wrapper
+
+
+@_retried
+async def registerPlayer(name, tournament_id=1, rating=None):
+    """Adds a player to the tournament database. See tournament.registerPlayer."""
+
+    async with AsyncTournamentSession() as session:
+        await session.registerPlayer(name, tournament_id, rating)
+
+
+async def registerPlayers(names, tournament_id=1, ratings=None):
+    """Adds many players in one transaction. See tournament.registerPlayers."""
+
+    async with AsyncTournamentSession() as session:
+        return await session.registerPlayers(names, tournament_id, ratings)
+
+
+async def playerStandings(tournament_id=1):
+    """Returns players and their win records. See tournament.playerStandings."""
+
+    async with AsyncTournamentSession(read_only=True) as session:
+        return await session.playerStandings(tournament_id)
+
+
+async def columnStandings(tournament_id=1):
+    """Returns the standings held column by column. See tournament.columnStandings."""
+
+    async with AsyncTournamentSession(read_only=True) as session:
+        return await session.columnStandings(tournament_id)
+
+
+async def playerTiebreaks(tournament_id=1):
+    """Returns every player's tiebreaks. See tournament.playerTiebreaks."""
+
+    async with AsyncTournamentSession(read_only=True) as session:
+        return await session.playerTiebreaks(tournament_id)
+
+
+async def playerRatings(tournament_id=1):
+    """Returns every player's current rating. See tournament.playerRatings."""
+
+    async with AsyncTournamentSession(read_only=True) as session:
+        return await session.playerRatings(tournament_id)
+
+
+async def recomputeRatings(tournament_id=1):
+    """Recomputes ratings from the whole history. See tournament.recomputeRatings."""
+
+    async with AsyncTournamentSession() as session:
+        return await session.recomputeRatings(tournament_id)
+
+
+async def iterStandings(tournament_id=1, batch_size=1000):
+    """Yields players and their win records in batches. See tournament.iterStandings.
+
+    Use with ``async for``; a pooled connection is held until the last row
+    has been read or the generator is closed.
+    """
+
+    async with AsyncTournamentSession(read_only=True) as session:
+        async for row in session.iterStandings(tournament_id, batch_size):
+            yield row
+
+
+async def topStandings(tournament_id=1, limit=50, after=None):
+    """Returns one page of the standings. See tournament.topStandings."""
+
+    async with AsyncTournamentSession(read_only=True) as session:
+        return await session.topStandings(tournament_id, limit, after)
+
+
+async def rebuildStandings(tournament_id=1):
+    """Recomputes a tournament's standings. See tournament.rebuildStandings."""
+
+    async with AsyncTournamentSession() as session:
+        await session.rebuildStandings(tournament_id)
+
+
+@_retried
+async def reportMatch(winner, loser, tournament_id=1, draw=False):
+    """Records the outcome of a single match. See tournament.reportMatch."""
+
+    async with AsyncTournamentSession() as session:
+        await session.reportMatch(winner, loser, tournament_id, draw)
+
+
+async def reportMatches(results, tournament_id=1):
+    """Records a whole round of results at once. See tournament.reportMatches."""
+
+    async with AsyncTournamentSession() as session:
+        await session.reportMatches(results, tournament_id)
+
+
+async def swissPairings(tournament_id=1):
+    """Returns pairings for the next round. See tournament.swissPairings."""
+
+    async with AsyncTournamentSession(read_only=True) as session:
+        return await session.swissPairings(tournament_id)
+
+
+@_retried
+async def startRound(tournament_id=1):
+    """Starts a tournament's next round with stored pairings. See tournament.startRound."""
+
+    async with AsyncTournamentSession() as session:
+        return await session.startRound(tournament_id)
+
+
+async def byeHistory(tournament_id=1):
+    """Returns who has had a bye, and in which round. See tournament.byeHistory."""
+
+    async with AsyncTournamentSession(read_only=True) as session:
+        return await session.byeHistory(tournament_id)
+
+
+async def countPlayersMany(tournament_ids):
+    """Returns each tournament's number of players. See tournament.countPlayersMany."""
+
+    async with AsyncTournamentSession(read_only=True) as session:
+        return await session.countPlayersMany(tournament_ids)
+
+
+async def playerStandingsMany(tournament_ids):
+    """Returns many tournaments' standings. See tournament.playerStandingsMany."""
+
+    async with AsyncTournamentSession(read_only=True) as session:
+        return await session.playerStandingsMany(tournament_ids)
+
+
+async def swissPairingsMany(tournament_ids):
+    """Returns many tournaments' next pairings. See tournament.swissPairingsMany."""
+
+    async with AsyncTournamentSession(read_only=True) as session:
+        return await session.swissPairingsMany(tournament_ids)
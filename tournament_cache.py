@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# tournament_cache.py -- in-process cache of per-tournament read results
+#
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TournamentCache(object):
+    """Thread-safe LRU cache of read results, keyed by tournament ID.
+
+    Each tournament's entry holds one value per kind of read (standings,
+    pairings, ...). Entries are evicted least recently used first once more
+    than maxsize tournaments are cached, and individual values expire ttl
+    seconds after they were stored.
+
+    Writers call invalidate() after changing a tournament. Every invalidation
+    bumps the tournament's generation, and put() ignores values computed
+    under an older generation, so a read that raced with a write cannot put
+    stale results back into the cache.
+
+    Args:
+      maxsize: maximum number of tournaments held at once
+      ttl: seconds a value stays fresh, or None for no expiry
+      clock: function returning the current time in seconds
+    """
+
+    def __init__(self, maxsize=128, ttl=None, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def generation(self, tournament_id):
+        """Returns a token to pass to put() for a value about to be computed."""
+        with self._lock:
+            return self._generations.get(tournament_id, 0)
+
+    def get(self, tournament_id, kind):
+        """Looks up a cached value.
+
+        Returns:
+          A (found, value) tuple; value is None when found is False.
+        """
+        with self._lock:
+            entry = self._entries.get(tournament_id)
+            stored = entry.get(kind) if entry is not None else None
+
+            if stored is None or (self.ttl is not None and
+                                  self._clock() - stored[0] > self.ttl):
+                self.misses += 1
+                return False, None
+
+            self._entries[tournament_id] = self._entries.pop(tournament_id)
+            self.hits += 1
+            return True, stored[1]
+
+    def put(self, tournament_id, kind, value, generation):
+        """Stores a value unless the tournament changed since generation()."""
+        with self._lock:
+            if self._generations.get(tournament_id, 0) != generation:
+                return
+
+            entry = self._entries.pop(tournament_id, {})
+            entry[kind] = (self._clock(), value)
+            self._entries[tournament_id] = entry
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, tournament_id):
+        """Drops every cached value for a tournament."""
+        with self._lock:
+            self._generations[tournament_id] = \
+                self._generations.get(tournament_id, 0) + 1
+            self._entries.pop(tournament_id, None)
+
+    def clear(self):
+        """Drops every cached value and resets the counters."""
+        with self._lock:
+            for tournament_id in self._entries:
+                self._generations[tournament_id] = \
+                    self._generations.get(tournament_id, 0) + 1
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """Returns the cache's counters and current size as a dict."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+            }
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#
+# tournament_columns.py -- memory-compact standings held column by column
+#
+# playerStandings() returns a list of (id, name, wins, matches) tuples, so a
+# field of tens of thousands of players costs as many tuples, and four
+# times as many boxed values, for the garbage collector to track.
+# StandingsColumns holds the same rows as typed arrays instead (four bytes
+# per ID, win and match count, eight per rating) and a list of interned
+# names, filled from a database cursor a batch at a time. It still
+# iterates, indexes and compares like a list of rows, and rankStandings(),
+# computeTiebreaks(), pairPlayers() and pairRound() read its columns
+# directly, so swissPairings() never builds the rows at all:
+#
+#     from tournament import columnStandings
+#
+#     standings = columnStandings(1)
+#     leaders = standings[:8]
+#     for player_id, name, wins, matches in leaders:
+#         print name, wins
+#
+
+import array
+import itertools
+import sys
+
+# Rows fetched from a cursor at a time while filling the columns.
+FETCH_BATCH_SIZE = 1000
+
+# Names of the columns, in the order of the fields of a standings row.
+ROW_COLUMNS = ('ids', 'names', 'wins', 'matches')
+
+_zip = getattr(itertools, 'izip', zip)
+
+try:
+    _intern = sys.intern
+except AttributeError:  # Python 2
+    _intern = intern
+
+
+class StandingsColumns(object):
+    """A tournament's (id, name, wins, matches) standings rows, held column
+    by column.
+
+    Iterating yields the rows as tuples, one at a time; an index gives one
+    row and a slice gives a new StandingsColumns. Compares equal to any
+    sequence of the same rows.
+
+    Args:
+      ids: the players' IDs
+      names: the players' names, in the same order as ids
+      wins: the players' wins, byes included, in the same order
+      matches: the players' matches played, byes included, in the same order
+      ratings: the players' ratings, in the same order, or None if the
+        columns do not hold them
+    """
+
+    __slots__ = ('ids', 'names', 'wins', 'matches', 'ratings')
+
+    __hash__ = None
+
+    def __init__(self, ids=(), names=(), wins=(), matches=(), ratings=None):
+        self.ids = array.array('i', ids)
+        self.names = [_internName(name) for name in names]
+        self.wins = array.array('i', wins)
+        self.matches = array.array('i', matches)
+        self.ratings = array.array('d', ratings) if ratings is not None else None
+
+    @classmethod
+    def fromCursor(cls, cursor, ratings=False, batch_size=FETCH_BATCH_SIZE):
+        """Reads the rows of a query that has been executed on a cursor.
+
+        Args:
+          cursor: a cursor whose query returns (id, name, wins, matches)
+            rows, with a rating as a fifth column if ratings is set
+          ratings: whether the rows carry ratings
+          batch_size: rows fetched at a time
+
+        Returns:
+          A new StandingsColumns.
+        """
+
+        columns = cls(ratings=() if ratings else None)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return columns
+            columns.extend(rows)
+
+    def append(self, row):
+        """Appends an (id, name, wins, matches) row, with a fifth column for
+        the rating if the columns hold ratings."""
+
+        self.ids.append(row[0])
+        self.names.append(_internName(row[1]))
+        self.wins.append(row[2])
+        self.matches.append(row[3])
+        if self.ratings is not None:
+            self.ratings.append(row[4])
+
+    def extend(self, rows):
+        """Appends rows, as append() does."""
+        for row in rows:
+            self.append(row)
+
+    def take(self, positions):
+        """Returns a new StandingsColumns of the rows at the given positions,
+        in that order."""
+
+        positions = list(positions)
+        ids, names, wins, matches = self.ids, self.names, self.wins, self.matches
+
+        return _fromColumns(array.array('i', [ids[i] for i in positions]),
+                            [names[i] for i in positions],
+                            array.array('i', [wins[i] for i in positions]),
+                            array.array('i', [matches[i] for i in positions]),
+                            None if self.ratings is None else
+                            array.array('d', [self.ratings[i] for i in positions]))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return _zip(self.ids, self.names, self.wins, self.matches)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return _fromColumns(self.ids[index], self.names[index], self.wins[index],
+                                self.matches[index],
+                                None if self.ratings is None else self.ratings[index])
+
+        return self.ids[index], self.names[index], self.wins[index], self.matches[index]
+
+    def __add__(self, other):
+        ratings = None
+        if self.ratings is not None and other.ratings is not None:
+            ratings = self.ratings + other.ratings
+
+        return _fromColumns(self.ids + other.ids, self.names + other.names,
+                            self.wins + other.wins, self.matches + other.matches, ratings)
+
+    def __eq__(self, other):
+        if isinstance(other, StandingsColumns):
+            return (self.ids, self.names, self.wins, self.matches) == \
+                (other.ids, other.names, other.wins, other.matches)
+
+        try:
+            return len(self) == len(other) and \
+                all(row == tuple(other_row) for row, other_row in _zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return "StandingsColumns({!r})".format(list(self))
+
+
+def column(standings, name):
+    """Returns one column of standings by its name in ROW_COLUMNS: read
+    straight from a StandingsColumns, or gathered from a sequence of (id,
+    name, wins, matches) rows."""
+
+    if isinstance(standings, StandingsColumns):
+        return getattr(standings, name)
+
+    index = ROW_COLUMNS.index(name)
+
+    return [row[index] for row in standings]
+
+
+def _fromColumns(ids, names, wins, matches, ratings):
+    """Makes a StandingsColumns around columns that are already typed and
+    interned, without copying them."""
+
+    columns = StandingsColumns.__new__(StandingsColumns)
+    columns.ids, columns.names, columns.wins, columns.matches, columns.ratings = \
+        ids, names, wins, matches, ratings
+
+    return columns
+
+
+def _internName(name):
+    """Interns a name, so that reads of the same player share one string.
+    Only native strings can be interned; Python 2 unicode names are kept as
+    they are."""
+    return _intern(name) if type(name) is str else name
@@ -4,5 +4,7 @@
 #
 
 class TournamentException(Exception):
-    def __init__(self, message):
+    def __init__(self, message, errors=None):
         super(Exception, self).__init__(message)
+        # Individual rule violations, when one call checks several at once.
+        self.errors = errors if errors is not None else []
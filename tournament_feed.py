@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+#
+# tournament_feed.py -- local standings kept current by the database's change feed
+#
+# The database publishes each change to a player's standings with NOTIFY
+# (see migrations/007_standings_feed.sql). A StandingsReplica listens for
+# the changes to a few tournaments, reads their standings once, and then
+# applies each change as it arrives, so a scoreboard can read its standings
+# locally instead of polling playerStandings():
+#
+#     from tournament_feed import StandingsReplica
+#
+#     with StandingsReplica([1, 2]) as replica:
+#         while True:
+#             for tournament_id in replica.poll(timeout=5):
+#                 show(replica.standings(tournament_id))
+#
+
+import select
+
+import psycopg2.extensions
+
+from tournament import DATABASE_NAME, connect
+
+# Channel each tournament's changes are published on.
+FEED_CHANNEL = "standings_{}"
+
+# Reads the names of (tournament ID, player ID) pairs given as two arrays.
+NAMES_QUERY = "SELECT tournament_id, id, name FROM players " \
+              "WHERE (tournament_id, id) IN " \
+              "(SELECT * FROM unnest(%s::int[], %s::int[]));"
+
+# Reads the standings of the tournaments in an array.
+STANDINGS_QUERY = "SELECT s.tournament_id, p.id, p.name, s.wins, s.matches " \
+                  "FROM standings s JOIN players p " \
+                  "ON p.tournament_id = s.tournament_id AND p.id = s.player_id " \
+                  "WHERE s.tournament_id = ANY(%s);"
+
+
+def parseDelta(payload):
+    """Parses the payload of a standings notification.
+
+    Returns:
+      A tuple of (tournament_id, player_id, wins, matches), where wins and
+      matches are None if the player has been removed.
+    """
+
+    tournament_id, change = payload.split(",")
+    player_id, counts = change.split(":", 1)
+
+    if counts == "-":
+        return int(tournament_id), int(player_id), None, None
+
+    wins, matches = counts.split(":")
+
+    return int(tournament_id), int(player_id), int(wins), int(matches)
+
+
+class StandingsReplica(object):
+    """A copy of some tournaments' standings, kept current from the change feed.
+
+    The replica holds a connection of its own, outside the pool, for as long
+    as it is open. It listens before it reads the standings, so no change is
+    missed; since each change carries the player's whole row rather than a
+    difference, changes that arrive after the read and were already part of
+    it leave the replica as it was.
+
+    Changes are applied only when poll() is called. Rows are ordered as in
+    iterStandings(): by wins, then fewest matches, then lowest player ID,
+    without tiebreaks, which would need every result.
+
+    Args:
+      tournament_ids: iterable of IDs of the tournaments to follow
+      database_name: name of the database to connect to
+    """
+
+    def __init__(self, tournament_ids, database_name=DATABASE_NAME):
+        self._players = dict((int(tournament_id), {}) for tournament_id in tournament_ids)
+
+        self.db_conn, self.db_cursor = connect(database_name)
+        # Notifications are only delivered between transactions.
+        self.db_conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+        try:
+            for tournament_id in self._players:
+                self.db_cursor.execute("LISTEN {};".format(FEED_CHANNEL.format(tournament_id)))
+
+            self.db_cursor.execute(STANDINGS_QUERY, (list(self._players),))
+            _loadStandings(self._players, self.db_cursor.fetchall())
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """Stops listening and closes the replica's connection."""
+        if not self.db_conn.closed:
+            self.db_cursor.close()
+            self.db_conn.close()
+
+    def fileno(self):
+        """Returns the connection's socket, for waiting on it with select()."""
+        return self.db_conn.fileno()
+
+    def poll(self, timeout=0):
+        """Applies the changes that have arrived.
+
+        Args:
+          timeout: seconds to wait for a change if none has arrived yet, or
+            None to wait until one does
+
+        Returns:
+          The set of IDs of the tournaments whose standings changed.
+        """
+
+        self.db_conn.poll()
+        if not self.db_conn.notifies and timeout != 0:
+            select.select([self.db_conn], [], [], timeout)
+            self.db_conn.poll()
+
+        deltas = [parseDelta(notify.payload) for notify in self.db_conn.notifies]
+        del self.db_conn.notifies[:]
+
+        return self._apply(deltas)
+
+    def standings(self, tournament_id):
+        """Returns a followed tournament's (id, name, wins, matches) rows.
+
+        Raises:
+          KeyError: if the replica does not follow the tournament
+        """
+
+        return _indexOrder(self._players[tournament_id].values())
+
+    def _apply(self, deltas):
+        """Applies (tournament_id, player_id, wins, matches) changes in order,
+        reading the names of newly registered players with one query."""
+
+        new_players = _newPlayers(self._players, deltas)
+
+        names = {}
+        if new_players:
+            self.db_cursor.execute(NAMES_QUERY, _namesParams(new_players))
+            names = _namesByPlayer(self.db_cursor.fetchall())
+
+        return _applyDeltas(self._players, deltas, names)
+
+
+def _indexOrder(rows):
+    """Returns (id, name, wins, matches) rows sorted as standings_rank_idx
+    orders them."""
+    return sorted(rows, key=lambda row: (-row[2], row[3], row[0]))
+
+
+def _loadStandings(players, rows):
+    """Fills a replica's tournament ID -> {player ID: row} dict from the
+    rows of STANDINGS_QUERY."""
+    for tournament_id, player_id, name, wins, matches in rows:
+        players[tournament_id][player_id] = (player_id, name, wins, matches)
+
+
+def _newPlayers(players, deltas):
+    """Returns the (tournament ID, player ID) pairs in deltas that a
+    replica has no name for yet."""
+    return set((tournament_id, player_id)
+               for tournament_id, player_id, wins, _ in deltas
+               if wins is not None and player_id not in players[tournament_id])
+
+
+def _namesParams(new_players):
+    """Returns the parameters of NAMES_QUERY for a set of pairs."""
+    new_players = list(new_players)
+    return [pair[0] for pair in new_players], [pair[1] for pair in new_players]
+
+
+def _namesByPlayer(rows):
+    """Returns a (tournament ID, player ID) -> name dict from the rows of
+    NAMES_QUERY."""
+    return dict(((tournament_id, player_id), name)
+                for tournament_id, player_id, name in rows)
+
+
+def _applyDeltas(players, deltas, names):
+    """Applies parsed deltas, in order, to a replica's players.
+
+    Players new to the replica take their names from names; a player
+    without one has been removed again since, and is skipped.
+
+    Returns:
+      The set of IDs of the tournaments whose standings changed.
+    """
+
+    changed = set()
+    for tournament_id, player_id, wins, matches in deltas:
+        rows = players[tournament_id]
+        changed.add(tournament_id)
+
+        if wins is None:
+            rows.pop(player_id, None)
+        elif player_id in rows:
+            rows[player_id] = rows[player_id][:2] + (wins, matches)
+        elif (tournament_id, player_id) in names:
+            rows[player_id] = (player_id, names[tournament_id, player_id], wins, matches)
+
+    return changed
@@ -0,0 +1,682 @@
+#!/usr/bin/env python
+#
+# tournament_memory.py -- in-memory storage backend for the tournament API
+#
+# Keeps players, matches, draws and byes in Python dicts and sets instead of
+# PostgreSQL, following the same rules for standings order, byes and
+# rematches. Useful for tests and for what-if simulations that need to play
+# out many tournaments quickly:
+#
+#     from tournament import *
+#     from tournament_memory import MemoryBackend
+#
+#     setBackend(MemoryBackend())
+#
+
+import bisect
+import threading
+
+from tournament import NOT_PAIRED, _checkRematches, _checkResults, _invalidateCache
+from tournament_columns import StandingsColumns
+from tournament_exception import TournamentException
+from tournament_pairing import pairRound
+from tournament_ratings import INITIAL_RATING, computeRatings, updateRatings
+from tournament_snapshot import TournamentSnapshot, readSnapshot, writeSnapshot
+from tournament_tiebreaks import computeTiebreaks, rankStandings
+
+
+class MemoryBackend(object):
+    """Storage backend that keeps every tournament in this process's memory.
+
+    Sessions hold the backend's lock for their whole ``with`` block, so they
+    run one at a time, and undo everything they changed if the block raises.
+    Player IDs are drawn from one counter shared by all tournaments and, like
+    a database sequence, are not reused after a rollback.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tournaments = {}
+        self._next_player_id = 1
+        # Tournaments made with createTournament(): ID -> name, and the
+        # state of those dropped with archive set.
+        self._created = {}
+        self._archived = {}
+        self._next_tournament_id = 1
+
+    def session(self, read_only=False):
+        """Returns a new MemorySession on this backend; read_only is ignored,
+        as there is no replica to read from."""
+        return MemorySession(self)
+
+
+class _Tournament(object):
+    """Players, results, ratings and byes of one tournament, indexed by player ID."""
+
+    __slots__ = ('names', 'wins', 'matches', 'byes', 'results', 'pairs',
+                 'opponents', 'bye_rounds', 'seed_ratings', 'ratings', 'draws',
+                 'rounds', 'round_pairings', 'open_pairs')
+
+    def __init__(self):
+        self.names = {}       # player ID -> name
+        self.wins = {}        # player ID -> wins, including byes
+        self.matches = {}     # player ID -> matches, including byes
+        self.byes = {}        # player ID -> byes
+        self.results = []     # (winner, loser) in the order reported
+        self.pairs = set()    # (lowest ID, highest ID) of every match played
+        self.opponents = {}   # player ID -> set of IDs played
+        self.bye_rounds = {}  # player ID -> round of their bye, or None if restored
+        self.seed_ratings = {}  # player ID -> rating at registration
+        self.ratings = {}     # player ID -> current rating
+        self.draws = []       # (player, player) in the order reported
+        self.rounds = 0       # number of rounds started
+        self.round_pairings = []  # (id1, name1, id2, name2) of the current round
+        self.open_pairs = set()  # (lowest ID, highest ID) of its unreported pairings
+
+
+# Stand-in for tournaments nobody has registered for, so reads need no checks.
+_NO_TOURNAMENT = _Tournament()
+
+
+class MemorySession(object):
+    """A unit of work against a MemoryBackend.
+
+    Offers the same methods as tournament.TournamentSession. Each change is
+    recorded with a function that reverses it; if the ``with`` block raises,
+    the changes are reversed newest first.
+    """
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._undo = []
+        # Tournaments written to during this session, whose cached reads are
+        # dropped when the session ends.
+        self._changed = set()
+
+    def __enter__(self):
+        self._backend._lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is not None:
+                while self._undo:
+                    self._undo.pop()()
+        finally:
+            self._undo = []
+            self._backend._lock.release()
+
+            _invalidateCache(self._changed)
+            self._changed.clear()
+
+        return False
+
+    def _read(self, tournament_id):
+        """Returns a tournament's state, or an empty one if it has none."""
+        return self._backend._tournaments.get(tournament_id, _NO_TOURNAMENT)
+
+    def _write(self, tournament_id):
+        """Returns a tournament's state for changing, creating it if needed."""
+        self._changed.add(tournament_id)
+
+        tournaments = self._backend._tournaments
+        tournament = tournaments.get(tournament_id)
+        if tournament is None:
+            tournament = tournaments[tournament_id] = _Tournament()
+            self._undo.append(lambda: tournaments.pop(tournament_id, None))
+
+        return tournament
+
+    def createTournament(self, name, tournament_id=None):
+        """Creates a tournament and returns its ID, as with the database.
+
+        Raises:
+          TournamentException: if a tournament with that ID was already created
+        """
+
+        backend = self._backend
+        if tournament_id is None:
+            while True:
+                tournament_id = backend._next_tournament_id
+                backend._next_tournament_id += 1
+                if (tournament_id not in backend._created and
+                        tournament_id not in backend._tournaments):
+                    break
+        elif tournament_id in backend._created:
+            raise TournamentException(
+                "Tournament {} has already been created.".format(tournament_id))
+
+        backend._created[tournament_id] = name
+        self._undo.append(lambda: backend._created.pop(tournament_id, None))
+        self._changed.add(tournament_id)
+
+        return tournament_id
+
+    def dropTournament(self, tournament_id, archive=False):
+        """Removes a tournament with all of its players and matches.
+
+        Raises:
+          TournamentException: if archive is set for a tournament that was
+            not made with createTournament()
+        """
+
+        backend = self._backend
+        if tournament_id not in backend._created or tournament_id in backend._archived:
+            if archive:
+                raise TournamentException(
+                    "Only tournaments made with createTournament can be archived.")
+
+            self.deletePlayers(tournament_id)
+            return
+
+        saved = self._read(tournament_id)
+        self.deletePlayers(tournament_id)
+
+        if archive:
+            backend._archived[tournament_id] = saved
+            self._undo.append(lambda: backend._archived.pop(tournament_id, None))
+        else:
+            name = backend._created.pop(tournament_id)
+            self._undo.append(lambda: backend._created.__setitem__(tournament_id, name))
+
+    def exportTournament(self, tournament_id, path):
+        """Writes a tournament's players, matches, draws and byes to a snapshot file."""
+
+        t = self._read(tournament_id)
+        player_ids = sorted(t.names)
+
+        writeSnapshot(path, TournamentSnapshot(
+            tournament_id,
+            player_ids, [t.names[player_id] for player_id in player_ids],
+            [winner for winner, _ in t.results], [loser for _, loser in t.results],
+            [player_id for player_id in player_ids
+             for _ in range(t.byes[player_id])],
+            [t.seed_ratings[player_id] for player_id in player_ids],
+            [t.ratings[player_id] for player_id in player_ids],
+            [player1 for player1, _ in t.draws], [player2 for _, player2 in t.draws]))
+
+    def importTournament(self, path, tournament_id=None):
+        """Loads a snapshot file into a tournament that has no players.
+
+        Returns:
+          The ID of the tournament the snapshot was loaded into.
+
+        Raises:
+          TournamentException: if the tournament already has players
+        """
+
+        snapshot = readSnapshot(path)
+        if tournament_id is None:
+            tournament_id = snapshot.tournament_id
+
+        if self._read(tournament_id).names:
+            raise TournamentException(
+                "Tournament {} already has players.".format(tournament_id))
+
+        # Build the tournament aside and swap it in, so a single undo suffices.
+        t = _Tournament()
+        for player_id, name, seed in zip(snapshot.player_ids, snapshot.names,
+                                         snapshot.seed_ratings):
+            t.names[player_id] = name
+            t.wins[player_id] = t.matches[player_id] = t.byes[player_id] = 0
+            t.seed_ratings[player_id] = t.ratings[player_id] = seed
+
+        for player_id in snapshot.byes:
+            t.bye_rounds[player_id] = None
+            t.wins[player_id] += 1
+            t.matches[player_id] += 1
+            t.byes[player_id] += 1
+
+        for winner, loser in zip(snapshot.winners, snapshot.losers):
+            t.results.append((winner, loser))
+            t.pairs.add((min(winner, loser), max(winner, loser)))
+            t.opponents.setdefault(winner, set()).add(loser)
+            t.opponents.setdefault(loser, set()).add(winner)
+            t.wins[winner] += 1
+            t.matches[winner] += 1
+            t.matches[loser] += 1
+            t.ratings[winner], t.ratings[loser] = updateRatings(
+                t.ratings[winner], t.ratings[loser], 1.0)
+
+        for player1, player2 in zip(snapshot.draws1, snapshot.draws2):
+            t.draws.append((player1, player2))
+            t.ratings[player1], t.ratings[player2] = updateRatings(
+                t.ratings[player1], t.ratings[player2], 0.5)
+
+        # The snapshot's own ratings, if it has them, replace the replayed ones.
+        if snapshot.ratings is not None:
+            t.ratings.update(zip(snapshot.player_ids, snapshot.ratings))
+
+        backend = self._backend
+        tournaments = backend._tournaments
+        saved = tournaments.get(tournament_id)
+
+        self._changed.add(tournament_id)
+        tournaments[tournament_id] = t
+        # Like the database sequence, the counter is not wound back on undo.
+        if t.names:
+            backend._next_player_id = max(backend._next_player_id, max(t.names) + 1)
+
+        def undo():
+            if saved is None:
+                tournaments.pop(tournament_id, None)
+            else:
+                tournaments[tournament_id] = saved
+        self._undo.append(undo)
+
+        return tournament_id
+
+    def deleteMatches(self, tournament_id=1):
+        """Removes all the match and draw records for a tournament, with its
+        rounds and byes, and puts every rating back to its seed."""
+
+        if tournament_id not in self._backend._tournaments:
+            return
+
+        t = self._write(tournament_id)
+        saved = (t.wins, t.matches, t.byes, t.bye_rounds, t.results, t.pairs, t.opponents,
+                 t.ratings, t.draws, t.rounds, t.round_pairings, t.open_pairs)
+
+        # Everyone's record is empty again, and no rounds are left.
+        t.wins = dict((player_id, 0) for player_id in t.names)
+        t.matches, t.byes, t.bye_rounds = dict(t.wins), dict(t.wins), {}
+        t.results, t.pairs, t.opponents = [], set(), {}
+        t.ratings, t.draws = dict(t.seed_ratings), []
+        t.rounds, t.round_pairings, t.open_pairs = 0, [], set()
+
+        def undo():
+            (t.wins, t.matches, t.byes, t.bye_rounds, t.results, t.pairs, t.opponents,
+             t.ratings, t.draws, t.rounds, t.round_pairings, t.open_pairs) = saved
+        self._undo.append(undo)
+
+    def deletePlayers(self, tournament_id=1):
+        """Removes all the player records for a tournament."""
+
+        tournaments = self._backend._tournaments
+        if tournament_id not in tournaments:
+            return
+
+        # Matches and byes go with the players, as with ON DELETE CASCADE.
+        self._changed.add(tournament_id)
+        saved = tournaments.pop(tournament_id)
+        self._undo.append(lambda: tournaments.__setitem__(tournament_id, saved))
+
+    def countPlayers(self, tournament_id=1):
+        """Returns the number of players registered for a tournament."""
+
+        return len(self._read(tournament_id).names)
+
+    def registerPlayer(self, name, tournament_id=1, rating=None):
+        """Adds a player to a tournament."""
+
+        self._addPlayer(self._write(tournament_id), name, rating)
+
+    def registerPlayers(self, names, tournament_id=1, ratings=None):
+        """Adds many players to a tournament at once.
+
+        Returns:
+          A list of the new players' IDs, in the same order as names.
+        """
+
+        names = list(names)
+        if not names:
+            return []
+
+        if ratings is None:
+            ratings = [None] * len(names)
+
+        t = self._write(tournament_id)
+        player_ids = [self._addPlayer(t, name, rating)
+                      for name, rating in zip(names, ratings)]
+
+        return player_ids
+
+    def playerStandings(self, tournament_id=1):
+        """Returns (id, name, wins, matches) rows for a tournament, sorted by
+        wins and then by tiebreaks, as with the database."""
+
+        return list(self.columnStandings(tournament_id))
+
+    def columnStandings(self, tournament_id=1):
+        """Returns a tournament's standings, sorted as by playerStandings(),
+        as a StandingsColumns that holds the players' ratings too."""
+
+        t = self._read(tournament_id)
+
+        return rankStandings(self._columns(t), t.results)
+
+    def playerTiebreaks(self, tournament_id=1):
+        """Returns a dict mapping each player ID to their (omw, buchholz,
+        median_buchholz, sonneborn_berger) tiebreaks."""
+
+        t = self._read(tournament_id)
+        standings = self._rows(t)
+        tiebreaks = computeTiebreaks(standings, t.results)
+
+        return dict((row[0], values) for row, values in zip(standings, tiebreaks))
+
+    def playerRatings(self, tournament_id=1):
+        """Returns a dict mapping each player ID to their current rating."""
+
+        return dict(self._read(tournament_id).ratings)
+
+    def recomputeRatings(self, tournament_id=1):
+        """Recomputes every rating in a tournament from its whole history.
+
+        Returns:
+          A dict mapping each player ID to their new rating.
+        """
+
+        if tournament_id not in self._backend._tournaments:
+            return {}
+
+        t = self._write(tournament_id)
+        saved = t.ratings
+
+        t.ratings = computeRatings(t.seed_ratings, t.results, t.draws)
+
+        def undo():
+            t.ratings = saved
+        self._undo.append(undo)
+
+        return dict(t.ratings)
+
+    def iterStandings(self, tournament_id=1, batch_size=1000):
+        """Yields (id, name, wins, matches) rows for a tournament, sorted by wins.
+
+        Ties are ordered as in the database's index: fewest matches first,
+        then lowest player ID.
+        """
+
+        for row in self._indexOrder(self._read(tournament_id)):
+            yield row
+
+    def topStandings(self, tournament_id=1, limit=50, after=None):
+        """Returns one page of (id, name, wins, matches) rows, sorted by wins.
+
+        Args:
+          tournament_id: ID of tournament whose standings are being paged
+          limit: maximum number of rows to return
+          after: last row of the previous page, or None for the first page
+        """
+
+        standings = self._indexOrder(self._read(tournament_id))
+
+        start = 0
+        if after is not None:
+            keys = [(-wins, matches, player_id)
+                    for player_id, _, wins, matches in standings]
+            start = bisect.bisect_right(keys, (-after[2], after[3], after[0]))
+
+        return standings[start:start + limit]
+
+    def rebuildStandings(self, tournament_id=1):
+        """Recomputes a tournament's standings counters from its match records."""
+
+        if tournament_id not in self._backend._tournaments:
+            return
+
+        t = self._write(tournament_id)
+        saved = (t.wins, t.matches, t.byes)
+
+        t.byes = dict((player_id, 0) for player_id in t.names)
+        for player_id in t.bye_rounds:
+            t.byes[player_id] += 1
+        t.wins, t.matches = dict(t.byes), dict(t.byes)
+        for winner, loser in t.results:
+            t.wins[winner] += 1
+            t.matches[winner] += 1
+            t.matches[loser] += 1
+
+        def undo():
+            t.wins, t.matches, t.byes = saved
+        self._undo.append(undo)
+
+    def reportMatch(self, winner, loser, tournament_id=1, draw=False):
+        """Records the outcome of a single match between two players.
+
+        Raises:
+          TournamentException: if the players are the same, either player is
+            not registered for the tournament, or the two have already met;
+            once the tournament has rounds, if the two are not paired in the
+            current round or their result is already in
+        """
+
+        t = self._read(tournament_id)
+
+        if t.rounds:
+            pair = (min(winner, loser), max(winner, loser))
+            if pair not in t.open_pairs:
+                raise TournamentException(NOT_PAIRED)
+
+            t = self._write(tournament_id)
+            self._claimPairing(t, pair)
+            if draw:
+                self._addDraw(t, winner, loser)
+            else:
+                self._addResult(t, winner, loser)
+            return
+
+        if winner == loser:
+            raise TournamentException("A player cannot play against themselves.")
+
+        if winner not in t.names or loser not in t.names:
+            raise TournamentException("Both players must exist and be registered "
+                                      "for the correct tournament.")
+
+        if draw:
+            self._addDraw(self._write(tournament_id), winner, loser)
+            return
+
+        if (min(winner, loser), max(winner, loser)) in t.pairs:
+            raise TournamentException("Players can only have played each other once.")
+
+        self._addResult(self._write(tournament_id), winner, loser)
+
+    def reportMatches(self, results, tournament_id=1):
+        """Records a whole round of results, validating them as a set.
+
+        Raises:
+          TournamentException: if any result breaks a rule; its errors
+            attribute lists each offending (winner, loser, draw) tuple with
+            the reason it was rejected
+        """
+
+        results = list(results)
+        decided = [(winner, loser) for winner, loser, draw in results if not draw]
+        drawn = [(winner, loser) for winner, loser, draw in results if draw]
+        if not results:
+            return
+
+        t = self._read(tournament_id)
+        if t.rounds:
+            errors = _checkResults(decided, (), (), drawn, t.open_pairs)
+        else:
+            registered = set(player_id for pair in decided + drawn for player_id in pair
+                             if player_id in t.names)
+            played = set(pair for pair in ((min(pair), max(pair)) for pair in decided)
+                         if pair in t.pairs)
+
+            errors = _checkResults(decided, registered, played, drawn)
+
+        if errors:
+            raise TournamentException(
+                "{} of {} match results were rejected.".format(len(errors), len(results)),
+                errors)
+
+        t = self._write(tournament_id)
+        if t.rounds:
+            for pair in decided + drawn:
+                self._claimPairing(t, (min(pair), max(pair)))
+        for winner, loser in decided:
+            self._addResult(t, winner, loser)
+        for player1, player2 in drawn:
+            self._addDraw(t, player1, player2)
+
+    def startRound(self, tournament_id=1):
+        """Pairs a tournament's next round and stores the pairings, or
+        returns the current round's if it still has results to come."""
+
+        t = self._read(tournament_id)
+        if t.open_pairs:
+            return list(t.round_pairings)
+
+        pairings, bye = self._nextPairings(t, allow_rematches=False)
+
+        t = self._write(tournament_id)
+        saved = (t.rounds, t.round_pairings, t.open_pairs)
+
+        t.rounds += 1
+        t.round_pairings = pairings
+        t.open_pairs = set((min(row[0], row[2]), max(row[0], row[2])) for row in pairings)
+
+        def undo():
+            t.rounds, t.round_pairings, t.open_pairs = saved
+        self._undo.append(undo)
+
+        if bye is not None:
+            self._giveBye(t, bye, t.rounds)
+
+        return list(pairings)
+
+    def swissPairings(self, tournament_id=1):
+        """Returns (id1, name1, id2, name2) pairings for the next round, or
+        the current round's while it has results to come."""
+
+        t = self._read(tournament_id)
+        if t.open_pairs:
+            return list(t.round_pairings)
+
+        return self._nextPairings(t)[0]
+
+    def byeHistory(self, tournament_id=1):
+        """Returns a dict mapping the ID of each player of a tournament who
+        has had a bye to the round it was given for, or None."""
+
+        return dict(self._read(tournament_id).bye_rounds)
+
+    def countPlayersMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to its number of players."""
+
+        return dict((tournament_id, self.countPlayers(tournament_id))
+                    for tournament_id in tournament_ids)
+
+    def playerStandingsMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to its standings."""
+
+        return dict((tournament_id, self.playerStandings(tournament_id))
+                    for tournament_id in tournament_ids)
+
+    def swissPairingsMany(self, tournament_ids):
+        """Returns a dict mapping each tournament ID to its next pairings."""
+
+        return dict((tournament_id, self.swissPairings(tournament_id))
+                    for tournament_id in tournament_ids)
+
+    def _nextPairings(self, t, allow_rematches=True):
+        """Pairs a tournament's next round from its standings, and chooses
+        who would get its bye, as with the database."""
+
+        standings = rankStandings(self._columns(t), t.results)
+
+        pairings, bye = pairRound(standings, t.opponents, t.bye_rounds)
+        if not allow_rematches:
+            _checkRematches(pairings, t.opponents)
+
+        return pairings, bye
+
+    def _rows(self, t):
+        """Returns a tournament's (id, name, wins, matches) rows, unsorted."""
+        wins, matches = t.wins, t.matches
+
+        return [(player_id, name, wins[player_id], matches[player_id])
+                for player_id, name in t.names.items()]
+
+    def _columns(self, t):
+        """Returns a tournament's players as a StandingsColumns with their
+        ratings, unsorted."""
+        player_ids = list(t.names)
+
+        return StandingsColumns(player_ids, [t.names[player_id] for player_id in player_ids],
+                                [t.wins[player_id] for player_id in player_ids],
+                                [t.matches[player_id] for player_id in player_ids],
+                                [t.ratings[player_id] for player_id in player_ids])
+
+    def _indexOrder(self, t):
+        """Returns a tournament's rows sorted as standings_rank_idx orders them."""
+        return sorted(self._rows(t), key=lambda row: (-row[2], row[3], row[0]))
+
+    def _addPlayer(self, t, name, rating=None):
+        """Registers one player and returns their new ID."""
+
+        player_id = self._backend._next_player_id
+        self._backend._next_player_id += 1
+
+        t.names[player_id] = name
+        t.wins[player_id] = t.matches[player_id] = t.byes[player_id] = 0
+        t.seed_ratings[player_id] = t.ratings[player_id] = \
+            INITIAL_RATING if rating is None else float(rating)
+
+        def undo():
+            del t.names[player_id], t.wins[player_id], t.matches[player_id], \
+                t.byes[player_id], t.seed_ratings[player_id], t.ratings[player_id]
+        self._undo.append(undo)
+
+        return player_id
+
+    def _addResult(self, t, winner, loser):
+        """Records one validated result and updates both players' records."""
+
+        t.results.append((winner, loser))
+        t.pairs.add((min(winner, loser), max(winner, loser)))
+        t.opponents.setdefault(winner, set()).add(loser)
+        t.opponents.setdefault(loser, set()).add(winner)
+        t.wins[winner] += 1
+        t.matches[winner] += 1
+        t.matches[loser] += 1
+        saved = (t.ratings[winner], t.ratings[loser])
+        t.ratings[winner], t.ratings[loser] = updateRatings(saved[0], saved[1], 1.0)
+
+        def undo():
+            t.results.pop()
+            t.pairs.discard((min(winner, loser), max(winner, loser)))
+            t.opponents[winner].discard(loser)
+            t.opponents[loser].discard(winner)
+            t.wins[winner] -= 1
+            t.matches[winner] -= 1
+            t.matches[loser] -= 1
+            t.ratings[winner], t.ratings[loser] = saved
+        self._undo.append(undo)
+
+    def _claimPairing(self, t, pair):
+        """Marks an open pairing of the current round as reported."""
+
+        t.open_pairs.remove(pair)
+        self._undo.append(lambda: t.open_pairs.add(pair))
+
+    def _addDraw(self, t, player1, player2):
+        """Records one validated draw and updates both players' ratings."""
+
+        t.draws.append((player1, player2))
+        saved = (t.ratings[player1], t.ratings[player2])
+        t.ratings[player1], t.ratings[player2] = updateRatings(saved[0], saved[1], 0.5)
+
+        def undo():
+            t.draws.pop()
+            t.ratings[player1], t.ratings[player2] = saved
+        self._undo.append(undo)
+
+    def _giveBye(self, t, player_id, round_number):
+        """Gives a player the bye of a round, worth a win and a match."""
+
+        t.bye_rounds[player_id] = round_number
+        t.wins[player_id] += 1
+        t.matches[player_id] += 1
+        t.byes[player_id] += 1
+
+        def undo():
+            del t.bye_rounds[player_id]
+            t.wins[player_id] -= 1
+            t.matches[player_id] -= 1
+            t.byes[player_id] -= 1
+        self._undo.append(undo)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+#
+# tournament_metrics.py -- in-process timing of API calls and SQL statements
+#
+
+import bisect
+import logging
+import re
+import threading
+
+# Upper bounds, in seconds, of the latency histogram buckets: 50 microseconds
+# doubling up to about 6.5 seconds, plus an implicit +Inf bucket.
+LATENCY_BUCKETS = tuple(0.00005 * 2 ** k for k in range(18))
+
+# Statements are grouped by their text with literals replaced by "?". Up to
+# this many statement texts are remembered so they need not be normalized
+# again on every call.
+NORMALIZED_CACHE_SIZE = 1024
+
+logger = logging.getLogger("tournament")
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_REPEATED_ROWS = re.compile(r"(\([?, ]*\))(?:, ?\1)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class LatencyHistogram(object):
+    """Counts observations into fixed latency buckets.
+
+    Recording an observation is a bisect over LATENCY_BUCKETS, so the cost
+    and memory use stay constant however many calls are recorded. Percentiles
+    are estimated by interpolating within the bucket they fall in.
+
+    Not thread-safe; TournamentMetrics serializes access to its histograms.
+    """
+
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """Records one observation."""
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent):
+        """Estimates the given percentile, in seconds, or None if empty."""
+        if not self.count:
+            return None
+
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for k, in_bucket in enumerate(self.buckets):
+            if in_bucket and seen + in_bucket >= rank:
+                if k == len(LATENCY_BUCKETS):
+                    return self.max
+                lower = LATENCY_BUCKETS[k - 1] if k else 0.0
+                upper = min(LATENCY_BUCKETS[k], self.max)
+                return lower + (upper - lower) * (rank - seen) / in_bucket
+            seen += in_bucket
+
+        return self.max
+
+    def stats(self):
+        """Returns the count, total and estimated percentiles as a dict."""
+        return {
+            'count': self.count,
+            'total_seconds': self.total,
+            'p50_ms': _milliseconds(self.percentile(50)),
+            'p95_ms': _milliseconds(self.percentile(95)),
+            'p99_ms': _milliseconds(self.percentile(99)),
+            'max_ms': _milliseconds(self.max if self.count else None),
+        }
+
+
+class _Timing(object):
+    """Latency histogram of one function or statement, with error and row counts."""
+
+    __slots__ = ('latency', 'errors', 'rows')
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = 0
+        self.rows = 0
+
+
+class TournamentMetrics(object):
+    """Thread-safe collector of call, statement and connection timings.
+
+    Public API functions are recorded by name. SQL statements are recorded
+    by their normalized text, so calls that differ only in their parameters
+    (or in the number of rows of a multi-row VALUES list) are counted
+    together. Statements slower than slow_query_threshold are also logged
+    as warnings on the "tournament" logger.
+
+    Args:
+      slow_query_threshold: seconds above which a statement is logged, or
+        None to log nothing
+    """
+
+    def __init__(self, slow_query_threshold=None):
+        self.slow_query_threshold = slow_query_threshold
+        self._lock = threading.Lock()
+        self._functions = {}
+        self._statements = {}
+        self._connections = LatencyHistogram()
+        self._normalized = {}
+        self.slow_queries = 0
+
+    def observeCall(self, name, seconds, failed=False):
+        """Records one call of a public API function."""
+        with self._lock:
+            timing = self._functions.get(name)
+            if timing is None:
+                timing = self._functions[name] = _Timing()
+            timing.latency.observe(seconds)
+            if failed:
+                timing.errors += 1
+
+    def observeStatement(self, query, seconds, rows=0, failed=False):
+        """Records one executed SQL statement.
+
+        Args:
+          query: the statement as passed to the cursor, str or bytes
+          seconds: time the statement took to run
+          rows: rows returned or affected, if known
+          failed: True if the statement raised an error
+        """
+        statement = self._normalize(query)
+
+        with self._lock:
+            timing = self._statements.get(statement)
+            if timing is None:
+                timing = self._statements[statement] = _Timing()
+            timing.latency.observe(seconds)
+            if rows > 0:
+                timing.rows += rows
+            if failed:
+                timing.errors += 1
+
+            slow = (self.slow_query_threshold is not None and
+                    seconds >= self.slow_query_threshold)
+            if slow:
+                self.slow_queries += 1
+
+        if slow:
+            logger.warning("Slow query (%.1f ms): %s", seconds * 1000, statement)
+
+    def observeConnect(self, seconds):
+        """Records the time taken to open one new database connection."""
+        with self._lock:
+            self._connections.observe(seconds)
+
+    def stats(self):
+        """Returns every recorded timing as a dict.
+
+        Returns:
+          A dict with 'functions' and 'statements' (each mapping a name or
+          statement to its count, errors, total seconds and p50/p95/p99
+          latency in milliseconds, plus rows for statements), 'connections'
+          (the same for connection setup) and 'slow_queries' (number of
+          statements slower than the threshold).
+        """
+        with self._lock:
+            return {
+                'functions': _timingStats(self._functions, rows=False),
+                'statements': _timingStats(self._statements, rows=True),
+                'connections': self._connections.stats(),
+                'slow_queries': self.slow_queries,
+            }
+
+    def prometheus(self):
+        """Returns every recorded timing in the Prometheus text exposition format."""
+        lines = []
+
+        with self._lock:
+            _histogramLines(lines, "tournament_call_duration_seconds",
+                            "Latency of public tournament API calls.",
+                            "function", self._functions)
+            _counterLines(lines, "tournament_call_errors_total",
+                          "Public tournament API calls that raised.",
+                          "function", self._functions, "errors")
+            _histogramLines(lines, "tournament_statement_duration_seconds",
+                            "Latency of SQL statements.",
+                            "statement", self._statements)
+            _counterLines(lines, "tournament_statement_errors_total",
+                          "SQL statements that raised.",
+                          "statement", self._statements, "errors")
+            _counterLines(lines, "tournament_statement_rows_total",
+                          "Rows returned or affected by SQL statements.",
+                          "statement", self._statements, "rows")
+            _histogramLines(lines, "tournament_connection_setup_seconds",
+                            "Time taken to open a database connection.",
+                            None, {"": self._connections})
+
+            lines.append("# HELP tournament_slow_queries_total "
+                         "SQL statements slower than the slow query threshold.")
+            lines.append("# TYPE tournament_slow_queries_total counter")
+            lines.append("tournament_slow_queries_total {}".format(self.slow_queries))
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Discards everything recorded so far."""
+        with self._lock:
+            self._functions.clear()
+            self._statements.clear()
+            self._connections = LatencyHistogram()
+            self.slow_queries = 0
+
+    def _normalize(self, query):
+        """Returns a statement's text with literals replaced by "?"."""
+        statement = self._normalized.get(query)
+        if statement is not None:
+            return statement
+
+        text = query
+        if not isinstance(text, str):
+            text = text.decode("utf-8", "replace")
+
+        statement = _LITERAL.sub("?", _WHITESPACE.sub(" ", text).strip())
+        statement = _REPEATED_ROWS.sub(r"\1, ...", statement)
+
+        # Only templates with placeholders (or without any literals) repeat;
+        # texts with values rendered into them, as sent by execute_values(),
+        # would fill the cache with entries that are never hit again.
+        if (("%s" in text or "%(" in text or "?" not in statement) and
+                len(self._normalized) < NORMALIZED_CACHE_SIZE):
+            self._normalized[query] = statement
+
+        return statement
+
+
+def _milliseconds(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def _timingStats(timings, rows):
+    """Converts a dict of _Timing objects to a dict of plain dicts."""
+    stats = {}
+    for name, timing in timings.items():
+        stats[name] = timing.latency.stats()
+        stats[name]['errors'] = timing.errors
+        if rows:
+            stats[name]['rows'] = timing.rows
+
+    return stats
+
+
+def _labels(label, value, extra=""):
+    """Formats a Prometheus label set."""
+    pairs = []
+    if label is not None:
+        escaped = value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append('{}="{}"'.format(label, escaped))
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _histogramLines(lines, metric, description, label, timings):
+    """Appends a Prometheus histogram for each timing to lines."""
+    lines.append("# HELP {} {}".format(metric, description))
+    lines.append("# TYPE {} histogram".format(metric))
+
+    for name in sorted(timings):
+        timing = timings[name]
+        histogram = getattr(timing, 'latency', timing)
+
+        cumulative = 0
+        for bound, in_bucket in zip(LATENCY_BUCKETS + ("+Inf",), histogram.buckets):
+            cumulative += in_bucket
+            le = bound if bound == "+Inf" else repr(bound)
+            lines.append("{}_bucket{} {}".format(
+                metric, _labels(label, name, 'le="{}"'.format(le)), cumulative))
+        lines.append("{}_sum{} {!r}".format(metric, _labels(label, name), histogram.total))
+        lines.append("{}_count{} {}".format(metric, _labels(label, name), histogram.count))
+
+
+def _counterLines(lines, metric, description, label, timings, attribute):
+    """Appends a Prometheus counter taken from each timing's attribute to lines."""
+    lines.append("# HELP {} {}".format(metric, description))
+    lines.append("# TYPE {} counter".format(metric))
+
+    for name in sorted(timings):
+        lines.append("{}{} {}".format(metric, _labels(label, name),
+                                      getattr(timings[name], attribute)))
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+#
+# tournament_pairing.py -- in-memory Swiss pairing engine
+#
+
+from tournament_columns import column
+
+# Upper bound on the number of times the search may undo a pairing before
+# giving up on a rematch-free round. Fields where every arrangement needs a
+# rematch (e.g. late rounds of a tiny event) would otherwise be searched
+# exhaustively.
+MAX_BACKTRACKS = 100000
+
+
+def pairPlayers(standings, opponents, max_backtracks=MAX_BACKTRACKS):
+    """Pairs players for the next round of a Swiss tournament.
+
+    Players are taken in standings order. The highest-ranked unpaired player
+    is paired with the next player below them whom they have not yet played,
+    so players meet opponents in their own score group first and an odd
+    player out floats down to the top of the next group. When that greedy
+    choice paints the bottom of the standings into a corner, the search
+    backtracks to the most recent pairing that has an untried alternative.
+
+    If no rematch-free pairing is found within max_backtracks steps, the
+    round is paired greedily, allowing a rematch only where a player has
+    already played everyone below them.
+
+    When the number of players is odd, one player (normally the player in
+    last place) is left unpaired.
+
+    Args:
+      standings: sequence of (id, name, wins, matches) rows in rank order,
+        or a StandingsColumns
+      opponents: dict mapping a player's id to the set of ids they have played
+      max_backtracks: search budget before rematches are allowed
+
+    Returns:
+      A list of tuples, each of which contains (id1, name1, id2, name2)
+    """
+
+    ids = column(standings, 'ids')
+    pairs = _search(ids, opponents, max_backtracks)
+    if pairs is None:
+        pairs = _greedy(ids, opponents)
+
+    names = column(standings, 'names')
+
+    return [(ids[i], names[i], ids[j], names[j]) for i, j in pairs]
+
+
+def pairRound(standings, opponents, had_bye=(), max_backtracks=MAX_BACKTRACKS):
+    """Pairs a round of a Swiss tournament and chooses who gets its bye.
+
+    When the number of players is odd, the lowest-ranked player who has not
+    had a bye yet gets this round's bye and everyone else is paired with
+    pairPlayers(). If every player has already had one, nobody gets a bye
+    and the player in last place sits the round out.
+
+    Args:
+      standings: sequence of (id, name, wins, matches) rows in rank order,
+        or a StandingsColumns
+      opponents: dict mapping a player's id to the set of ids they have played
+      had_bye: collection of the ids of players who have had a bye
+      max_backtracks: search budget before rematches are allowed
+
+    Returns:
+      A pair of the list of (id1, name1, id2, name2) pairings and the id of
+      the player given the bye, or None if nobody is.
+    """
+
+    if len(standings) % 2 == 0:
+        return pairPlayers(standings, opponents, max_backtracks), None
+
+    ids = column(standings, 'ids')
+    for k in range(len(ids) - 1, -1, -1):
+        if ids[k] not in had_bye:
+            rest = standings[:k] + standings[k + 1:]
+            return pairPlayers(rest, opponents, max_backtracks), ids[k]
+
+    return pairPlayers(standings, opponents, max_backtracks), None
+
+
+def _search(ids, opponents, max_backtracks):
+    """Backtracking search for a pairing with no rematches.
+
+    Unpaired players are kept in a doubly linked list over their positions
+    in the standings, so taking a player out and putting them back (in
+    reverse order) are both constant time.
+
+    Args:
+      ids: the players' IDs in rank order
+
+    Returns:
+      A list of (i, j) index pairs into ids, or None if the budget ran out
+      or no rematch-free pairing exists.
+    """
+
+    count = len(ids)
+    head = count  # Sentinel position shared by both ends of the list.
+    nxt = list(range(1, count + 1)) + [0]
+    prv = [count] + list(range(count))
+
+    def remove(k):
+        nxt[prv[k]] = nxt[k]
+        prv[nxt[k]] = prv[k]
+
+    def restore(k):
+        nxt[prv[k]] = k
+        prv[nxt[k]] = k
+
+    def candidate(i, j):
+        """First position from j onward that the player at i has not played."""
+        played = opponents.get(ids[i], ())
+        while j != head and ids[j] in played:
+            j = nxt[j]
+        return j
+
+    stack = []
+    backtracks = 0
+
+    while True:
+        i = nxt[head]
+        if i == head or nxt[i] == head:
+            return stack
+
+        remove(i)
+        j = candidate(i, nxt[head])
+        if j != head:
+            remove(j)
+            stack.append((i, j))
+            continue
+
+        # Nobody left can play i: undo pairings until one can be changed.
+        restore(i)
+        while True:
+            if not stack or backtracks >= max_backtracks:
+                return None
+            backtracks += 1
+
+            i, j = stack.pop()
+            restore(j)
+            j = candidate(i, nxt[j])
+            if j != head:
+                remove(j)
+                stack.append((i, j))
+                break
+            restore(i)
+
+
+def _greedy(ids, opponents):
+    """Pairs players in rank order, given their IDs, preferring opponents
+    not yet played."""
+
+    unpaired = list(range(len(ids)))
+    pairs = []
+
+    while len(unpaired) > 1:
+        i = unpaired.pop(0)
+        played = opponents.get(ids[i], ())
+
+        for k, j in enumerate(unpaired):
+            if ids[j] not in played:
+                break
+        else:
+            k = 0
+
+        pairs.append((i, unpaired.pop(k)))
+
+    return pairs
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+# tournament_ratings.py -- Elo ratings for seeding and pairing
+#
+# Each recorded game moves both players' ratings by
+#
+#   K_FACTOR * (score - expected)
+#
+# in opposite directions, where score is 1 for a win and 0.5 for a draw and
+# expected is the Elo expected score given the two ratings beforehand. The
+# database applies this update in triggers (migrations/005_player_ratings.sql)
+# and the in-memory backend with updateRatings(); the constants below must
+# match the ones in the migration.
+#
+
+import operator
+
+INITIAL_RATING = 1500.0
+
+K_FACTOR = 32.0
+
+# computeRatings() stops once no rating moves by more than this in a pass,
+# or after MAX_PASSES passes.
+RATING_TOLERANCE = 0.01
+MAX_PASSES = 100
+
+
+def expectedScore(rating, opponent_rating):
+    """Returns the Elo expected score of a player against an opponent."""
+    return 1.0 / (1.0 + 10.0 ** ((opponent_rating - rating) / 400.0))
+
+
+def updateRatings(rating_a, rating_b, score_a):
+    """Applies one game's Elo update.
+
+    Args:
+      rating_a: player a's rating before the game
+      rating_b: player b's rating before the game
+      score_a: player a's result: 1 for a win, 0.5 for a draw, 0 for a loss
+
+    Returns:
+      A tuple of the two players' (new rating a, new rating b).
+    """
+    change = K_FACTOR * (score_a - expectedScore(rating_a, rating_b))
+
+    return rating_a + change, rating_b - change
+
+
+def computeRatings(seeds, results, draws):
+    """Computes every player's rating from a tournament's whole history at once.
+
+    Ratings reported game by game depend on the order the games came in,
+    which is not recorded. Instead, every game is rated simultaneously: each
+    player's rating is their seed plus K_FACTOR times the sum, over their
+    games, of score minus the expected score against the opponent's rating.
+    Since the expected scores depend on the ratings being computed, the
+    ratings are found by repeated passes from the seeds, each moving half
+    way to its target. Each pass goes over flat per-game lists with
+    map(), so the cost is a few list operations per game and pass.
+
+    The result is close to, but generally not the same as, the ratings
+    updated game by game.
+
+    Args:
+      seeds: dict mapping each player's id to their seed rating
+      results: iterable of (winner id, loser id) pairs
+      draws: iterable of (player id, player id) pairs
+
+    Returns:
+      A dict mapping each player's id to their rating.
+    """
+
+    ids = list(seeds)
+    position = dict((player_id, i) for i, player_id in enumerate(ids))
+    seed = [float(seeds[player_id]) for player_id in ids]
+
+    # Games as parallel columns of positions in ids and player a's score;
+    # games of players missing from seeds are ignored.
+    first, second, score = [], [], []
+    for games, result in ((results, 1.0), (draws, 0.5)):
+        for a, b in games:
+            if a in position and b in position:
+                first.append(position[a])
+                second.append(position[b])
+                score.append(result)
+
+    ratings = list(seed)
+    for _ in range(MAX_PASSES):
+        expected = list(map(expectedScore,
+                            map(ratings.__getitem__, first),
+                            map(ratings.__getitem__, second)))
+        surplus = list(map(operator.sub, score, expected))
+
+        target = list(seed)
+        for i, j, change in zip(first, second, surplus):
+            target[i] += K_FACTOR * change
+            target[j] -= K_FACTOR * change
+
+        moved = 0.0
+        for i in range(len(ratings)):
+            step = (target[i] - ratings[i]) / 2
+            ratings[i] += step
+            moved = max(moved, abs(step))
+
+        if moved <= RATING_TOLERANCE:
+            break
+
+    return dict(zip(ids, ratings))
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+#
+# tournament_simulation.py -- Monte Carlo forecasts of a tournament's remaining rounds
+#
+# Reads a tournament's current state once and plays its remaining rounds
+# out many times in memory, pairing each round with pairRound() on
+# standings ranked by rankStandings(), as startRound() does, and deciding
+# each game at random from the players' Elo expected scores. The trials are
+# spread over a pool of worker processes, each of which is sent the state
+# once and then only a seed and a number of trials per batch, so the run
+# scales with the number of cores.
+#
+#     from tournament_simulation import simulateTournament
+#
+#     forecast = simulateTournament(1, rounds=3, trials=10000)
+#     for player_id in forecast.player_ids:
+#         print forecast.topProbability(player_id, 8)
+#
+# The simulation follows the rules as the API applies them: each round's bye
+# goes to the lowest-ranked player who has not had one, a player left
+# unpaired once everyone has had a bye scores nothing, and draws count for
+# the ratings but not the standings.
+#
+
+import array
+import multiprocessing
+import os
+import random
+import tempfile
+
+from tournament import getBackend
+from tournament_pairing import pairRound
+from tournament_ratings import expectedScore, updateRatings
+from tournament_snapshot import readSnapshot
+from tournament_tiebreaks import rankStandings
+
+# Trials played per task sent to a worker. Fixed, rather than derived from
+# the number of processes, so that a seed gives the same forecast on any
+# number of cores.
+TRIALS_PER_TASK = 50
+
+# The tournament state held by each worker process; see _initWorker().
+_state = None
+
+
+class TournamentState(object):
+    """What a simulation needs of a tournament: its players' records and
+    ratings, its results and byes, and the pairings of its current round
+    still waiting for a result.
+
+    Args:
+      player_ids: the players' IDs
+      names: the players' names, in the same order as player_ids
+      wins: the players' wins, byes included, in the same order
+      matches: the players' matches played, byes included, in the same order
+      ratings: the players' current ratings, in the same order
+      results: (winner id, loser id) pairs of the matches played
+      pending: (id1, id2) pairings of the current round without a result,
+        or None to pair the first simulated round afresh
+      had_bye: IDs of the players who have had a bye
+      pending_bye: ID of the player the first simulated round's bye goes
+        to when it is played with the pending pairings, or None
+    """
+
+    __slots__ = ('player_ids', 'names', 'wins', 'matches', 'ratings', 'results', 'pending',
+                 'had_bye', 'pending_bye')
+
+    def __init__(self, player_ids, names, wins, matches, ratings, results, pending=None,
+                 had_bye=(), pending_bye=None):
+        self.player_ids = list(player_ids)
+        self.names = list(names)
+        self.wins = list(wins)
+        self.matches = list(matches)
+        self.ratings = list(ratings)
+        self.results = list(results)
+        self.pending = list(pending) if pending is not None else None
+        self.had_bye = list(had_bye)
+        self.pending_bye = pending_bye
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class SimulationResult(object):
+    """How often each player finished in each position over a simulation's trials.
+
+    Attributes:
+      player_ids: the players' IDs
+      names: the players' names, in the same order as player_ids
+      rounds: the number of rounds played out in each trial
+      trials: the number of trials
+      counts: dict mapping each player's ID to an array whose item i is the
+        number of trials in which they finished in position i + 1
+      clear_winners: the number of trials in which one player finished with
+        more wins than everyone else
+    """
+
+    __slots__ = ('player_ids', 'names', 'rounds', 'trials', 'counts', 'clear_winners')
+
+    def __init__(self, player_ids, names, rounds, trials, counts, clear_winners):
+        self.player_ids = player_ids
+        self.names = names
+        self.rounds = rounds
+        self.trials = trials
+        self.counts = counts
+        self.clear_winners = clear_winners
+
+    def distribution(self, player_id):
+        """Returns a list of the player's probability of finishing in each
+        position, first place first."""
+        return [count / float(self.trials) for count in self.counts[player_id]]
+
+    def topProbability(self, player_id, top):
+        """Returns the player's probability of finishing in the top places."""
+        return sum(self.counts[player_id][:top]) / float(self.trials)
+
+    def clearWinnerProbability(self):
+        """Returns the probability that one player finishes alone on the
+        most wins, with no tiebreak needed for first place."""
+        return self.clear_winners / float(self.trials)
+
+
+def loadTournament(tournament_id):
+    """Reads the state of a tournament to simulate, in one session.
+
+    Returns:
+      A TournamentState.
+    """
+
+    handle, path = tempfile.mkstemp(suffix=".tdbs")
+    os.close(handle)
+
+    try:
+        with getBackend().session(read_only=True) as session:
+            session.exportTournament(tournament_id, path)
+            pairings = session.swissPairings(tournament_id)
+
+        snapshot = readSnapshot(path)
+    finally:
+        os.remove(path)
+
+    position = dict((player_id, i) for i, player_id in enumerate(snapshot.player_ids))
+    wins = [0] * len(position)
+    matches = [0] * len(position)
+
+    for player_id in snapshot.byes:
+        wins[position[player_id]] += 1
+        matches[position[player_id]] += 1
+
+    results = list(zip(snapshot.winners, snapshot.losers))
+    for winner, loser in results:
+        wins[position[winner]] += 1
+        matches[position[winner]] += 1
+        matches[position[loser]] += 1
+
+    # The pairings are the current round's while it has results to come, or
+    # those of the next round otherwise, which the first simulated round
+    # would pair the same way. Either way, pairings already played are left
+    # out.
+    played = set((min(pair), max(pair)) for pair in results)
+    pending = [(row[0], row[2]) for row in pairings
+               if (min(row[0], row[2]), max(row[0], row[2])) not in played]
+
+    # A player left out of the pairings already has the current round's bye,
+    # or, if they have not had one, will get the next round's.
+    had_bye = set(snapshot.byes)
+    paired = set(player_id for row in pairings for player_id in (row[0], row[2]))
+    unpaired = [player_id for player_id in snapshot.player_ids if player_id not in paired]
+    pending_bye = unpaired[0] if len(unpaired) == 1 and unpaired[0] not in had_bye else None
+
+    return TournamentState(snapshot.player_ids, snapshot.names, wins, matches,
+                           snapshot.ratings, results, pending, had_bye, pending_bye)
+
+
+def simulateTournament(tournament_id, rounds, trials=1000, draw_rate=0.0,
+                       processes=None, seed=None):
+    """Forecasts a tournament's final standings by playing out its remaining
+    rounds many times.
+
+    Args:
+      tournament_id: ID of the tournament to forecast
+      rounds: rounds still to be played, counting the current one if it
+        has started
+      trials: number of times the remaining rounds are played out
+      draw_rate: probability that a game is drawn
+      processes: number of worker processes; one per core if None, and
+        none besides this one if 1
+      seed: seed for the trials' random numbers, for a repeatable forecast
+
+    Returns:
+      A SimulationResult.
+    """
+
+    return simulateState(loadTournament(tournament_id), rounds, trials, draw_rate,
+                         processes, seed)
+
+
+def simulateState(state, rounds, trials=1000, draw_rate=0.0, processes=None, seed=None):
+    """Plays out a TournamentState's remaining rounds many times; see
+    simulateTournament()."""
+
+    rng = random.Random(seed)
+    tasks = [(rng.getrandbits(62), min(TRIALS_PER_TASK, trials - start), rounds, draw_rate)
+             for start in range(0, trials, TRIALS_PER_TASK)]
+
+    if processes == 1:
+        _initWorker(state)
+        outcomes = map(_playTask, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, _initWorker, (state,))
+        outcomes = pool.imap_unordered(_playTask, tasks)
+
+    count = len(state.player_ids)
+    positions = [array.array('l', [0]) * count for _ in range(count)]
+    clear_winners = 0
+
+    try:
+        for orders, clear in outcomes:
+            clear_winners += clear
+            for start in range(0, len(orders), count):
+                for place, i in enumerate(orders[start:start + count]):
+                    positions[i][place] += 1
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return SimulationResult(state.player_ids, state.names, rounds, trials,
+                            dict(zip(state.player_ids, positions)), clear_winners)
+
+
+def roundsForClearWinner(tournament_id, max_rounds, confidence=0.9, trials=1000,
+                         draw_rate=0.0, processes=None, seed=None):
+    """Finds how many more rounds a tournament needs to produce a clear winner.
+
+    Args:
+      tournament_id: ID of the tournament to forecast
+      max_rounds: most rounds to try
+      confidence: probability of a clear winner wanted, between 0 and 1
+      trials, draw_rate, processes, seed: as for simulateTournament()
+
+    Returns:
+      The fewest rounds, from 0 to max_rounds, after which one player
+      finishes alone on the most wins with at least the given probability,
+      or None if even max_rounds do not.
+    """
+
+    state = loadTournament(tournament_id)
+
+    for rounds in range(max_rounds + 1):
+        result = simulateState(state, rounds, trials, draw_rate, processes, seed)
+        if result.clearWinnerProbability() >= confidence:
+            return rounds
+
+    return None
+
+
+def _initWorker(state):
+    """Keeps the tournament state in a worker process for its tasks."""
+    global _state
+    _state = state
+
+
+def _playTask(task):
+    """Plays a batch of trials on the worker's state.
+
+    Args:
+      task: tuple of (seed, trials, rounds, draw_rate)
+
+    Returns:
+      A pair of an array holding each trial's finishing order, as positions
+      in the state's player_ids, one trial after another, and the number of
+      trials with a clear winner.
+    """
+
+    seed, trials, rounds, draw_rate = task
+    rng = random.Random(seed)
+    index = dict((player_id, i) for i, player_id in enumerate(_state.player_ids))
+
+    orders = array.array('i')
+    clear_winners = 0
+    for _ in range(trials):
+        standings = _playTrial(_state, rounds, draw_rate, rng)
+        orders.extend(index[row[0]] for row in standings)
+        if len(standings) < 2 or standings[0][2] > standings[1][2]:
+            clear_winners += 1
+
+    return orders, clear_winners
+
+
+def _playTrial(state, rounds, draw_rate, rng):
+    """Plays out the remaining rounds once.
+
+    Returns:
+      The final (id, name, wins, matches) standings in rank order.
+    """
+
+    player_ids = state.player_ids
+    names = dict(zip(player_ids, state.names))
+    wins = dict(zip(player_ids, state.wins))
+    matches = dict(zip(player_ids, state.matches))
+    ratings = dict(zip(player_ids, state.ratings))
+    results = list(state.results)
+
+    had_bye = set(state.had_bye)
+
+    opponents = dict((player_id, set()) for player_id in player_ids)
+    for winner, loser in results:
+        opponents[winner].add(loser)
+        opponents[loser].add(winner)
+
+    pairs, bye = state.pending, state.pending_bye
+    for round_number in range(rounds):
+        if round_number > 0 or pairs is None:
+            pairings, bye = pairRound(
+                _rank(player_ids, names, wins, matches, ratings, results), opponents, had_bye)
+            pairs = [(row[0], row[2]) for row in pairings]
+
+        if bye is not None:
+            wins[bye] += 1
+            matches[bye] += 1
+            had_bye.add(bye)
+
+        for a, b in pairs:
+            roll = rng.random()
+            if roll < draw_rate:
+                ratings[a], ratings[b] = updateRatings(ratings[a], ratings[b], 0.5)
+                continue
+
+            if roll - draw_rate < (1 - draw_rate) * expectedScore(ratings[a], ratings[b]):
+                winner, loser = a, b
+            else:
+                winner, loser = b, a
+
+            wins[winner] += 1
+            matches[winner] += 1
+            matches[loser] += 1
+            results.append((winner, loser))
+            opponents[winner].add(loser)
+            opponents[loser].add(winner)
+            ratings[winner], ratings[loser] = updateRatings(ratings[winner], ratings[loser], 1)
+
+    return _rank(player_ids, names, wins, matches, ratings, results)
+
+
+def _rank(player_ids, names, wins, matches, ratings, results):
+    """Returns standings rows ranked as playerStandings() ranks them."""
+    return rankStandings([(player_id, names[player_id], wins[player_id], matches[player_id])
+                          for player_id in player_ids],
+                         results, [ratings[player_id] for player_id in player_ids])
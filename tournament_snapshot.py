@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+#
+# tournament_snapshot.py -- compact binary snapshots of a tournament's state
+#
+# A snapshot holds a tournament's players, matches, draws and byes as flat
+# arrays of numbers, so it can be written and read back without going through
+# the API one call at a time. The file layout (version 2, little-endian) is:
+#
+#   header        32 bytes: magic "TDBS", version (uint16), reserved
+#                 (uint16), tournament ID (int32) and the number of players,
+#                 matches, draws and byes and the size of the names (uint32
+#                 each)
+#   seed_ratings  float64 per player
+#   ratings       float64 per player
+#   player_ids    int32 per player, ascending
+#   name_offsets  uint32 per player plus one; player i's name is
+#                 names[name_offsets[i]:name_offsets[i + 1]]
+#   winners       int32 per match
+#   losers        int32 per match
+#   draws1        int32 per draw, the first player's ID
+#   draws2        int32 per draw, the second player's ID
+#   byes          int32 per bye, the ID of the player holding it
+#   names         the players' names in UTF-8, back to back
+#
+# Every array starts on a boundary of its own item size, so a memory-mapped
+# file can be read in place, e.g. with numpy.frombuffer.
+#
+# Version 1 files, written before ratings and draws were kept, have a 36-byte
+# header without the number of draws (and 8 bytes of padding instead) and
+# none of the ratings or draws arrays. They can still be read.
+#
+
+import array
+import mmap
+import struct
+import sys
+
+from tournament_ratings import INITIAL_RATING
+
+SNAPSHOT_MAGIC = b"TDBS"
+SNAPSHOT_VERSION = 2
+
+_HEADER = struct.Struct("<4sHHiIIIII")
+_HEADER_V1 = struct.Struct("<4sHHiIIII8x")
+
+# Item type and size of each array in the file, in order.
+_ARRAYS = (('seed_ratings', 'd', 8), ('ratings', 'd', 8), ('player_ids', 'i', 4),
+           ('name_offsets', 'I', 4), ('winners', 'i', 4), ('losers', 'i', 4),
+           ('draws1', 'i', 4), ('draws2', 'i', 4), ('byes', 'i', 4))
+
+
+class TournamentSnapshot(object):
+    """A tournament's players, matches, draws and byes, held in arrays.
+
+    Args:
+      tournament_id: ID of the tournament the snapshot was taken from
+      player_ids: the players' IDs, ascending
+      names: the players' names, in the same order as player_ids
+      winners: winner ID of each match
+      losers: loser ID of each match, in the same order as winners
+      byes: ID of the player holding each bye
+      seed_ratings: the players' seed ratings, in the same order as
+        player_ids; INITIAL_RATING for everyone if None
+      ratings: the players' current ratings, in the same order as
+        player_ids, or None if not known
+      draws1: first player's ID of each draw
+      draws2: second player's ID of each draw, in the same order as draws1
+    """
+
+    __slots__ = ('tournament_id', 'player_ids', 'names', 'winners', 'losers', 'byes',
+                 'seed_ratings', 'ratings', 'draws1', 'draws2')
+
+    def __init__(self, tournament_id, player_ids, names, winners, losers, byes,
+                 seed_ratings=None, ratings=None, draws1=(), draws2=()):
+        self.tournament_id = tournament_id
+        self.player_ids = array.array('i', player_ids)
+        self.names = list(names)
+        self.winners = array.array('i', winners)
+        self.losers = array.array('i', losers)
+        self.byes = array.array('i', byes)
+        self.seed_ratings = array.array('d', seed_ratings if seed_ratings is not None
+                                        else [INITIAL_RATING] * len(self.player_ids))
+        self.ratings = array.array('d', ratings) if ratings is not None else None
+        self.draws1 = array.array('i', draws1)
+        self.draws2 = array.array('i', draws2)
+
+
+def writeSnapshot(path, snapshot):
+    """Writes a TournamentSnapshot to a file in the format described above."""
+
+    encoded = [name if isinstance(name, bytes) else name.encode("utf-8")
+               for name in snapshot.names]
+
+    name_offsets = array.array('I', [0])
+    for name in encoded:
+        name_offsets.append(name_offsets[-1] + len(name))
+
+    arrays = {
+        'name_offsets': name_offsets,
+        # Without known ratings, the players are taken to be at their seeds.
+        'ratings': snapshot.ratings if snapshot.ratings is not None
+        else snapshot.seed_ratings,
+    }
+
+    header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0,
+                          snapshot.tournament_id, len(snapshot.player_ids),
+                          len(snapshot.winners), len(snapshot.draws1),
+                          len(snapshot.byes), name_offsets[-1])
+
+    with open(path, "wb") as snapshot_file:
+        snapshot_file.write(header)
+        for name, _, _ in _ARRAYS:
+            snapshot_file.write(_toBytes(arrays[name] if name in arrays
+                                         else getattr(snapshot, name)))
+        snapshot_file.write(b"".join(encoded))
+
+
+def readSnapshot(path):
+    """Reads a TournamentSnapshot from a file written by writeSnapshot().
+
+    The file is memory-mapped rather than read through a buffer, and each
+    array is copied out of the mapping in one piece.
+
+    Raises:
+      ValueError: if the file is not a snapshot, or a version this module
+        cannot read
+    """
+
+    with open(path, "rb") as snapshot_file:
+        header = snapshot_file.read(_HEADER_V1.size)
+        if len(header) < _HEADER.size or header[:4] != SNAPSHOT_MAGIC:
+            raise ValueError("{} is not a tournament snapshot.".format(path))
+
+        version = struct.unpack("<H", header[4:6])[0]
+        if version == SNAPSHOT_VERSION:
+            _, _, _, tournament_id, players, matches, draws, byes, names_size = \
+                _HEADER.unpack(header[:_HEADER.size])
+            header_size = _HEADER.size
+            stored = _ARRAYS
+        elif version == 1 and len(header) == _HEADER_V1.size:
+            _, _, _, tournament_id, players, matches, byes, names_size = \
+                _HEADER_V1.unpack(header)
+            draws = 0
+            header_size = _HEADER_V1.size
+            stored = [item for item in _ARRAYS
+                      if item[0] not in ('seed_ratings', 'ratings', 'draws1', 'draws2')]
+        else:
+            raise ValueError("Tournament snapshot version {} is not supported."
+                             .format(version))
+
+        data = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    counts = {'seed_ratings': players, 'ratings': players, 'player_ids': players,
+              'name_offsets': players + 1, 'winners': matches, 'losers': matches,
+              'draws1': draws, 'draws2': draws, 'byes': byes}
+
+    try:
+        if len(data) != header_size + names_size + \
+                sum(size * counts[name] for name, _, size in stored):
+            raise ValueError("Tournament snapshot {} is truncated.".format(path))
+
+        arrays = {}
+        start = header_size
+        for name, typecode, size in stored:
+            end = start + size * counts[name]
+            arrays[name] = _fromBytes(typecode, data[start:end])
+            start = end
+
+        blob = data[start:start + names_size]
+    finally:
+        data.close()
+
+    name_offsets = arrays['name_offsets']
+    names = [blob[name_offsets[i]:name_offsets[i + 1]] for i in range(players)]
+    if str is not bytes:
+        names = [name.decode("utf-8") for name in names]
+
+    return TournamentSnapshot(tournament_id, arrays['player_ids'], names,
+                              arrays['winners'], arrays['losers'], arrays['byes'],
+                              arrays.get('seed_ratings'), arrays.get('ratings'),
+                              arrays.get('draws1', ()), arrays.get('draws2', ()))
+
+
+def _toBytes(values):
+    """Returns an array's contents as little-endian bytes."""
+    if sys.byteorder == "big":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+
+    return values.tobytes() if hasattr(values, "tobytes") else values.tostring()
+
+
+def _fromBytes(typecode, data):
+    """Returns an array of the given type decoded from little-endian bytes."""
+    values = array.array(typecode)
+    if hasattr(values, "frombytes"):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+
+    if sys.byteorder == "big":
+        values.byteswap()
+
+    return values
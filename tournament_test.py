@@ -2,7 +2,10 @@
 #
 # Test cases for tournament.py
 
+import sys
+
 from tournament import *
+from tournament_memory import MemoryBackend
 
 def testDeleteMatches():
     deleteMatches()
@@ -126,6 +129,10 @@ def testPairings():
 
 
 if __name__ == '__main__':
+    # Run with --memory to test the in-memory backend instead of PostgreSQL.
+    if "--memory" in sys.argv:
+        setBackend(MemoryBackend())
+
     testDeleteMatches()
     testDelete()
     testCount()
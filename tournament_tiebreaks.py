@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# tournament_tiebreaks.py -- opponent-strength tiebreaks for Swiss standings
+#
+# Players level on wins and matches are separated, in order, by:
+#
+#   OMW%              average match-win percentage of a player's opponents,
+#                     each counted as at least 1/3 so that one weak opponent
+#                     does not sink it
+#   Buchholz          sum of the opponents' wins
+#   median-Buchholz   Buchholz without the best and worst opponent (when there
+#                     are at least three)
+#   Sonneborn-Berger  sum of the wins of the opponents the player beat
+#
+# Byes count towards a player's own wins but are not opponents.
+#
+
+import operator
+
+from tournament_columns import StandingsColumns, column
+
+# Lowest match-win percentage an opponent counts for in OMW%.
+MIN_MATCH_WIN_PERCENTAGE = 1.0 / 3
+
+# OMW% is rounded to this many decimal places, so that players whose
+# opponents are equally strong tie exactly, whatever order the matches were
+# loaded in.
+OMW_PRECISION = 9
+
+
+def computeTiebreaks(standings, results):
+    """Computes every player's tiebreaks from a tournament's match results.
+
+    The results are loaded once into a sparse opponent matrix held in flat
+    lists (compressed sparse rows): the opponents of the player at standings
+    position i are neighbors[offsets[i]:offsets[i + 1]], and beat[k] records
+    whether they won the match against neighbors[k]. The tiebreaks then take
+    a few passes over those lists, so the cost grows with the number of
+    players plus matches.
+
+    Args:
+      standings: sequence of (id, name, wins, matches) rows, or a
+        StandingsColumns
+      results: iterable of (winner id, loser id) pairs for the tournament
+
+    Returns:
+      A list with an (omw, buchholz, median_buchholz, sonneborn_berger)
+      tuple for each row of standings, in the same order.
+    """
+
+    count = len(standings)
+    position = dict((player_id, i) for i, player_id in enumerate(column(standings, 'ids')))
+
+    wins = column(standings, 'wins')
+    match_win = [max(float(player_wins) / player_matches, MIN_MATCH_WIN_PERCENTAGE)
+                 if player_matches else MIN_MATCH_WIN_PERCENTAGE
+                 for player_wins, player_matches in zip(wins, column(standings, 'matches'))]
+
+    # Matches as pairs of standings positions; results for players missing
+    # from standings are ignored.
+    winners = []
+    losers = []
+    for winner, loser in results:
+        if winner in position and loser in position:
+            winners.append(position[winner])
+            losers.append(position[loser])
+
+    offsets = [0] * (count + 1)
+    for i in winners:
+        offsets[i + 1] += 1
+    for i in losers:
+        offsets[i + 1] += 1
+    for i in range(count):
+        offsets[i + 1] += offsets[i]
+
+    neighbors = [0] * offsets[count]
+    beat = [0] * offsets[count]
+    filled = offsets[:count]
+    for winner, loser in zip(winners, losers):
+        neighbors[filled[winner]] = loser
+        beat[filled[winner]] = 1
+        filled[winner] += 1
+        neighbors[filled[loser]] = winner
+        filled[loser] += 1
+
+    # Per-match columns: each opponent's wins and match-win percentage, and
+    # their wins again where the player beat them. Each is one pass over the
+    # whole list; the per-player sums below are builtins over slices.
+    opponent_wins = list(map(wins.__getitem__, neighbors))
+    opponent_match_win = list(map(match_win.__getitem__, neighbors))
+    beaten_wins = list(map(operator.mul, opponent_wins, beat))
+
+    tiebreaks = []
+    for i in range(count):
+        start, end = offsets[i], offsets[i + 1]
+        if start == end:
+            tiebreaks.append((0.0, 0, 0, 0))
+            continue
+
+        played = opponent_wins[start:end]
+        buchholz = sum(played)
+        median_buchholz = buchholz - max(played) - min(played) \
+            if end - start >= 3 else buchholz
+
+        tiebreaks.append((round(sum(opponent_match_win[start:end]) / (end - start),
+                                OMW_PRECISION),
+                          buchholz, median_buchholz, sum(beaten_wins[start:end])))
+
+    return tiebreaks
+
+
+def rankStandings(standings, results, ratings=None):
+    """Sorts standings by wins, then matches played, then tiebreaks.
+
+    Players level on wins are ordered by fewest matches first, as in the
+    database, then by OMW%, Buchholz, median-Buchholz and Sonneborn-Berger
+    (highest first), then by rating (highest first) if ratings are given,
+    and finally by lowest player ID. Before any results are in, this seeds
+    the field by rating.
+
+    Args:
+      standings: sequence of (id, name, wins, matches) rows, in any order,
+        or a StandingsColumns
+      results: iterable of (winner id, loser id) pairs for the tournament
+      ratings: sequence of the players' ratings, in the same order as
+        standings, or None to use the ratings of a StandingsColumns that
+        holds them
+
+    Returns:
+      A new list of the standings rows in rank order, or a new
+      StandingsColumns if standings is one.
+    """
+
+    columnar = isinstance(standings, StandingsColumns)
+    tiebreaks = computeTiebreaks(standings, results)
+    if ratings is None:
+        ratings = standings.ratings if columnar else None
+    if ratings is None:
+        ratings = [0] * len(standings)
+
+    keys = [(-wins, matches, -omw, -buchholz, -median_buchholz, -sonneborn_berger,
+             -rating, player_id)
+            for player_id, wins, matches,
+            (omw, buchholz, median_buchholz, sonneborn_berger), rating
+            in zip(column(standings, 'ids'), column(standings, 'wins'),
+                   column(standings, 'matches'), tiebreaks, ratings)]
+
+    order = sorted(range(len(standings)), key=keys.__getitem__)
+    if columnar:
+        return standings.take(order)
+
+    return [standings[i] for i in order]